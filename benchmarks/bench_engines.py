@@ -0,0 +1,54 @@
+"""
+Compares the 'line' and 'ast' engines on a generated project: throughput (files and lines
+per second) and accuracy (precision/recall of reported lines against the lines that really
+use the library).
+
+Usage (from the top of the repo)::
+    $ PYTHONPATH=. python benchmarks/bench_engines.py [--files 200] [--lines 200] [--repeat 3]
+"""
+import argparse
+import shutil, tempfile
+import time
+
+from thaw import thaw
+
+from synthetic import write_project
+
+LIBRARY = 'numpy'
+
+def score(results,truth):
+    reported = 0
+    correct = 0
+    for filepath, used in truth.items():
+        found = set(results[filepath][LIBRARY]['linenums'])
+        reported += len(found)
+        correct += len(found & used[LIBRARY])
+    expected = sum(len(used[LIBRARY]) for used in truth.values())
+    return correct / reported if reported else 1.0, correct / expected if expected else 1.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thaw's line and ast engines.")
+    parser.add_argument('--files',type=int,default=200)
+    parser.add_argument('--lines',type=int,default=200)
+    parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp('thaw_bench')
+    try:
+        truth = write_project(directory,args.files,args.lines,[LIBRARY])
+        total_lines = args.files * args.lines
+        print(f"{'engine':<8} | {'files/s':>10} | {'lines/s':>12} | {'precision':>9} | {'recall':>6}")
+        for engine, functions in thaw.ENGINES.items():
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = {filepath: functions['libraries'](filepath,[LIBRARY]) for filepath in truth}
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best,elapsed)
+            precision, recall = score(results,truth)
+            print(f"{engine:<8} | {args.files / best:>10.0f} | {total_lines / best:>12.0f} | {precision:>9.3f} | {recall:>6.3f}")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
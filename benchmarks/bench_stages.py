@@ -0,0 +1,100 @@
+"""
+Times each stage of a thaw run on its own against a generated project and a local fake
+package index, and prints the results as JSON so they can be compared across releases:
+
+    walk      => index_project (finding .py files and local modules)
+    imports   => search_directory_for_imports (check_file_for_imports on every file)
+    libraries => search_directory_for_libraries (check_file_for_libraries on every file)
+    lookups   => resolve_libraries against the fake index with no cache
+    report    => writing the scan as a verbose text report and as json
+
+Usage (from the top of the repo)::
+    $ PYTHONPATH=. python benchmarks/bench_stages.py [--files 500] [--lines 200] [--libraries 4]
+          [--import-density 0.5] [--alias-chain 2] [--engine line] [--jobs 1] [--repeat 3]
+          [--latency 0] [--output results.json]
+"""
+import argparse
+from io import StringIO
+import json
+import platform
+import shutil, tempfile
+import statistics
+import sys
+import time
+
+from thaw import thaw
+
+from fake_index import FakeIndex
+from synthetic import library_names, project_size, write_project
+
+def time_stage(function,repeat):
+    '''
+    runs function repeat times and returns ({'best','mean','runs'} in seconds, last result)
+    '''
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start)
+    return {'best':min(runs),'mean':statistics.mean(runs),'runs':runs}, result
+
+def write_report(scan,report_format):
+    writer = thaw.ReportWriter(stdout=StringIO(),report_format=report_format)
+    scan.write(writer,report_format,True)
+    writer.close()
+
+def run(args):
+    libraries = library_names(args.libraries)
+    directory = tempfile.mkdtemp('thaw_bench')
+    try:
+        write_project(directory,args.files,args.lines,libraries,args.import_density,args.alias_chain)
+        files, lines, size = project_size(directory)
+        stages = {}
+        stages['walk'], project = time_stage(lambda: thaw.index_project(directory),args.repeat)
+        filepaths = project['files']
+        stages['imports'], imports = time_stage(lambda: thaw.search_directory_for_imports(directory,args.jobs,filepaths,engine=args.engine),args.repeat)
+        stages['libraries'], affected = time_stage(lambda: thaw.search_directory_for_libraries(directory,libraries,args.jobs,filepaths,engine=args.engine),args.repeat)
+        with FakeIndex({library: '1.0.0' for library in libraries},args.latency) as index:
+            stages['lookups'], resolved = time_stage(lambda: thaw.resolve_libraries(libraries,directory,index.url,local_modules=project['modules']),args.repeat)
+            requests = index.requests
+        records = [{'library':library,'source':resolved[library]['source'],'affected':affected[library]} for library in libraries]
+        scan = thaw.Scan('imports',directory,records)
+        stages['report'], _ = time_stage(lambda: write_report(scan,'text'),args.repeat)
+        stages['report_json'], _ = time_stage(lambda: write_report(scan,'json'),args.repeat)
+        return {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': vars(args),
+            'project': {'files':files,'lines':lines,'bytes':size,'imports':len(set(imports)),'hits':sum(len(hits['lines']) for found in affected.values() for hits in found)},
+            'index_requests': requests,
+            'stages': stages,
+        }
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of thaw on a generated project.")
+    parser.add_argument('--files',type=int,default=500)
+    parser.add_argument('--lines',type=int,default=200)
+    parser.add_argument('--libraries',type=int,default=4,help="Number of libraries the project uses.")
+    parser.add_argument('--import-density',type=float,default=0.5,help="Chance that a module imports each library.")
+    parser.add_argument('--alias-chain',type=int,default=2,help="How many variables a library object can be passed along.")
+    parser.add_argument('--engine',choices=sorted(thaw.ENGINES),default='line')
+    parser.add_argument('--jobs',type=int,default=1)
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--latency',type=float,default=0.0,help="Seconds the fake index waits before each response.")
+    parser.add_argument('--output',help="Write results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+    else:
+        json.dump(results,sys.stdout,indent=2)
+        sys.stdout.write('\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+A local stand-in for PyPI's JSON API, so benchmarks measure thaw rather than the network.
+Serves /pypi/<name>/json for the packages it's given (404 for everything else), optionally
+waiting `latency` seconds before each response.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+class FakeIndexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'pypi' and parts[2] == 'json' and parts[1] in self.server.packages:
+            version = self.server.packages[parts[1]]
+            body = json.dumps({'info':{'name':parts[1],'version':version},'releases':{version:[]}}).encode('utf-8')
+            self.send_response(200)
+        else:
+            body = b'Not Found'
+            self.send_response(404)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+class FakeIndex:
+    '''
+    with FakeIndex({'numpy':'1.19.1'}) as index:
+        ... thaw.resolve_libraries(libraries, directory, index.url) ...
+    '''
+    def __init__(self,packages,latency=0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),FakeIndexHandler)
+        self.server.packages = dict(packages)
+        self.server.latency = latency
+        self.server.requests = 0
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever,kwargs={'poll_interval':0.05},daemon=True)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,116 @@
+"""
+Generates synthetic projects for the benchmarks: packages of python modules that import a
+mix of libraries (under aliases, some as optional imports with a fallback), use them, pass
+them along chains of variables, annotate with them, and mention them in places that aren't
+uses, plus a requirements.txt pinning every library.
+"""
+import os
+import random
+
+# library name => (alias it's imported as, function called on it)
+LIBRARIES = {
+    'numpy': ('np', 'zeros'),
+    'pandas': ('pd', 'DataFrame'),
+    'requests': ('rq', 'get'),
+    'yaml': ('yml', 'safe_load'),
+    'idna': ('idn', 'encode'),
+    'click': ('ck', 'command'),
+    'attr': ('at', 'ib'),
+    'six': ('sx', 'moves'),
+}
+
+def library_names(count):
+    names = list(LIBRARIES)
+    return names[:count]
+
+def write_module(filepath,libraries,lines,rng,import_density=1.0,alias_chain=1):
+    '''
+    writes one module of roughly `lines` lines and returns {library : set of line numbers
+    that really use it}. Each library is imported with probability import_density;
+    variables made from a library can be passed on through up to alias_chain more variables.
+    '''
+    imported = [library for library in libraries if rng.random() < import_density]
+    text = []
+    for library in imported:
+        alias = LIBRARIES[library][0]
+        if rng.random() < 0.3:
+            text += ['try:', f"    import {library} as {alias}", 'except ImportError:', f"    {alias} = None"]
+        else:
+            text.append(f"import {library} as {alias}")
+    text.append('import os')
+    text.append('')
+    used = {library: set() for library in libraries}
+    variables = {library: [] for library in imported}
+    while len(text) < lines:
+        kind = rng.random()
+        if imported and kind < 0.15:
+            library = rng.choice(imported)
+            alias, function = LIBRARIES[library]
+            name = f"{alias}_v{len(text)}"
+            variables[library].append((name,0))
+            text.append(f"{name} = {alias}.{function}({rng.randint(1,9)})")
+            used[library].add(len(text))
+        elif imported and kind < 0.25:
+            library = rng.choice(imported)
+            chain = [(name,depth) for name, depth in variables[library] if depth < alias_chain]
+            if chain:
+                source, depth = rng.choice(chain)
+                name = f"link{len(text)}"
+                variables[library].append((name,depth + 1))
+                text.append(f"{name} = {source}")
+                used[library].add(len(text))
+        elif imported and kind < 0.35:
+            library = rng.choice(imported)
+            if variables[library]:
+                text.append(f"print({rng.choice(variables[library])[0]})")
+                used[library].add(len(text))
+        elif imported and kind < 0.42:
+            # decoys: the alias shows up, but not as a use of the library
+            alias = LIBRARIES[rng.choice(imported)][0]
+            text.append(rng.choice([f'label = "{alias} is short for a library"', f'settings.{alias} = 4', f'{alias}_count = 2 # {alias}']))
+        elif imported and kind < 0.45:
+            library = rng.choice(imported)
+            alias, function = LIBRARIES[library]
+            text.append(f"hint{len(text)}: {alias}.{function} = None")
+            used[library].add(len(text))
+        else:
+            text.append(f"value{len(text)} = os.path.join('a', 'b')")
+    with open(filepath,'w') as f:
+        f.write('\n'.join(text) + '\n')
+    return used
+
+def write_project(directory,files,lines,libraries=('numpy',),import_density=1.0,alias_chain=1,files_per_package=50,seed=0):
+    '''
+    writes `files` modules of roughly `lines` lines each into packages of files_per_package
+    modules under directory, plus a requirements.txt pinning each library to 0.1.0, and returns
+    {filepath : {library : set of line numbers that really use the library}}
+    '''
+    rng = random.Random(seed)
+    truth = {}
+    for n in range(files):
+        package = os.path.join(directory,f"package{n // files_per_package}")
+        if n % files_per_package == 0:
+            os.makedirs(package,exist_ok=True)
+            with open(os.path.join(package,'__init__.py'),'w') as f:
+                f.write('')
+        filepath = os.path.join(package,f"module{n}.py")
+        truth[filepath] = write_module(filepath,libraries,lines,rng,import_density,alias_chain)
+    with open(os.path.join(directory,'requirements.txt'),'w') as f:
+        for library in libraries:
+            f.write(f"{library}==0.1.0\n")
+    return truth
+
+def project_size(directory):
+    '''
+    returns (number of .py files, total lines, total bytes) under directory
+    '''
+    files = lines = size = 0
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith('.py'):
+                with open(os.path.join(root,filename),'rb') as f:
+                    data = f.read()
+                files += 1
+                lines += data.count(b'\n')
+                size += len(data)
+    return files, lines, size
@@ -24,7 +24,8 @@ setuptools.setup(
     keywords="thaw update freeze pip requirements library manage package development project",
     entry_points={
         'console_scripts': [
-            'thaw = thaw.thaw:main'
+            'thaw = thaw.thaw:main',
+            'thaw-batch = thaw.thaw:batch_main'
         ]
     },
 )
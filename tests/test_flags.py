@@ -1,8 +1,10 @@
 import argparse
 import fnmatch
 from io import StringIO
+import json
 import os
 import pathlib
+import pstats
 import shutil, tempfile
 import unittest
 from unittest import mock
@@ -15,6 +17,12 @@ class ThawTests(unittest.TestCase):
     
     def setUpTempDirectory(self):
         self.test_dir = tempfile.mkdtemp('example')
+        # keep main() and Scanner away from the real user cache
+        self.cache_dir = tempfile.mkdtemp('cache')
+        self.addCleanup(shutil.rmtree,self.cache_dir,True)
+        cache_env = mock.patch.dict(os.environ,{'THAW_CACHE_DIR':self.cache_dir})
+        cache_env.start()
+        self.addCleanup(cache_env.stop)
         
     def createTempDotPyFile(self,text,name='temp'):
         with open(os.path.join(self.test_dir,f"{name}.py"), 'w') as f:
@@ -222,6 +230,117 @@ class ThawTests(unittest.TestCase):
         self.tearDownTempDirectory
         
         
+    def testFlagJobsGivesSameReportAsSingleProcess(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        reports = []
+        for jobs in [1,4]:
+            @mock.patch('argparse.ArgumentParser.parse_args',
+                        return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=True,library=['numpy','idna'],imports=False,jobs=jobs))
+            def runThawWithMockArgs(mock_args):
+                with mock.patch('sys.stdout',new=StringIO()) as mock_out, mock.patch.object(thaw,'MIN_FILES_PER_JOB',1):
+                    thaw.main()
+                    reports.append(mock_out.getvalue())
+            runThawWithMockArgs()
+        self.assertEqual(reports[0],reports[1])
+        self.assertTrue('numpy' in reports[0] and 'idna' in reports[0])
+        self.tearDownTempDirectory()
+    
+    def testFlagEngineAst(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=True,library=['numpy'],imports=False,engine='ast'))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                report = mock_out.getvalue()
+                self.assertTrue('a = np.arange(15).reshape(3, 5)' in report and 'print(a)' in report)
+        runThawWithMockArgs()
+        self.tearDownTempDirectory()
+    
+    def testFlagFormatJson(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=True,library=['numpy'],imports=False,format='json'))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                report = json.loads(mock_out.getvalue())
+                self.assertEqual(report['mode'],'library')
+                self.assertEqual(report['libraries'],[{'library':'numpy','files_affected':1,'files':[
+                    {'file':'major.py','lines':[3,4],'linestext':['a = np.arange(15).reshape(3, 5)\n','print(a)']}]}])
+        runThawWithMockArgs()
+        self.tearDownTempDirectory()
+    
+    def testFlagFormatJsonLines(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=['numpy','idna'],imports=False,format='jsonl'))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                records = [json.loads(line) for line in mock_out.getvalue().splitlines()]
+                self.assertEqual(records,[
+                    {'type':'library','library':'numpy','files_affected':1},
+                    {'type':'file','library':'numpy','file':'major.py','lines':[3,4]},
+                    {'type':'library','library':'idna','files_affected':1},
+                    {'type':'file','library':'idna','file':'minor.py','lines':[3,4]},
+                ])
+        runThawWithMockArgs()
+        self.tearDownTempDirectory()
+    
+    def testFlagFormatJsonMessages(self):
+        self.setUpTempDirectory()
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=None,imports=False,format='json'))
+        def runThawWithoutRequirements(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                self.assertTrue(json.loads(mock_out.getvalue())['message'].startswith('No requirements file found'))
+        runThawWithoutRequirements()
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=['numpy'],imports=True,format='jsonl'))
+        def runThawWithConflictingFlags(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                records = [json.loads(line) for line in mock_out.getvalue().splitlines()]
+                self.assertEqual([record['type'] for record in records],['message'])
+                self.assertTrue(records[0]['message'].startswith('--library and --imports flags cannot be used'))
+        runThawWithConflictingFlags()
+        self.tearDownTempDirectory()
+    
+    def testFlagStats(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=['numpy'],imports=False,jobs=1,stats=True))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out, mock.patch('sys.stderr',new=StringIO()) as mock_err:
+                thaw.main()
+                self.assertTrue('numpy' in mock_out.getvalue() and 'seconds' not in mock_out.getvalue())
+                rows = {line.split('|')[0].strip(): [cell.strip() for cell in line.split('|')[1:]] for line in mock_err.getvalue().splitlines()}
+                self.assertEqual(list(rows),['phase','load','walk','scan','save','report','total'])
+                self.assertEqual(rows['scan'][1],str(len(thaw.list_python_files(self.test_dir))))
+        runThawWithMockArgs()
+        self.tearDownTempDirectory()
+    
+    def testFlagProfile(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        profile_path = os.path.join(self.test_dir,'thaw.prof')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=['numpy'],imports=False,jobs=1,profile=profile_path))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()):
+                thaw.main()
+        runThawWithMockArgs()
+        functions = [function[2] for function in pstats.Stats(profile_path).stats]
+        self.assertTrue('search_directory_for_libraries' in functions)
+        self.tearDownTempDirectory()
+    
     def testDirectorySameAsRunLocation(self):
         self.setUpTempDirectory()
         self.createTempRequirementsDotTxt('all')
@@ -0,0 +1,499 @@
+import argparse
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+import json
+import os
+import shutil, tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from thaw import thaw
+
+class FakeIndexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.clients.add(self.client_address)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        parts = self.path.strip('/').split('/')
+        if self.server.errors:
+            self.server.errors -= 1
+            body = b'Service Unavailable'
+            self.send_response(503)
+        elif len(parts) == 3 and parts[0] == 'pypi' and parts[2] == 'json' and parts[1] in self.server.packages:
+            version = self.server.packages[parts[1]]
+            releases = {release:[{'filename':f"{parts[1]}-{release}.tar.gz",'yanked':release in self.server.yanked}] for release in self.server.releases.get(parts[1],[version])}
+            body = json.dumps({'info':{'name':parts[1],'version':version},'releases':releases}).encode('utf-8')
+            self.send_response(200)
+        elif len(parts) == 2 and parts[0] == 'simple' and parts[1] in self.server.packages:
+            version = self.server.packages[parts[1]]
+            body = f'<html><body><a href="../../files/{parts[1]}-{version}.tar.gz#sha256=00">{parts[1]}-{version}.tar.gz</a>\n<a href="../../files/{parts[1]}-99.0.tar.gz" data-yanked="">{parts[1]}-99.0.tar.gz</a></body></html>'.encode('utf-8')
+            self.send_response(200)
+        else:
+            body = b'Not Found'
+            self.send_response(404)
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding','gzip')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+class IndexTests(unittest.TestCase):
+    # SETUP METHODS ----------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),FakeIndexHandler)
+        self.server.packages = {'numpy':'1.19.1','pandas':'1.1.0','idna':'2.10'}
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.delay = 0
+        self.server.errors = 0
+        self.server.releases = {}
+        self.server.yanked = set()
+        self.index_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever,kwargs={'poll_interval':0.05},daemon=True)
+        self.thread.start()
+        self.test_dir = tempfile.mkdtemp('example')
+        self.cache_env = mock.patch.dict(os.environ,{'THAW_CACHE_DIR':self.test_dir})
+        self.cache_env.start()
+
+    def tearDown(self):
+        self.cache_env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        thaw.close_connection('http',self.index_url[len('http://'):])
+        shutil.rmtree(self.test_dir)
+
+
+    # INDEX LOOKUP TESTS -----------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def testFetchLibraryMetadataFound(self):
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url),{'source':'pypi','version':'1.19.1'})
+
+    def testFetchLibraryMetadataNotFound(self):
+        self.assertEqual(thaw.fetch_library_metadata('notapackage',self.index_url),{'source':'other','version':None})
+
+    def testFetchLibraryMetadataUnreachableIndex(self):
+        self.assertEqual(thaw.fetch_library_metadata('numpy','http://127.0.0.1:1'),{'source':'unknown','version':None})
+
+    def testFetchLibraryMetadataWithoutVersion(self):
+        self.server.packages['broken'] = ''
+        self.assertEqual(thaw.fetch_library_metadata('broken',self.index_url),{'source':'pypi','version':None})
+
+    def testGetLatestVersion(self):
+        self.assertEqual(thaw.get_latest_version('pandas',self.index_url),'1.1.0')
+
+    def testGetLatestVersionRaisesForMissingLibrary(self):
+        self.assertRaises(thaw.WrongAssumptionError,thaw.get_latest_version,'notapackage',self.index_url)
+
+    def testGetLibrarySourceUsesIndex(self):
+        self.assertEqual(thaw.get_library_source('idna',self.test_dir,self.index_url),'pypi')
+        self.assertEqual(thaw.get_library_source('notapackage',self.test_dir,self.index_url),'other')
+
+    def testFetchUrlAcceptsGzip(self):
+        status, body = thaw.fetch_url(f"{self.index_url}/pypi/numpy/json")
+        self.assertEqual(json.loads(body)['info']['version'],'1.19.1')
+
+    def testFetchLibraryMetadataSkipsReleasesUnlessAsked(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        thaw.fetch_library_metadata('numpy',self.index_url,cache)
+        self.assertNotIn('versions',cache.get(self.index_url,'numpy'))
+
+    def testFetchUrlReusesConnection(self):
+        for library in ['numpy','pandas','idna']:
+            thaw.fetch_url(f"{self.index_url}/pypi/{library}/json")
+        self.assertEqual(len(self.server.requests),3)
+        self.assertEqual(len(self.server.clients),1)
+
+    def testResolveLibrariesLooksUpEachLibraryOnce(self):
+        with open(os.path.join(self.test_dir,'helpers.py'),'w') as f:
+            f.write('x = 1')
+        resolved = thaw.resolve_libraries(['numpy','pandas','numpy','helpers','notapackage','pandas'],self.test_dir,self.index_url,4)
+        self.assertEqual(resolved,{
+            'numpy':{'source':'pypi','version':'1.19.1'},
+            'pandas':{'source':'pypi','version':'1.1.0'},
+            'helpers':{'source':'local','version':None},
+            'notapackage':{'source':'other','version':None},
+        })
+        self.assertEqual(sorted(self.server.requests),['/pypi/notapackage/json','/pypi/numpy/json','/pypi/pandas/json'])
+
+
+    def testFlagIndexUrl(self):
+        with open(os.path.join(self.test_dir,'requirements.txt'),'w') as f:
+            f.write('numpy==1.19.0\npandas==0.25.3\n')
+        with open(os.path.join(self.test_dir,'temp.py'),'w') as f:
+            f.write('import numpy as np\n\na = np.arange(15).reshape(3, 5)\nprint(a)')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=None,imports=False,index_url=self.index_url))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                report = mock_out.getvalue()
+                self.assertTrue('1.19.0 >> 1.19.1' in report and '0.25.3 >> 1.1.0' in report)
+                self.assertTrue('1 MAJOR updates, 0 MINOR updates, 1 MICRO updates' in report)
+        runThawWithMockArgs()
+
+    def testFlagFormatJsonLinesRequirements(self):
+        with open(os.path.join(self.test_dir,'requirements.txt'),'w') as f:
+            f.write('numpy==1.19.0\npandas==1.1.0\n')
+        with open(os.path.join(self.test_dir,'temp.py'),'w') as f:
+            f.write('import numpy as np\n\na = np.arange(15).reshape(3, 5)\nprint(a)')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,out=None,verbose=False,library=None,imports=False,index_url=self.index_url,format='jsonl'))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.main()
+                records = [json.loads(line) for line in mock_out.getvalue().splitlines()]
+                self.assertEqual(records[0],{'type':'library','library':'numpy','source':'pypi','current_version':'1.19.0','latest_version':'1.19.1','scale':'micro','files_affected':1})
+                self.assertEqual(records[1],{'type':'file','library':'numpy','file':'temp.py','lines':[3,4]})
+                self.assertEqual(records[2]['scale'],None)
+                self.assertEqual(records[3]['type'],'summary')
+                self.assertEqual(records[3]['scales']['micro'],{'count':1,'libraries':['numpy']})
+        runThawWithMockArgs()
+
+    def testStatsCountRequestsAndCacheHitsPerPhase(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        stats = thaw.Stats()
+        with thaw.collect_stats(stats):
+            with thaw.stats_phase('cold'):
+                thaw.resolve_libraries(['numpy','pandas','notapackage'],self.test_dir,self.index_url,cache=cache)
+            with thaw.stats_phase('warm'):
+                thaw.resolve_libraries(['numpy','pandas'],self.test_dir,self.index_url,cache=cache)
+        self.assertEqual((stats.phases['cold']['requests'],stats.phases['cold']['cache_hits'],stats.phases['cold']['cache_misses']),(3,0,3))
+        self.assertEqual((stats.phases['warm']['requests'],stats.phases['warm']['cache_hits'],stats.phases['warm']['cache_misses']),(0,2,0))
+        self.assertEqual(stats.totals()['requests'],3)
+        thaw.fetch_url(f"{self.index_url}/pypi/numpy/json")
+        self.assertEqual(stats.totals()['requests'],3)
+
+    def testStatsRecordPeakResidentMemoryWithoutTracing(self):
+        stats = thaw.Stats()
+        with thaw.collect_stats(stats):
+            with thaw.stats_phase('scan'):
+                pass
+        self.assertGreater(stats.phases['scan']['peak_memory'],0)
+        self.assertIn('peak rss',stats.table())
+        with mock.patch.object(thaw,'resource',None):
+            self.assertEqual(thaw.peak_memory(),0)
+
+
+    # BATCH TESTS ------------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def setUpProjects(self):
+        projects = {
+            'service-a': ('numpy==1.19.0\npandas==1.1.0\n','import numpy as np\n\nprint(np.ones(2))'),
+            'service-b': ('numpy==1.18.0\nidna==2.9\n','import idna\nidna.encode("a")'),
+            'scripts': (None,'print(1)'),
+        }
+        directories = []
+        for name, (requirements, code) in projects.items():
+            directory = os.path.join(self.test_dir,'projects',name)
+            os.makedirs(directory)
+            if requirements:
+                with open(os.path.join(directory,'requirements.txt'),'w') as f:
+                    f.write(requirements)
+            with open(os.path.join(directory,'main.py'),'w') as f:
+                f.write(code)
+            directories.append(directory)
+        return directories
+
+    def testBatchScanLooksUpSharedLibrariesOnce(self):
+        directories = self.setUpProjects()
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'),refresh=True)
+        scans = thaw.batch_scan(directories,cache,self.index_url,workers=3)
+        self.assertEqual(sorted(self.server.requests),['/pypi/idna/json','/pypi/numpy/json','/pypi/pandas/json'])
+        self.assertEqual([record['library'] for record in scans[0].outdated],['numpy'])
+        self.assertEqual([record['library'] for record in scans[1].outdated],['numpy','idna'])
+        self.assertTrue(scans[2].message.startswith('No requirements file found'))
+
+    def testBatchScanDoesNotLookUpProjectModules(self):
+        directories = self.setUpProjects()
+        with open(os.path.join(directories[0],'requirements.txt'),'a') as f:
+            f.write('helpers==1.0\n')
+        with open(os.path.join(directories[0],'helpers.py'),'w') as f:
+            f.write('x = 1\n')
+        scans = thaw.batch_scan(directories,thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')),self.index_url,workers=1)
+        self.assertNotIn('/pypi/helpers/json',self.server.requests)
+        self.assertEqual(scans[0].library('helpers')['source'],'local')
+
+    def testBatchSummaryGroupsOutdatedLibrariesAcrossProjects(self):
+        directories = self.setUpProjects()
+        scans = thaw.batch_scan(directories,thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')),self.index_url)
+        summary = thaw.batch_summary(thaw.project_names(directories),scans,['a.txt','b.txt',None])
+        self.assertEqual([library['library'] for library in summary['libraries']],['numpy','idna'])
+        self.assertEqual(summary['libraries'][0]['projects'],[
+            {'project':'service-a','current_version':'1.19.0','scale':'micro','files_affected':1},
+            {'project':'service-b','current_version':'1.18.0','scale':'minor','files_affected':0},
+        ])
+        self.assertEqual([(project['project'],project['outdated']) for project in summary['projects']],[('service-a',1),('service-b',2),('scripts',0)])
+
+    def testBatchMainWritesProjectReportsAndSummary(self):
+        directories = self.setUpProjects()
+        projects_file = os.path.join(self.test_dir,'projects.txt')
+        with open(projects_file,'w') as f:
+            f.write('# fleet\nprojects/service-a\nprojects/service-b\n\nprojects/scripts\n')
+        out = os.path.join(self.test_dir,'reports')
+        os.makedirs(out)
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(projects=[],projects_file=projects_file,out=out,index_url=self.index_url,format='jsonl'))
+        def runBatchWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out:
+                thaw.batch_main()
+                return [json.loads(line) for line in mock_out.getvalue().splitlines()]
+        records = runBatchWithMockArgs()
+        self.assertEqual([record['project'] for record in records if record['type'] == 'project'],['service-a','service-b','scripts'])
+        self.assertEqual([(record['library'],record['project']) for record in records if record['type'] == 'outdated'],[('numpy','service-a'),('numpy','service-b'),('idna','service-b')])
+        self.assertEqual(sorted(os.listdir(out))[:2],['service-a','service-b'])
+        with open(records[1]['report']) as f:
+            self.assertEqual([json.loads(line)['library'] for line in f if '"library"' in line and '"file"' not in line],['numpy','idna'])
+
+
+    # METADATA CACHE TESTS ---------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def testMetadataCacheWarmLookupMakesNoRequests(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        thaw.resolve_libraries(['numpy','pandas'],self.test_dir,self.index_url,cache=cache)
+        cache.save()
+        self.server.requests.clear()
+        warm_cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        resolved = thaw.resolve_libraries(['numpy','pandas'],self.test_dir,self.index_url,cache=warm_cache)
+        self.assertEqual(resolved['numpy'],{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(self.server.requests,[])
+
+    def testMetadataCacheExpiredEntryIsLookedUpAgain(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'),ttl=0)
+        thaw.fetch_library_metadata('numpy',self.index_url,cache)
+        with mock.patch('time.time',return_value=thaw.time.time() + 1):
+            thaw.fetch_library_metadata('numpy',self.index_url,cache)
+        self.assertEqual(len(self.server.requests),2)
+
+    def testMetadataCacheRefreshIgnoresEntries(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        cache.set(self.index_url,'numpy',{'source':'pypi','version':'0.1'})
+        cache.refresh = True
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,cache),{'source':'pypi','version':'1.19.1'})
+
+    def testMetadataCacheOfflineUsesStaleEntriesAndSkipsNetwork(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'),ttl=0,offline=True)
+        cache.set(self.index_url,'numpy',{'source':'pypi','version':'1.0'})
+        with mock.patch('time.time',return_value=thaw.time.time() + 10):
+            self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,cache),{'source':'pypi','version':'1.0'})
+        self.assertEqual(thaw.fetch_library_metadata('pandas',self.index_url,cache),{'source':'other','version':None})
+        self.assertEqual(self.server.requests,[])
+
+    def testMetadataCacheEvictsLeastRecentlyUsed(self):
+        path = os.path.join(self.test_dir,'metadata.json')
+        cache = thaw.MetadataCache(path,max_entries=2)
+        for n, library in enumerate(['numpy','pandas','idna']):
+            with mock.patch('time.time',return_value=1000.0 + n):
+                cache.set(self.index_url,library,{'source':'pypi','version':'1.0'})
+        with mock.patch('time.time',return_value=1000.0 + 5):
+            cache.get(self.index_url,'numpy')
+        cache.save()
+        reloaded = thaw.MetadataCache(path,ttl=float('inf'))
+        self.assertEqual(reloaded.get(self.index_url,'pandas'),None)
+        self.assertEqual(reloaded.get(self.index_url,'numpy'),{'source':'pypi','version':'1.0'})
+        self.assertEqual(reloaded.get(self.index_url,'idna'),{'source':'pypi','version':'1.0'})
+
+    def testMetadataCacheWarmRunDoesNotRewriteFile(self):
+        path = os.path.join(self.test_dir,'metadata.json')
+        cache = thaw.MetadataCache(path)
+        cache.set(self.index_url,'numpy',{'source':'pypi','version':'1.0'})
+        cache.save()
+        warm = thaw.MetadataCache(path)
+        self.assertEqual(warm.get(self.index_url,'numpy'),{'source':'pypi','version':'1.0'})
+        with mock.patch('os.replace') as replace:
+            warm.save()
+        replace.assert_not_called()
+
+    def testMetadataCacheDoesNotStoreConnectionFailures(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        thaw.fetch_library_metadata('numpy','http://127.0.0.1:1',cache)
+        self.assertEqual(cache.get('http://127.0.0.1:1','numpy'),None)
+
+
+    # LOCAL AND SIMPLE INDEX TESTS -------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def makeWheelhouse(self):
+        wheelhouse = os.path.join(self.test_dir,'wheelhouse')
+        os.mkdir(wheelhouse)
+        for filename in ['numpy-1.19.1-cp38-cp38-manylinux1_x86_64.whl','numpy-1.20.0rc1-cp38-cp38-manylinux1_x86_64.whl',
+                         'numpy-1.9.3.tar.gz','Flask_Login-0.5.0-py2.py3-none-any.whl','idna-2.10.zip','notes.txt']:
+            open(os.path.join(wheelhouse,filename),'w').close()
+        return wheelhouse
+
+    def testIndexKind(self):
+        self.assertEqual(thaw.index_kind('https://pypi.org'),'json')
+        self.assertEqual(thaw.index_kind('https://mirror.example.com/root/pypi/+simple/'),'simple')
+        self.assertEqual(thaw.index_kind('https://mirror.example.com/simple'),'simple')
+        self.assertEqual(thaw.index_kind('/srv/wheelhouse'),'local')
+        self.assertEqual(thaw.index_kind('file:///srv/wheelhouse'),'local')
+
+    def testParseDistributionFilename(self):
+        self.assertEqual(thaw.parse_distribution_filename('Django-3.1.2-py3-none-any.whl'),('django','3.1.2'))
+        self.assertEqual(thaw.parse_distribution_filename('python-dateutil-2.8.1.tar.gz'),('python-dateutil','2.8.1'))
+        self.assertEqual(thaw.parse_distribution_filename('README.md'),None)
+
+    def testLatestVersionPrefersFinalReleases(self):
+        self.assertEqual(thaw.latest_version(['1.9.3','1.19.1','1.20.0rc1','1.19.1.post1']),'1.19.1.post1')
+        self.assertEqual(thaw.latest_version(['2.0b1','2.0a3']),'2.0b1')
+        self.assertEqual(thaw.latest_version([]),None)
+
+    def testFetchLibraryMetadataFromWheelhouse(self):
+        wheelhouse = self.makeWheelhouse()
+        self.assertEqual(thaw.fetch_library_metadata('numpy',wheelhouse),{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(thaw.fetch_library_metadata('flask-login',f"file://{wheelhouse}"),{'source':'pypi','version':'0.5.0'})
+        self.assertEqual(thaw.fetch_library_metadata('pandas',wheelhouse),{'source':'other','version':None})
+
+    def testFetchLibraryMetadataFromSimpleIndexDirectory(self):
+        simple = os.path.join(self.test_dir,'simple')
+        os.makedirs(os.path.join(simple,'pandas'))
+        os.makedirs(os.path.join(simple,'idna'))
+        with open(os.path.join(simple,'pandas','index.html'),'w') as f:
+            f.write('<a href="pandas-1.1.0.tar.gz">pandas-1.1.0.tar.gz</a><a href="pandas-2.0.0.tar.gz" data-yanked="bad">pandas-2.0.0.tar.gz</a>')
+        open(os.path.join(simple,'idna','idna-2.10-py2.py3-none-any.whl'),'w').close()
+        self.assertEqual(thaw.fetch_library_metadata('pandas',simple),{'source':'pypi','version':'1.1.0'})
+        self.assertEqual(thaw.fetch_library_metadata('idna',simple),{'source':'pypi','version':'2.10'})
+
+    def testLocalIndexIsBuiltOncePerRun(self):
+        wheelhouse = self.makeWheelhouse()
+        with mock.patch.object(thaw,'LocalIndex',wraps=thaw.LocalIndex) as local_index:
+            resolved = thaw.resolve_libraries(['numpy','idna','pandas'],self.test_dir,wheelhouse,4,local_modules=set())
+        self.assertEqual(local_index.call_count,1)
+        self.assertEqual(resolved['idna'],{'source':'pypi','version':'2.10'})
+        self.assertEqual(self.server.requests,[])
+        with mock.patch.object(thaw.os,'scandir',wraps=os.scandir) as scandir:
+            thaw.resolve_libraries(['numpy','idna'],self.test_dir,wheelhouse,4,local_modules=set())
+        self.assertEqual(scandir.call_count,0)
+
+    def testFetchLibraryMetadataFromSimpleIndexUrl(self):
+        simple_url = f"{self.index_url}/simple/"
+        self.assertEqual(thaw.fetch_library_metadata('numpy',simple_url),{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(thaw.fetch_library_metadata('notapackage',simple_url),{'source':'other','version':None})
+        self.assertEqual(self.server.requests,['/simple/numpy/','/simple/notapackage/'])
+
+    def testFetchLibraryMetadataWithVersions(self):
+        self.server.releases['pandas'] = ['0.25.3','1.0.5','1.1.0']
+        self.server.yanked.add('1.0.5')
+        self.assertEqual(thaw.fetch_library_metadata('pandas',self.index_url,with_versions=True),{'source':'pypi','version':'1.1.0','versions':['0.25.3','1.1.0']})
+
+    def testMetadataCacheLooksUpAgainForMissingVersions(self):
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        cache.set(self.index_url,'numpy',{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,cache),{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(self.server.requests,[])
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,cache,with_versions=True)['versions'],['1.19.1'])
+        self.assertEqual(self.server.requests,['/pypi/numpy/json'])
+
+    def testScanRequirementsUsesNewestVersionAllowedByRange(self):
+        self.server.releases['pandas'] = ['0.25.3','1.0.5','1.1.0']
+        self.server.releases['numpy'] = ['1.18.5','1.19.0','1.19.1']
+        with open(os.path.join(self.test_dir,'requirements.txt'),'w') as f:
+            f.write('pandas>=0.25,<1.1\nnumpy>=1.19\nidna\n')
+        scan = thaw.Scanner(self.index_url,1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))).scan(self.test_dir)
+        self.assertEqual([(record['library'],record['current_version'],record['latest_version'],record['scale']) for record in scan.libraries],
+                         [('pandas','1.0.5','1.1.0','minor'),('numpy','1.19.1','1.19.1',None),('idna',None,None,None)])
+
+    def testScanRequirementsLooksUpEachLibraryOnceAcrossFiles(self):
+        with open(os.path.join(self.test_dir,'requirements.txt'),'w') as f:
+            f.write('numpy==1.19.0\ngit+https://github.com/psf/requests.git#egg=requests\n-r dev.txt\n')
+        with open(os.path.join(self.test_dir,'dev.txt'),'w') as f:
+            f.write('NumPy>=1.18\npandas==1.1.0\n')
+        with open(os.path.join(self.test_dir,'setup.cfg'),'w') as f:
+            f.write('[options]\ninstall_requires =\n    numpy\n    pandas\n')
+        scan = thaw.Scanner(self.index_url,1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))).scan(self.test_dir)
+        self.assertEqual(sorted(self.server.requests),['/pypi/numpy/json','/pypi/pandas/json'])
+        self.assertEqual([(record['library'],record['source'],record['current_version'],record['scale']) for record in scan.libraries],
+                         [('numpy','pypi','1.19.0','micro'),('requests','other',None,None),('pandas','pypi','1.1.0',None)])
+
+
+    # NETWORK POLICY TESTS ---------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def testNetworkPolicyTimesOutSlowIndex(self):
+        self.server.delay = 2
+        policy = thaw.NetworkPolicy(timeout=0.2,retries=0)
+        start = time.monotonic()
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,policy=policy),{'source':'unknown','version':None})
+        self.assertLess(time.monotonic() - start,1.5)
+
+    def testNetworkPolicyWithoutTimeoutOrDeadline(self):
+        policy = thaw.NetworkPolicy(timeout=None,deadline=None)
+        self.assertEqual(policy.request_timeout(),None)
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,policy=policy),{'source':'pypi','version':'1.19.1'})
+        self.assertLessEqual(thaw.NetworkPolicy(timeout=None,deadline=60).request_timeout(),60)
+
+    def testNetworkPolicyRetriesServerErrors(self):
+        self.server.errors = 2
+        policy = thaw.NetworkPolicy(retries=2,backoff=0)
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,policy=policy),{'source':'pypi','version':'1.19.1'})
+        self.assertEqual(len(self.server.requests),3)
+
+    def testNetworkPolicyGivesUpAfterRetries(self):
+        self.server.errors = 5
+        cache = thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json'))
+        policy = thaw.NetworkPolicy(retries=1,backoff=0)
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,cache,policy),{'source':'unknown','version':None})
+        self.assertEqual(len(self.server.requests),2)
+        self.assertEqual(cache.get(self.index_url,'numpy'),None)
+
+    def testCircuitBreakerShortCircuitsRemainingLookups(self):
+        policy = thaw.NetworkPolicy(retries=0,failure_threshold=2)
+        libraries = ['numpy','pandas','idna','requests','six']
+        with mock.patch.object(thaw,'fetch_url',wraps=thaw.fetch_url) as fetch_url:
+            resolved = thaw.resolve_libraries(libraries,None,'http://127.0.0.1:1',1,local_modules=set(),policy=policy)
+        self.assertEqual(fetch_url.call_count,2)
+        self.assertEqual(resolved,{library:{'source':'unknown','version':None} for library in libraries})
+        self.assertEqual(policy.skipped,5)
+
+    def testCircuitBreakerClosesAfterCooldown(self):
+        policy = thaw.NetworkPolicy(retries=0,failure_threshold=1,cooldown=0)
+        thaw.fetch_library_metadata('numpy','http://127.0.0.1:1',policy=policy)
+        self.assertEqual(thaw.fetch_library_metadata('numpy',self.index_url,policy=policy),{'source':'pypi','version':'1.19.1'})
+        self.assertFalse(policy.tripped)
+
+    def testNetworkPolicyDeadlineSkipsLookups(self):
+        policy = thaw.NetworkPolicy(deadline=0)
+        resolved = thaw.resolve_libraries(['numpy','pandas'],None,self.index_url,local_modules=set(),policy=policy)
+        self.assertEqual(resolved['numpy'],{'source':'unknown','version':None})
+        self.assertEqual(self.server.requests,[])
+
+    def testFlagRetriesReportsUnknownLibraries(self):
+        with open(os.path.join(self.test_dir,'temp.py'),'w') as f:
+            f.write('import numpy as np\n\na = np.arange(15)\n')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,imports=True,index_url='http://127.0.0.1:1',retries=0,refresh=True))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out, mock.patch('sys.stderr',new=StringIO()) as mock_err:
+                thaw.main()
+                self.assertIn('\t?numpy',mock_out.getvalue())
+                self.assertIn("couldn't reach http://127.0.0.1:1; 1 libraries are reported as unknown",mock_err.getvalue())
+        runThawWithMockArgs()
+
+    def testRequirementsReportListsUnknownLibraries(self):
+        with open(os.path.join(self.test_dir,'requirements.txt'),'w') as f:
+            f.write('numpy==1.19.0\n')
+        @mock.patch('argparse.ArgumentParser.parse_args',
+                    return_value=argparse.Namespace(directory=self.test_dir,index_url='http://127.0.0.1:1',retries=0,refresh=True))
+        def runThawWithMockArgs(mock_args):
+            with mock.patch('sys.stdout',new=StringIO()) as mock_out, mock.patch('sys.stderr',new=StringIO()):
+                thaw.main()
+                self.assertIn(f"\t?{'numpy':<40} | unknown (index unreachable)\n",mock_out.getvalue())
+        runThawWithMockArgs()
+
+
+if __name__ == '__main__':
+    unittest.main()
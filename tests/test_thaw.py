@@ -1,7 +1,9 @@
+from io import StringIO
 import os
 import pathlib
 import shutil, tempfile
 import unittest
+from unittest import mock
 
 from thaw import thaw
 
@@ -11,6 +13,12 @@ class ThawTests(unittest.TestCase):
     
     def setUpTempDirectory(self):
         self.test_dir = tempfile.mkdtemp('example')
+        # keep main() and Scanner away from the real user cache
+        self.cache_dir = tempfile.mkdtemp('cache')
+        self.addCleanup(shutil.rmtree,self.cache_dir,True)
+        cache_env = mock.patch.dict(os.environ,{'THAW_CACHE_DIR':self.cache_dir})
+        cache_env.start()
+        self.addCleanup(cache_env.stop)
         
     def createTempDotPyFile(self,text,name='temp'):
         f = open(os.path.join(self.test_dir, f"{name}.py"), 'w')
@@ -78,6 +86,59 @@ class ThawTests(unittest.TestCase):
     def testVersionUpdateScaleReturnsNone(self):
         self.assertEqual(thaw.version_update_scale('1.0','1.0'),None)
     
+    def testVersionUpdateScaleSingleComponentVersions(self):
+        self.assertEqual(thaw.version_update_scale('2020','2021'),"major")
+        self.assertEqual(thaw.version_update_scale('2020','2020.1'),"minor")
+    
+    def testVersionUpdateScaleComparesPep440Versions(self):
+        self.assertEqual(thaw.version_update_scale('1.0','1.0.0'),None)
+        self.assertEqual(thaw.version_update_scale('2.0','1.9'),None)
+        self.assertEqual(thaw.version_update_scale('1.4rc1','1.4'),"micro")
+        self.assertEqual(thaw.version_update_scale('1.4','1.4.post1'),"micro")
+        self.assertEqual(thaw.version_update_scale('2020.1','1!1.0'),"major")
+    
+    def testVersionOrdering(self):
+        versions = ['1.0.post1','1.0+local.1','1.0','1.0rc1','1.0b2','1.0a1','1.0.dev1','0.9','1!0.1']
+        self.assertEqual([version.text for version in sorted(map(thaw.parse_version,versions))],
+                         ['0.9','1.0.dev1','1.0a1','1.0b2','1.0rc1','1.0','1.0+local.1','1.0.post1','1!0.1'])
+        self.assertEqual(thaw.parse_version('1.0'),thaw.parse_version('1.0.0'))
+        self.assertEqual(thaw.parse_version('not a version'),None)
+    
+    def testParseVersionIsMemoized(self):
+        self.assertIs(thaw.parse_version('3.2.1'),thaw.parse_version('3.2.1'))
+        self.assertIs(thaw.parse_specifiers('>=1.0,<2'),thaw.parse_specifiers('>=1.0,<2'))
+    
+    def testSpecifierSetContains(self):
+        cases = {
+            '~=2.2': (['2.2','2.9.1'],['2.1','3.0']),
+            '==1.19.*': (['1.19','1.19.5'],['1.20.0','1.1']),
+            '>=1.0,!=1.3.*,<2': (['1.0','1.2.9','1.4'],['0.9','1.3.1','2.0']),
+            '<2.0': (['1.9'],['2.0rc1','2.0']),
+            '>1.0': (['1.0.1'],['1.0','1.0.post1']),
+            '': (['0.1','9'],['1.0rc1']),
+        }
+        for text, (allowed, refused) in cases.items():
+            specifier = thaw.parse_specifiers(text)
+            for version in allowed:
+                self.assertTrue(specifier.contains(version),f"{version} should match '{text}'")
+            for version in refused:
+                self.assertFalse(specifier.contains(version),f"{version} shouldn't match '{text}'")
+    
+    def testSpecifierSetBestPrefersFinalReleases(self):
+        versions = ['0.25.3','1.0.5','1.1.0','1.2.0rc1']
+        self.assertEqual(thaw.parse_specifiers('<1.1').best(versions),'1.0.5')
+        self.assertEqual(thaw.parse_specifiers('').best(versions),'1.1.0')
+        self.assertEqual(thaw.parse_specifiers('>=1.2.0rc1').best(versions),'1.2.0rc1')
+        self.assertEqual(thaw.parse_specifiers('>1.1').best(versions),'1.2.0rc1')
+        self.assertEqual(thaw.parse_specifiers('>=2').best(versions),None)
+    
+    def testPinnedVersion(self):
+        versions = ['1.18.5','1.19.0','1.19.1']
+        self.assertEqual(thaw.pinned_version(thaw.parse_specifiers('==1.19.0'),versions),'1.19.0')
+        self.assertEqual(thaw.pinned_version(thaw.parse_specifiers('<1.19'),versions),'1.18.5')
+        self.assertEqual(thaw.pinned_version(thaw.parse_specifiers('<1.19')),None)
+        self.assertEqual(thaw.pinned_version(thaw.parse_specifiers(''),versions),None)
+    
     # ------------------------------   
     
     def testLibraryInstanceNotSubwordReturnsFalseForSubwordInMiddleOfWord(self):
@@ -112,6 +173,36 @@ class ThawTests(unittest.TestCase):
     def testCheckLineForNewVariableWithVariable(self):
         self.assertEqual(thaw.check_line_for_new_variable('dt','today = dt.date.today()'),['today'])
 
+
+    # ------------------------------
+    
+    def testKeywordMatcherFindsWholeWord(self):
+        matcher = thaw.KeywordMatcher(['os'])
+        self.assertEqual(matcher.search('pathname = os.path.dirname("file")'),'os')
+    
+    def testKeywordMatcherIgnoresSubword(self):
+        matcher = thaw.KeywordMatcher(['os'])
+        self.assertEqual(matcher.search('kangaroos are wild animals'),None)
+        self.assertEqual(matcher.search('ostentatious means very showy'),None)
+    
+    def testKeywordMatcherPicksUpAddedKeywords(self):
+        matcher = thaw.KeywordMatcher(['dt'])
+        self.assertEqual(matcher.search('today.weekday()'),None)
+        matcher.add('today')
+        self.assertEqual(matcher.search('today.weekday()'),'today')
+    
+    def testKeywordMatcherReturnsFirstKeywordInLine(self):
+        matcher = thaw.KeywordMatcher([b'np',b'(arr'])
+        matcher.add(b'total')
+        matcher.add(b'total')
+        self.assertEqual(matcher.keywords,{b'np',b'(arr',b'total'})
+        self.assertEqual(matcher.search(b'x = total + np.sum(arr)'),b'total')
+        self.assertEqual(matcher.search(b'print(np.sum(arr))'),b'np')
+        self.assertEqual(matcher.search(b'len (arr)'),b'(arr')
+        self.assertEqual(matcher.search(b'len (array)'),None)
+    
+    def testKeywordMatcherWithNoKeywords(self):
+        self.assertEqual(thaw.KeywordMatcher().search('import os'),None)
     
     # PYPI SEARCH METHOD TESTS -----------------------------------------------------------------------------------------
     # ------------------------------------------------------------------------------------------------------------------
@@ -122,6 +213,127 @@ class ThawTests(unittest.TestCase):
         self.assertEqual(thaw.get_library_source('minor',self.test_dir),'local')
         self.tearDownTempDirectory()
     
+    def testGetLibrarySourceLocalPackage(self):
+        self.setUpTempDirectory()
+        os.makedirs(os.path.join(self.test_dir,'src','mypackage'))
+        with open(os.path.join(self.test_dir,'src','mypackage','__init__.py'),'w') as f:
+            f.write('')
+        self.assertEqual(thaw.get_library_source('mypackage',self.test_dir),'local')
+        self.tearDownTempDirectory()
+    
+    def testIndexProjectOnlyFindsTopLevelNames(self):
+        self.setUpTempDirectory()
+        for name in ['app/requests','app/__init__','docs/conf','src/mylib/__init__','src/mylib/numpy']:
+            os.makedirs(os.path.dirname(os.path.join(self.test_dir,name)),exist_ok=True)
+            self.createTempDotPyFile('',name)
+        self.assertEqual(thaw.index_project(self.test_dir)['modules'],{'app','docs','mylib'})
+        self.assertFalse(thaw.library_is_local('requests',self.test_dir))
+        self.tearDownTempDirectory()
+    
+    def testIndexProjectFindsModulesPackagesAndNamespacePackages(self):
+        self.setUpTempDirectory()
+        os.makedirs(os.path.join(self.test_dir,'regular'))
+        os.makedirs(os.path.join(self.test_dir,'namespace','inner'))
+        os.makedirs(os.path.join(self.test_dir,'data'))
+        for path in [('regular','__init__.py'),('namespace','inner','mod.py'),('helpers.py',),('data','notes.txt')]:
+            with open(os.path.join(self.test_dir,*path),'w') as f:
+                f.write('')
+        project = thaw.index_project(self.test_dir)
+        self.assertEqual(project['modules'],{'regular','namespace','helpers'})
+        self.assertEqual(sorted(project['files']),sorted([
+            os.path.join(self.test_dir,'regular') + '/__init__.py',
+            os.path.join(self.test_dir,'namespace','inner') + '/mod.py',
+            self.test_dir + '/helpers.py',
+        ]))
+        self.tearDownTempDirectory()
+    
+    def testWalkProjectPrunesToolAndVirtualenvDirectories(self):
+        self.setUpTempDirectory()
+        for directory in ['.git/objects','.tox/py38','venv/lib','node_modules/pkg','build/lib','lib/site-packages/numpy','myenv','src/__pycache__','src/app']:
+            os.makedirs(os.path.join(self.test_dir,directory))
+            self.createTempDotPyFile('import os',directory + '/module')
+        with open(os.path.join(self.test_dir,'myenv','pyvenv.cfg'),'w') as f:
+            f.write('home = /usr/bin')
+        self.createTempDotPyFile('import os','main')
+        self.assertEqual(thaw.list_python_files(self.test_dir),[self.test_dir + '/main.py',self.test_dir + '/src/app/module.py'])
+        self.tearDownTempDirectory()
+    
+    def testWalkProjectHonorsGitignoreAndExcludes(self):
+        self.setUpTempDirectory()
+        for directory in ['generated','docs/examples','src/legacy']:
+            os.makedirs(os.path.join(self.test_dir,directory))
+        for name in ['main','generated/models','docs/conf','docs/examples/demo','src/api_pb2','src/legacy/old','src/legacy/keep']:
+            self.createTempDotPyFile('import os',name)
+        with open(os.path.join(self.test_dir,'.gitignore'),'w') as f:
+            f.write('# generated code\n/generated/\n*_pb2.py\n')
+        with open(os.path.join(self.test_dir,'src','.gitignore'),'w') as f:
+            f.write('legacy/*\n!legacy/keep.py\n')
+        relative = lambda files: [filepath[len(self.test_dir) + 1:] for filepath in files]
+        self.assertEqual(sorted(relative(thaw.index_project(self.test_dir)['files'])),['docs/conf.py','docs/examples/demo.py','main.py','src/legacy/keep.py'])
+        self.assertEqual(sorted(relative(thaw.index_project(self.test_dir,['docs/examples/**'])['files'])),['docs/conf.py','main.py','src/legacy/keep.py'])
+        self.assertEqual(sorted(relative(thaw.index_project(self.test_dir,['docs','ma?n.py'])['files'])),['src/legacy/keep.py'])
+        self.tearDownTempDirectory()
+    
+    def testWalkProjectMatchesOsWalkOrder(self):
+        self.setUpTempDirectory()
+        for directory in ['b/c','a','b/a']:
+            os.makedirs(os.path.join(self.test_dir,directory))
+        for name in ['z','b/c/y','a/x','b/a/w','b/v']:
+            self.createTempDotPyFile('import os',name)
+        walked = [root + '/' + file for root, dirs, files in os.walk(self.test_dir) for file in files]
+        self.assertEqual(thaw.list_python_files(self.test_dir),walked)
+        self.tearDownTempDirectory()
+    
+    def testManifestListsFilesWithModuleNames(self):
+        self.setUpTempDirectory()
+        os.makedirs(os.path.join(self.test_dir,'pkg','sub'))
+        self.createTempDotPyFile('import os','main')
+        self.createTempDotPyFile('','pkg/__init__')
+        self.createTempDotPyFile('x = 1\n','pkg/sub/mod')
+        manifest = thaw.Manifest.build(self.test_dir)
+        self.assertEqual(manifest.files,thaw.list_python_files(self.test_dir))
+        entries = {entry['module']: entry for entry in manifest.entries}
+        self.assertEqual(sorted(entries),['main','pkg.__init__','pkg.sub.mod'])
+        self.assertEqual(set(entries['pkg.sub.mod']),{'path','module'})
+        self.assertEqual(entries['pkg.sub.mod']['path'],self.test_dir + '/pkg/sub/mod.py')
+        self.assertEqual(manifest.modules,{'main','pkg'})
+        self.tearDownTempDirectory()
+    
+    def testSavedManifestIsReusedUntilADirectoryChanges(self):
+        self.setUpTempDirectory()
+        os.makedirs(os.path.join(self.test_dir,'pkg'))
+        self.createTempDotPyFile('import os','main')
+        self.createTempDotPyFile('import os','pkg/mod')
+        cache_dir = tempfile.mkdtemp('cache')
+        path = os.path.join(cache_dir,'manifests','manifest.json')
+        first = thaw.load_manifest(self.test_dir,path=path)
+        with mock.patch.object(thaw,'walk_project',side_effect=AssertionError('walked')):
+            self.assertEqual(thaw.load_manifest(self.test_dir,path=path).entries,first.entries)
+        self.assertEqual(thaw.Manifest.load(path,self.test_dir,['*.txt']),None)
+        self.createTempDotPyFile('import os','pkg/new')
+        os.utime(os.path.join(self.test_dir,'pkg'),ns=(1,1))
+        self.assertEqual(thaw.Manifest.load(path,self.test_dir),None)
+        self.assertTrue(self.test_dir + '/pkg/new.py' in thaw.load_manifest(self.test_dir,path=path).files)
+        with open(os.path.join(self.test_dir,'.gitignore'),'w') as f:
+            f.write('pkg/\n')
+        self.assertEqual(thaw.load_manifest(self.test_dir,path=path).files,[self.test_dir + '/main.py'])
+        shutil.rmtree(cache_dir)
+        self.tearDownTempDirectory()
+    
+    def testScannerReusesManifestBetweenScans(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        scanner = thaw.Scanner(jobs=1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')))
+        first = scanner.scan(self.test_dir,'library',['numpy'])
+        with mock.patch.object(thaw,'walk_project',side_effect=AssertionError('walked')):
+            second = scanner.scan(self.test_dir,'library',['numpy'])
+        self.assertEqual(second.libraries,first.libraries)
+        self.tearDownTempDirectory()
+    
+    def testLibraryIsLocalUsesGivenIndex(self):
+        self.assertTrue(thaw.library_is_local('mymodule','/does/not/exist',{'mymodule'}))
+        self.assertFalse(thaw.library_is_local('numpy','/does/not/exist',{'mymodule'}))
+    
     def testGetLibrarySourcePYPI(self):
         self.assertEqual(thaw.get_library_source('numpy',os.getcwd()),'pypi')
     
@@ -199,6 +411,16 @@ class ThawTests(unittest.TestCase):
         self.assertEqual(thaw.get_libraries_and_versions_from_requirements(filepath),[{'library':'pandas','version':None}])
         self.tearDownTempDirectory()
         
+    def testGetRequirementsKeepsEveryClause(self):
+        self.setUpTempDirectory()
+        with open(os.path.join(self.test_dir, 'requirements.txt'), 'w') as f:
+            f.write('# comment\n-r base.txt\npandas[excel] >=1.0, <1.2\nsqlalchemy\nnumpy==1.19.* ; python_version >= "3.6"\n')
+        filepath = os.path.join(self.test_dir,'requirements.txt')
+        requirements = thaw.get_requirements(filepath)
+        self.assertEqual([(item['library'],str(item['specifier'])) for item in requirements],
+                         [('pandas','>=1.0, <1.2'),('sqlalchemy',''),('numpy','==1.19.*')])
+        self.tearDownTempDirectory()
+    
     def testGetLibrariesAndVersionsFromRequirementsLessThanOperator(self):
         self.setUpTempDirectory()
         with open(os.path.join(self.test_dir, 'requirements.txt'), 'w') as f:
@@ -269,6 +491,464 @@ class ThawTests(unittest.TestCase):
         self.assertEqual(thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'datetime')['linenums'],[3,5])
         self.tearDownTempDirectory()
 
+    def testCheckFileForLibraryIgnoresVariableNamesContainingKeyword(self):
+        text = 'import datetime as dt #1\n#2\ndt_format = "%Y" #3\ndelta = dt.timedelta(2) #4'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'datetime')['linenums'],[4])
+        self.tearDownTempDirectory()
+
+    def testLibrariesInSourceFindsOnlyMentionedLibraries(self):
+        data = b'import numpy as np\nimport pandas_ta\nprint(np.pi)'
+        self.assertEqual(thaw.libraries_in_source(data,['idna','numpy','pandas','pandas_ta']),['numpy','pandas','pandas_ta'])
+        self.assertEqual(thaw.libraries_in_source(data,['idna','datetime']),[])
+        self.assertEqual(thaw.libraries_in_source(data,[]),[])
+    
+    def testCheckFileForLibrariesSkipsLineAnalysisWhenNoLibraryIsMentioned(self):
+        self.setUpTempDirectory()
+        self.createTempDotPyFile('import os\nx = os.getcwd()\nprint(x)')
+        with mock.patch.object(thaw,'check_line_for_library') as mock_check:
+            affected = thaw.check_file_for_libraries(os.path.join(self.test_dir, 'temp.py'),['numpy','idna'])
+            mock_check.assert_not_called()
+        self.assertEqual(affected,{'numpy':{'linenums':[],'linetext':[]},'idna':{'linenums':[],'linetext':[]}})
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibraryWithEncodingDeclaration(self):
+        self.setUpTempDirectory()
+        with open(os.path.join(self.test_dir,'temp.py'),'wb') as f:
+            f.write('# -*- coding: latin-1 -*-\nimport idna\nname = "café"\nprint(idna.encode(name))\n'.encode('latin-1'))
+        affected = thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'idna')
+        self.assertEqual(affected,{'linenums':[4],'linetext':['print(idna.encode(name))\n']})
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibraryWithByteOrderMark(self):
+        self.setUpTempDirectory()
+        with open(os.path.join(self.test_dir,'temp.py'),'wb') as f:
+            f.write('\ufeffimport numpy as np\nx = np.zeros(3)\nprint(x)\n'.encode('utf-8'))
+        affected = thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'numpy')
+        self.assertEqual(affected,{'linenums':[2,3],'linetext':['x = np.zeros(3)\n','print(x)\n']})
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibraryWithUndecodableBytes(self):
+        self.setUpTempDirectory()
+        with open(os.path.join(self.test_dir,'temp.py'),'wb') as f:
+            f.write(b'import idna\r\nlabel = "\xff\xfe"\r\nx = idna.decode(label) # \xff\r\n')
+        affected = thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'idna')
+        self.assertEqual(affected['linenums'],[3])
+        self.assertEqual(affected['linetext'],['x = idna.decode(label) # \ufffd\n'])
+        self.assertEqual(thaw.check_file_for_imports(os.path.join(self.test_dir, 'temp.py')),['idna'])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesMemoryMapsLargeFiles(self):
+        text = 'import datetime as dt #1\n#2\nelapsed = dt.timedelta(2) #3\nelapsed2 = dt.timedelta(3) #4'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.createTempDotPyFile('x = 1\n' * 100,'unrelated')
+        with mock.patch.object(thaw,'MMAP_THRESHOLD',1):
+            self.assertEqual(thaw.check_file_for_library(os.path.join(self.test_dir, 'temp.py'),'datetime')['linenums'],[3,4])
+            self.assertEqual(thaw.check_file_for_library(os.path.join(self.test_dir, 'unrelated.py'),'datetime')['linenums'],[])
+            self.assertEqual(thaw.check_file_for_imports(os.path.join(self.test_dir, 'temp.py')),['datetime'])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesTracksEachLibrarySeparately(self):
+        text = 'import datetime as dt #1\nimport idna #2\nelapsed = dt.timedelta(2) #3\nprint(idna.decode("xn--eckwd4c7c.xn--zckzah")) #4\nelapsed * 2 #5'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        affected = thaw.check_file_for_libraries(os.path.join(self.test_dir, 'temp.py'),['datetime','idna'])
+        self.assertEqual(affected['datetime']['linenums'],[3,5])
+        self.assertEqual(affected['idna']['linenums'],[4])
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForLibrariesMatchesPerLibrarySearch(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        affected = thaw.search_directory_for_libraries(self.test_dir,['idna','numpy','pandas'])
+        for lib in ['idna','numpy','pandas']:
+            self.assertEqual(affected[lib],thaw.search_directory_for_library(self.test_dir,lib))
+        self.assertEqual(len(affected['idna']),1)
+        self.tearDownTempDirectory()
+
+
+    def testFileHitsReadsLineTextFromFileWhenAsked(self):
+        self.setUpTempDirectory()
+        with open(os.path.join(self.test_dir,'temp.py'),'wb') as f:
+            f.write('# -*- coding: latin-1 -*-\r\nimport idna\r\nx = idna.encode("\xe9")\r\n'.encode('latin-1'))
+        filepath = os.path.join(self.test_dir,'temp.py')
+        hits = thaw.FileHits(filepath,[3])
+        self.assertFalse(hasattr(hits,'__dict__'))
+        self.assertEqual(hits['lines'],[3])
+        self.assertEqual(hits['linestext'],thaw.check_file_for_library(filepath,'idna')['linetext'])
+        self.assertEqual(hits,{'file':filepath,'lines':[3],'linestext':['x = idna.encode("\xe9")\n']})
+        self.assertRaises(KeyError,hits.__getitem__,'text')
+        self.tearDownTempDirectory()
+    
+    def testVerboseReportOfDeletedFileShowsNoLineText(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        result = thaw.Scanner(jobs=1).scan(self.test_dir,libraries=['numpy'])
+        os.remove(os.path.join(self.test_dir,'major.py'))
+        stdout = StringIO()
+        result.write(thaw.ReportWriter(stdout=stdout),verbose=True)
+        self.assertIn('\n\t\t3          | \n',stdout.getvalue())
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForLibrariesReturnsCompactHits(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        affected = thaw.search_directory_for_libraries(self.test_dir,['numpy'])['numpy']
+        self.assertEqual(affected,[thaw.FileHits(self.test_dir + '/major.py',[3,4])])
+        self.assertEqual(affected[0]['linestext'],['a = np.arange(15).reshape(3, 5)\n','print(a)'])
+        self.assertTrue(affected[0].file is thaw.FileHits(self.test_dir + '/major.py',[]).file)
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForLibrariesWithJobsMatchesSerialRun(self):
+        self.setUpTempDirectory()
+        for n in range(12):
+            self.createTempDotPyFile(f'import numpy as np #1\n\na = np.arange({n}) #3\nprint(a) #4','file' + str(n))
+        serial = thaw.search_directory_for_libraries(self.test_dir,['numpy'],1)
+        with mock.patch.object(thaw,'MIN_FILES_PER_JOB',1):
+            parallel = thaw.search_directory_for_libraries(self.test_dir,['numpy'],4)
+        self.assertEqual(parallel,serial)
+        self.assertEqual(len(parallel['numpy']),12)
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForImportsWithJobsMatchesSerialRun(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        serial = thaw.search_directory_for_imports(self.test_dir,1)
+        with mock.patch.object(thaw,'MIN_FILES_PER_JOB',1):
+            parallel = thaw.search_directory_for_imports(self.test_dir,3)
+        self.assertEqual(parallel,serial)
+        self.tearDownTempDirectory()
+
+
+    def testSearchDirectoryForLibrariesWithFileCacheOnlyRescansChangedFiles(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        cache_path = os.path.join(self.test_dir,'cache.json')
+        file_cache = thaw.FileResultCache(self.test_dir,cache_path)
+        first = thaw.search_directory_for_libraries(self.test_dir,['numpy','idna'],1,file_cache=file_cache)
+        file_cache.save()
+        self.createTempDotPyFile('import numpy as np\n\nb = np.ones(3)\nb += 1\nprint(b)','major')
+        mock_check = mock.Mock(wraps=thaw.check_file_for_libraries)
+        with mock.patch.dict(thaw.ENGINES['line'],{'libraries':mock_check}):
+            second = thaw.search_directory_for_libraries(self.test_dir,['numpy','idna'],1,file_cache=thaw.FileResultCache(self.test_dir,cache_path))
+            self.assertEqual([call.args[0] for call in mock_check.call_args_list],[self.test_dir + '/major.py'])
+        self.assertEqual(second['idna'],first['idna'])
+        self.assertEqual(second['numpy'][0]['lines'],[3,4,5])
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForLibrariesWithFileCacheScansForNewLibraries(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        file_cache = thaw.FileResultCache(self.test_dir,os.path.join(self.test_dir,'cache.json'))
+        thaw.search_directory_for_libraries(self.test_dir,['numpy'],1,file_cache=file_cache)
+        affected = thaw.search_directory_for_libraries(self.test_dir,['numpy','pandas'],1,file_cache=file_cache)
+        self.assertEqual(affected,thaw.search_directory_for_libraries(self.test_dir,['numpy','pandas'],1))
+        self.tearDownTempDirectory()
+    
+    def testSearchDirectoryForImportsWithFileCache(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        cache_path = os.path.join(self.test_dir,'cache.json')
+        file_cache = thaw.FileResultCache(self.test_dir,cache_path)
+        first = thaw.search_directory_for_imports(self.test_dir,1,file_cache=file_cache)
+        file_cache.save()
+        mock_check = mock.Mock()
+        with mock.patch.dict(thaw.ENGINES['line'],{'imports':mock_check}):
+            second = thaw.search_directory_for_imports(self.test_dir,1,file_cache=thaw.FileResultCache(self.test_dir,cache_path))
+            mock_check.assert_not_called()
+        self.assertEqual(second,first)
+        self.tearDownTempDirectory()
+
+
+    # REPORT BUILDING TESTS --------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+    
+    def testReportWriterStreamsToStdoutAndReportFile(self):
+        self.setUpTempDirectory()
+        stdout = StringIO()
+        writer = thaw.ReportWriter(self.test_dir,stdout)
+        writer.write('\tsummary\n')
+        writer.end_summary()
+        self.assertEqual(stdout.getvalue(),'\tsummary\n\n\n\n')
+        affected = [{'file':self.test_dir + '/temp.py','lines':[3,4],'linestext':['x = 1\n','y = 2\n']}]
+        thaw.stream_report_segment(writer,self.test_dir,affected,False)
+        writer.close()
+        self.assertEqual(stdout.getvalue(),'\tsummary\n\n\n\n\n\ttemp.py\n\t\t[3, 4]\n\n\n')
+        report_file = [file for file in os.listdir(self.test_dir) if file.startswith('thaw_report')][0]
+        with open(os.path.join(self.test_dir,report_file)) as f:
+            report = f.read()
+        self.assertTrue(report.startswith('THAW REPORT RUN '))
+        self.assertTrue(report.endswith('\n\tsummary\n\n\n\ttemp.py\n\t\t[3, 4]'))
+        self.tearDownTempDirectory()
+    
+    def testWriteReportSegmentVerbose(self):
+        affected = [{'file':'/project/temp.py','lines':[3,4],'linestext':['x = 1\n','y = 2\n']}]
+        self.assertEqual(thaw.write_report_segment('/project',affected,True),'\n\ttemp.py\n\t\t3          | x = 1\n\n\t\t4          | y = 2\n')
+    
+    # DEPENDENCY SOURCES TESTS -----------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def writeProjectFiles(self,files):
+        for name, text in files.items():
+            path = os.path.join(self.test_dir,name)
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            with open(path,'w') as f:
+                f.write(text)
+
+    def dependencySummary(self):
+        return [(dependency['library'],str(dependency['specifier']),dependency['url']) for dependency in thaw.collect_dependencies(thaw.find_dependency_files(self.test_dir))]
+
+    def testParseRequirement(self):
+        requirement = thaw.parse_requirement('pandas[excel] >=1.0,<1.2; python_version >= "3.6"')
+        self.assertEqual((requirement[0],str(requirement[1]),requirement[2],requirement[3]),('pandas','>=1.0,<1.2',None,'python_version >= "3.6"'))
+        self.assertEqual(thaw.parse_requirement('git+https://github.com/psf/requests.git@v2.25.0#egg=requests')[::2],('requests','git+https://github.com/psf/requests.git@v2.25.0#egg=requests'))
+        self.assertEqual(thaw.parse_requirement('attrs @ https://example.com/attrs-20.3.0.tar.gz')[::2],('attrs','https://example.com/attrs-20.3.0.tar.gz'))
+        self.assertEqual(thaw.parse_requirement('./local/package'),None)
+
+    def testMarkerApplies(self):
+        self.assertTrue(thaw.marker_applies('python_version >= "3.6"'))
+        self.assertFalse(thaw.marker_applies('python_version < "3"'))
+        self.assertTrue(thaw.marker_applies('sys_platform == "nonexistent" or (os_name != "nonexistent" and python_version > "2.7")'))
+        self.assertFalse(thaw.marker_applies('extra == "test"'))
+        self.assertTrue(thaw.marker_applies('not a marker (('))
+
+    def testPoetryConstraint(self):
+        self.assertEqual(thaw.poetry_constraint('^1.2.3'),'>=1.2.3,<2')
+        self.assertEqual(thaw.poetry_constraint('^0.2.3'),'>=0.2.3,<0.3')
+        self.assertEqual(thaw.poetry_constraint('~1.2.3'),'>=1.2.3,<1.3')
+        self.assertEqual(thaw.poetry_constraint('1.2.3'),'==1.2.3')
+        self.assertEqual(thaw.poetry_constraint('>=1.2 <2'),'>=1.2,<2')
+        self.assertEqual(thaw.poetry_constraint('*'),'')
+
+    def testCollectDependenciesFollowsIncludesAndConstraints(self):
+        self.setUpTempDirectory()
+        self.writeProjectFiles({
+            'requirements.txt':'-r requirements/base.txt\n-c constraints.txt\nDjango>=3.0 \\\n    --hash=sha256:abc\nold-thing==1.0; python_version < "3.0"\n-e .\n--index-url https://example.com/simple\n',
+            'requirements/base.txt':'numpy==1.19.0  # pinned\n-r ../requirements.txt\n',
+            'requirements/dev.txt':'NumPy>=1.18\ngit+https://github.com/psf/requests.git#egg=requests\n',
+            'constraints.txt':'django<3.2\nflask<2\n',
+        })
+        self.assertEqual(self.dependencySummary(),[
+            ('numpy','==1.19.0,>=1.18',None),
+            ('Django','>=3.0,<3.2',None),
+            ('requests','','git+https://github.com/psf/requests.git#egg=requests'),
+        ])
+        self.tearDownTempDirectory()
+
+    @unittest.skipIf(thaw.tomllib is None,"needs tomllib (python 3.11+) or tomli")
+    def testCollectDependenciesMergesProjectFilesAndLockfiles(self):
+        self.setUpTempDirectory()
+        self.writeProjectFiles({
+            'pyproject.toml':'[project]\ndependencies = ["PyYAML>=5.1"]\n[project.optional-dependencies]\ntest = ["coverage[toml]~=5.0"]\n[tool.poetry.dependencies]\npython = "^3.8"\nclick = "^7.1.2"\n',
+            'setup.cfg':'[options]\ninstall_requires =\n    six>=1.15\n[options.extras_require]\ndocs = sphinx<4\n',
+            'Pipfile.lock':'{"default":{"pandas":{"version":"==1.1.0"}},"develop":{"flake8":{"git":"https://github.com/pycqa/flake8"}}}',
+            'poetry.lock':'[[package]]\nname = "pyyaml"\nversion = "5.3.1"\n',
+        })
+        self.assertEqual(self.dependencySummary(),[
+            ('PyYAML','>=5.1,==5.3.1',None),
+            ('coverage','~=5.0',None),
+            ('click','>=7.1.2,<8',None),
+            ('six','>=1.15',None),
+            ('sphinx','<4',None),
+            ('pandas','==1.1.0',None),
+            ('flake8','','https://github.com/pycqa/flake8'),
+        ])
+        self.tearDownTempDirectory()
+
+    def testReadDependencyFileIsMemoizedUntilFileChanges(self):
+        self.setUpTempDirectory()
+        self.writeProjectFiles({'requirements.txt':'numpy==1.19.0\n'})
+        path = os.path.join(self.test_dir,'requirements.txt')
+        with mock.patch.object(thaw,'parse_requirements_text',wraps=thaw.parse_requirements_text) as parse_text:
+            thaw.read_dependency_file(path)
+            thaw.read_dependency_file(path)
+            self.assertEqual(parse_text.call_count,1)
+            with open(path,'w') as f:
+                f.write('numpy==1.19.1\npandas\n')
+            self.assertEqual(len(thaw.read_dependency_file(path)),2)
+            self.assertEqual(parse_text.call_count,2)
+        self.tearDownTempDirectory()
+
+    def testIsDependencyFile(self):
+        for filepath in ['/p/requirements-dev.txt','/p/constraints.txt','/p/requirements/base.txt','/p/pyproject.toml','/p/poetry.lock']:
+            self.assertTrue(thaw.is_dependency_file(filepath),filepath)
+        for filepath in ['/p/notes.txt','/p/setup.py','/p/docs/conf.toml']:
+            self.assertFalse(thaw.is_dependency_file(filepath),filepath)
+    
+    # AST ENGINE TESTS -------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+    
+    def testCheckFileForLibrariesAstMatchesLineEngineOnSimpleFiles(self):
+        texts = [
+            'import idna #line1\n#line2\nprint(idna.decode("xn--eckwd4c7c.xn--zckzah")) #line3',
+            'from datetime import date, time #1\n#2\ntoday = date.today() #3\nepoch = time.time() #4',
+            'import datetime as dt #1\n#2\nelapsed = dt.timedelta(2) #3\nelapsed2 = dt.timedelta(3) #4',
+            'from datetime import date as d #1\n#2\nd.today() #3',
+            'import datetime #1\n#2\ndelta = datetime.timedelta(2) #3\n#4\ndelta * 2 #5',
+        ]
+        self.setUpTempDirectory()
+        for text in texts:
+            self.createTempDotPyFile(text)
+            filepath = os.path.join(self.test_dir, 'temp.py')
+            library = 'idna' if 'idna' in text else 'datetime'
+            self.assertEqual(thaw.check_file_for_libraries_ast(filepath,[library]),thaw.check_file_for_libraries(filepath,[library]))
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesAstIgnoresStringsAndUnrelatedAttributes(self):
+        text = 'import os #1\nlabel = "os is imported" #2\npath = os.getcwd() #3\nconfig.os = 3 #4\nprint(path) #5\npath = "elsewhere" #6\nprint(path) #7'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_libraries_ast(os.path.join(self.test_dir, 'temp.py'),['os'])['os']['linenums'],[3,5])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesAstFollowsLoopsAndWithStatements(self):
+        text = 'import pandas as pd\ndf = pd.DataFrame()\nfor index, row in df.iterrows():\n    print(row)\nwith pd.ExcelWriter("out.xlsx") as writer:\n    writer.close()'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_libraries_ast(os.path.join(self.test_dir, 'temp.py'),['pandas'])['pandas']['linenums'],[2,3,4,5,6])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesAstKeepsBindingsFromOtherBranches(self):
+        text = 'try:\n    import numpy as np\nexcept ImportError:\n    np = None\n\nx = np.zeros(3)\nprint(np.sum(x))'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_libraries_ast(os.path.join(self.test_dir, 'temp.py'),['numpy'])['numpy']['linenums'],[6,7])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesAstCountsAnnotations(self):
+        text = 'import numpy as np\narr: np.ndarray\ndef f(a: np.ndarray) -> None:\n    return None\nif arr is None:\n    y = np.ones(2)\nelse:\n    y = 1\nprint(y)'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_libraries_ast(os.path.join(self.test_dir, 'temp.py'),['numpy'])['numpy']['linenums'],[2,3,6,9])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForLibrariesAstFallsBackToLineEngineOnSyntaxError(self):
+        text = 'import idna #line1\n#line2\nprint idna.decode("xn--eckwd4c7c.xn--zckzah") #line3'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_libraries_ast(os.path.join(self.test_dir, 'temp.py'),['idna'])['idna']['linenums'],[3])
+        self.tearDownTempDirectory()
+    
+    def testCheckFileForImportsAst(self):
+        text = 'import os.path, sys\nfrom datetime import date\nfrom . import sibling\nimportant = True\nimport numpy as np'
+        self.setUpTempDirectory()
+        self.createTempDotPyFile(text)
+        self.assertEqual(thaw.check_file_for_imports_ast(os.path.join(self.test_dir, 'temp.py')),['os','sys','datetime','numpy'])
+        self.tearDownTempDirectory()
+
+
+    # SCAN API TESTS ---------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+    
+    def testScanLibraries(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        scanner = thaw.Scanner(jobs=1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')))
+        result = scanner.scan(self.test_dir,libraries=['numpy','pandas'])
+        self.assertEqual(result.mode,'library')
+        self.assertEqual([record['library'] for record in result.libraries],['numpy','pandas'])
+        self.assertEqual(result.library('numpy')['affected'],thaw.search_directory_for_library(self.test_dir,'numpy'))
+        self.assertEqual(result.library('idna'),None)
+        self.tearDownTempDirectory()
+    
+    def testScanWithoutRequirementsFileHasMessage(self):
+        self.setUpTempDirectory()
+        self.createTempDotPyFile('import numpy')
+        scanner = thaw.Scanner(jobs=1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')))
+        result = scanner.scan(self.test_dir)
+        self.assertEqual(result.mode,'requirements')
+        self.assertEqual(result.libraries,[])
+        self.assertTrue(result.message.startswith('No requirements file found'))
+        self.tearDownTempDirectory()
+    
+    def testScanRejectsUnknownMode(self):
+        self.setUpTempDirectory()
+        scanner = thaw.Scanner(jobs=1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')))
+        self.assertRaises(thaw.WrongAssumptionError,scanner.scan,self.test_dir,'everything')
+        self.tearDownTempDirectory()
+    
+    def testScannerReusesFileCacheBetweenScans(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        with mock.patch.dict(os.environ,{'THAW_CACHE_DIR':os.path.join(self.test_dir,'cache')}):
+            scanner = thaw.Scanner(jobs=1,incremental=True)
+            first = scanner.scan(self.test_dir,'library',['numpy'])
+            mock_check = mock.Mock(wraps=thaw.check_file_for_libraries)
+            with mock.patch.dict(thaw.ENGINES['line'],{'libraries':mock_check}):
+                second = scanner.scan(self.test_dir,'library',['numpy'])
+                mock_check.assert_not_called()
+        self.assertEqual(second.libraries,first.libraries)
+        self.assertEqual(len(scanner.file_caches),1)
+        self.tearDownTempDirectory()
+    
+    def testScannerReusesWorkerProcessesAcrossScans(self):
+        self.setUpTempDirectory()
+        for n in range(8):
+            self.createTempDotPyFile(f'import numpy as np #1\n\na = np.arange({n}) #3\nprint(a) #4','file' + str(n))
+        with mock.patch.object(thaw,'MIN_FILES_PER_JOB',1), mock.patch.object(thaw,'ProcessPoolExecutor',wraps=thaw.ProcessPoolExecutor) as executor:
+            with thaw.Scanner(jobs=2) as scanner:
+                results = [scanner.scan(self.test_dir,libraries=['numpy']) for i in range(3)]
+                self.assertTrue(scanner.pool.executor is not None)
+            self.assertEqual(executor.call_count,1)
+        self.assertTrue(scanner.pool.executor is None)
+        self.assertEqual(len(results[2].library('numpy')['affected']),8)
+        self.tearDownTempDirectory()
+    
+    def testModuleScanSharesOneScanner(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        with mock.patch.dict(os.environ,{'THAW_CACHE_DIR':os.path.join(self.test_dir,'cache')}), mock.patch.object(thaw,'_default_scanner',None):
+            thaw.scan(self.test_dir,libraries=['numpy'])
+            scanner = thaw._default_scanner
+            result = thaw.scan(self.test_dir,libraries=['numpy'])
+            self.assertTrue(thaw._default_scanner is scanner)
+        self.assertEqual(len(result.library('numpy')['affected']),1)
+        self.tearDownTempDirectory()
+
+
+    # WATCH TESTS ------------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+    
+    def testProjectWatcherReportsChangedAddedAndRemovedFiles(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        watcher = thaw.ProjectWatcher(self.test_dir)
+        self.assertEqual(watcher.poll(),[])
+        os.utime(os.path.join(self.test_dir,'major.py'),ns=(0,0))
+        self.createTempDotPyFile('import os','new')
+        os.remove(os.path.join(self.test_dir,'minor.py'))
+        with open(os.path.join(self.test_dir,'notes.txt'),'w') as f:
+            f.write('not watched')
+        self.assertEqual(watcher.poll(),[self.test_dir + '/major.py',self.test_dir + '/minor.py',self.test_dir + '/new.py'])
+        self.assertEqual(watcher.poll(),[])
+        self.tearDownTempDirectory()
+    
+    def testScanChangedSinceKeepsOnlyChangedLibraries(self):
+        before = thaw.Scan('library','dir',[{'library':'numpy','affected':[]},{'library':'idna','affected':[]}])
+        after = thaw.Scan('library','dir',[{'library':'numpy','affected':[]},{'library':'idna','affected':[{'file':'dir/a.py','lines':[1],'linestext':['x']}]}])
+        self.assertEqual([record['library'] for record in after.changed_since(before).libraries],['idna'])
+        self.assertEqual(after.changed_since(after).libraries,[])
+    
+    def testWatchDirectoryReportsOnlyChangedSections(self):
+        self.setUpTempDirectory()
+        self.createTempRequirementsDotTxt('all')
+        scanner = thaw.Scanner(jobs=1,cache=thaw.MetadataCache(os.path.join(self.test_dir,'metadata.json')),keep_results=True)
+        previous = scanner.scan(self.test_dir,'library',['numpy','idna'])
+        def editFile(interval):
+            self.createTempDotPyFile('import numpy as np\n\nb = np.ones(3)\nb += 1\nprint(b)','major')
+            os.utime(os.path.join(self.test_dir,'major.py'),ns=(1,1))
+        stdout = StringIO()
+        mock_check = mock.Mock(wraps=thaw.check_file_for_libraries)
+        with mock.patch('time.sleep',side_effect=editFile), mock.patch.dict(thaw.ENGINES['line'],{'libraries':mock_check}):
+            thaw.watch_directory(scanner,previous,thaw.ReportWriter(stdout=stdout),polls=1)
+        self.assertEqual([call.args[0] for call in mock_check.call_args_list],[self.test_dir + '/major.py'])
+        report = stdout.getvalue()
+        self.assertTrue('1 files changed' in report)
+        self.assertTrue('numpy' in report and '[3, 4, 5]' in report and 'idna' not in report)
+        self.tearDownTempDirectory()
+
     
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1 @@
+from .thaw import Scan, Scanner, scan
@@ -9,28 +9,104 @@ Installation::
     $ pip install thaw
 
 Usage::
-    $ python -m thaw ~/directory/to/search [-h] [-i IMPORTS] [-l LIBRARY] [-o OUT] [-v VERBOSE]
+    $ python -m thaw ~/directory/to/search [-h] [-i IMPORTS] [-l LIBRARY] [-o OUT] [-v VERBOSE] [-j JOBS] [--index-url INDEX_URL] [--refresh] [--offline] [--cache-ttl CACHE_TTL] [--timeout TIMEOUT] [--deadline DEADLINE] [--retries RETRIES] [--incremental] [--engine {ast,line}] [-e [GLOB ...]] [-w] [--stats] [--profile PROFILE] [-f {json,jsonl,text}]
     
 Flags::
     --imports                   => searches for libraries in import statements rather than requirements.txt file
     --library [lib1 lib2 ...]   => searches for specified library/ies regardless of version status
     --out [directory path]      => creates report .txt file in specified directory
     --verbose                   => includes line text in report, not just line numbers where outdated libraries are used
+    --jobs [n]                  => number of processes to scan files with (defaults to number of CPUs)
+    --index-url [url]           => base url of package index to check versions against (defaults to https://pypi.org);
+                                   can also be a simple index url (ending in /simple or /+simple), or a local
+                                   wheelhouse or simple-index directory (path or file:// url)
+    --refresh                   => ignores cached package versions and looks every library up again
+    --offline                   => only uses cached package versions, never contacts the package index
+    --cache-ttl [seconds]       => how long cached package versions stay fresh (defaults to one day)
+    --timeout [seconds]         => how long to wait on any one request to the package index (defaults to 10)
+    --deadline [seconds]        => how long all version lookups may take together (defaults to 60)
+    --retries [n]               => times to retry a failed request to the package index (defaults to 2)
+    --incremental               => reuses results from the last run for files that haven't changed
+    --engine [line|ast]         => analyzes files line by line (default) or by parsing them with ast
+    --format [text|json|jsonl]  => writes the report as plain text (default), json, or json lines
+    --watch                     => keeps running and reports changed sections whenever project files change
+    --exclude [glob1 glob2 ...] => skips matching files and directories (.gitignore entries are always skipped)
+    --stats                     => prints time, files, bytes, requests, cache hits/misses and peak resident memory per phase
+    --profile [path]            => writes cProfile data for the scan to path
 """
 import argparse
+from array import array
+import ast
+import configparser
+import cProfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 from datetime import datetime as dt
 import fnmatch
+import functools
+import gzip
+import hashlib
+import http.client
+import json
+import mmap
 import os
 import platform
+import random
+import re
 import subprocess
 import sys
-from urllib import request
+import tempfile
+import threading
+import time
+import tokenize
+from urllib import parse
+
+try:
+    import tomllib
+except ImportError: # python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+MIN_FILES_PER_JOB = 32
+PYPI_URL = "https://pypi.org"
+LOOKUP_WORKERS = 16
+MAX_REDIRECTS = 3
+REQUEST_TIMEOUT = 10
+LOOKUP_DEADLINE = 60
+LOOKUP_RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+CACHE_TTL = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 5000
+FILE_CACHE_FORMAT = 2
+MANIFEST_FORMAT = 2
+MMAP_THRESHOLD = 1 << 20
+REPORT_BUFFER_SIZE = 1 << 16
+WATCH_INTERVAL = 0.5
+WORD = re.compile("[A-Za-z0-9_]+")
+WORD_BYTES = re.compile(rb"[A-Za-z0-9_]+")
+PRUNED_DIRECTORIES = {'.git','.hg','.svn','.tox','.nox','venv','.venv','node_modules','build','site-packages','__pycache__','.mypy_cache','.pytest_cache','.eggs'}
+
+_thread_connections = threading.local()
+_stats = None
 
 class WrongAssumptionError(Exception):
     def __init__(self,expression,message):
         self.expression = expression
         self.message = message
 
+class IndexUnavailableError(WrongAssumptionError):
+    pass
+
 # -----------------------------------------------------------
 # HELPER FUNCTIONS ------------------------------------------
 # -----------------------------------------------------------
@@ -41,19 +117,32 @@ def version_update_scale(old_version_string, new_version_string):
     and returns "major" "minor" or "micro" to indicate scale of update required to get to new.
     Returns None if the versions are the same
     
-    major -> 1.x to 2.x
+    major -> 1.x to 2.x (or a new epoch)
     minor -> 1.4 to 1.7
-    micro ->  1.4.3 to 1.4.4
+    micro ->  1.4.3 to 1.4.4 (or any other newer version, like 1.4rc1 to 1.4 or 1.4 to 1.4.post1)
+    
+    Versions are compared as PEP 440 versions, so None is also returned if new is older than
+    old. Versions that don't parse are compared segment by segment as strings.
     """
-    old_version = old_version_string.split('.')
-    new_version = new_version_string.split('.')
+    old_version = parse_version(old_version_string)
+    new_version = parse_version(new_version_string)
+    if old_version is None or new_version is None:
+        old_parts = (old_version_string.split('.') + ['0','0'])[:3]
+        new_parts = (new_version_string.split('.') + ['0','0'])[:3]
+        if old_parts[0] != new_parts[0]:
+            return "major"
+        elif old_parts[1] != new_parts[1]:
+            return "minor"
+        elif old_version_string == new_version_string:
+            return None
+        return "micro"
     
-    if old_version[0] != new_version[0]:
+    if new_version <= old_version:
+        return None
+    elif old_version.epoch != new_version.epoch or old_version.part(0) != new_version.part(0):
         return "major"
-    elif old_version[1] != new_version[1]:
+    elif old_version.part(1) != new_version.part(1):
         return "minor"
-    elif old_version == new_version:
-        return None
     else:
         return "micro"
 
@@ -107,35 +196,605 @@ def check_line_for_new_variable(library_name,line_string):
     else:                                                                                                                                                                                                                                                                                                                                                     
         return [line_string.split('=')[0].strip()]
     
+# -----------------------------------------------------------
+
+class KeywordMatcher:
+    '''
+    Matches a growing set of keywords against lines. Keywords that are plain names (the
+    usual case: aliases and variables) are kept in a set and looked up against each word
+    of the line, so adding one costs nothing no matter how many variables pile up. Any
+    other keywords go in one alternation regex that is only rebuilt when one is added.
+    Like library_instance_not_subword, a keyword only matches when it isn't part of a 
+    longer name. Keywords and lines can be str or bytes (but not a mix of both).
+    
+    ex:
+    matcher = KeywordMatcher(['os'])
+    matcher.search('pathname = os.path.dirname("file")')
+    >> 'os'
+    matcher.search('total_cost = item_price + tax')
+    >> None
+    '''
+    def __init__(self,keywords=()):
+        self.keywords = set()
+        self.names = set()
+        self.escaped = []
+        self.pattern = None
+        for keyword in keywords:
+            self.add(keyword)
+    
+    def add(self,keyword):
+        if keyword and keyword not in self.keywords:
+            self.keywords.add(keyword)
+            if word_pattern(keyword).fullmatch(keyword):
+                self.names.add(keyword)
+            else:
+                self.escaped.append(re.escape(keyword))
+                self.pattern = None
+    
+    def compile(self):
+        alternatives = sorted(self.escaped,key=len,reverse=True)
+        if isinstance(alternatives[0], bytes):
+            self.pattern = re.compile(rb"(?<![A-Za-z0-9_])(?:" + b'|'.join(alternatives) + rb")(?![A-Za-z0-9_])")
+        else:
+            self.pattern = re.compile("(?<![A-Za-z0-9_])(?:" + '|'.join(alternatives) + ")(?![A-Za-z0-9_])")
+    
+    def search(self,line):
+        '''
+        returns the first keyword found in line as a whole word, or None
+        '''
+        found = None
+        if self.names:
+            for word in word_pattern(line).finditer(line):
+                if word.group(0) in self.names:
+                    found = word
+                    break
+        if self.escaped:
+            if self.pattern is None:
+                self.compile()
+            match = self.pattern.search(line)
+            if match and (found is None or match.start() < found.start() or (match.start() == found.start() and match.end() > found.end())):
+                found = match
+        if found:
+            return found.group(0)
+        return None
+
+def word_pattern(text):
+    return WORD_BYTES if isinstance(text, bytes) else WORD
+
+# -----------------------------------------------------------
+# VERSIONS --------------------------------------------------
+# -----------------------------------------------------------
+
+VERSION_PATTERN = re.compile(r'''
+    v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>[-_.]?(?P<pre_label>alpha|a|beta|b|preview|pre|c|rc)[-_.]?(?P<pre_number>[0-9]+)?)?
+    (?P<post>-(?P<post_implicit>[0-9]+)|[-_.]?(?:post|rev|r)[-_.]?(?P<post_number>[0-9]+)?)?
+    (?P<dev>[-_.]?dev[-_.]?(?P<dev_number>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+''',re.VERBOSE | re.IGNORECASE)
+PRE_RELEASE_RANK = {'a':0,'alpha':0,'b':1,'beta':1,'c':2,'rc':2,'pre':2,'preview':2}
+SPECIFIER_PATTERN = re.compile(r'^\s*(~=|===|==|!=|<=|>=|<|>)\s*([^\s,;]+)\s*$')
+
+@functools.total_ordering
+class Version:
+    '''
+    A PEP 440 version, parsed once - use parse_version, which memoizes them. Versions compare
+    by what they mean rather than how they're written, so 1.0 == 1.0.0 and
+    1.0.dev1 < 1.0a1 < 1.0rc1 < 1.0 < 1.0.post1 < 1.1. text keeps the string as written.
+    '''
+    __slots__ = ('text','epoch','release','pre','post','dev','local','key')
+    
+    def __init__(self,text):
+        match = VERSION_PATTERN.fullmatch(text.strip())
+        if not match:
+            raise WrongAssumptionError('Version',f"'{text}' is not a PEP 440 version")
+        self.text = text
+        self.epoch = int(match.group('epoch') or 0)
+        self.release = tuple(int(part) for part in match.group('release').split('.'))
+        self.pre = (PRE_RELEASE_RANK[match.group('pre_label').lower()], int(match.group('pre_number') or 0)) if match.group('pre') else None
+        self.post = int(match.group('post_implicit') or match.group('post_number') or 0) if match.group('post') else None
+        self.dev = int(match.group('dev_number') or 0) if match.group('dev') else None
+        local = match.group('local')
+        self.local = tuple((1, int(part), '') if part.isdigit() else (0, 0, part.lower()) for part in re.split(r'[-_.]',local)) if local else ()
+        release = list(self.release)
+        while len(release) > 1 and release[-1] == 0:
+            release.pop()
+        if self.pre is None and self.post is None and self.dev is not None:
+            pre = (-1,)
+        else:
+            pre = (1,) if self.pre is None else (0,) + self.pre
+        post = (-1,) if self.post is None else (0, self.post)
+        dev = (1,) if self.dev is None else (0, self.dev)
+        self.key = (self.epoch, tuple(release), pre, post, dev, self.local)
+    
+    @property
+    def public(self):
+        '''the comparison key without the local version label'''
+        return self.key[:5]
+    
+    @property
+    def base(self):
+        '''the comparison key of just the epoch and release'''
+        return self.key[:2]
+    
+    @property
+    def is_prerelease(self):
+        return self.pre is not None or self.dev is not None
+    
+    @property
+    def is_postrelease(self):
+        return self.post is not None
+    
+    def part(self,index):
+        '''release segment index (0 for major, 1 for minor, 2 for micro), 0 if it isn't written'''
+        return self.release[index] if index < len(self.release) else 0
+    
+    def __eq__(self,other):
+        return isinstance(other,Version) and self.key == other.key
+    
+    def __lt__(self,other):
+        return self.key < other.key
+    
+    def __hash__(self):
+        return hash(self.key)
+    
+    def __str__(self):
+        return self.text
+    
+    def __repr__(self):
+        return f"Version('{self.text}')"
+
+@functools.lru_cache(maxsize=16384)
+def parse_version(text):
+    '''
+    returns the Version for text, or None if it isn't a PEP 440 version. Memoized, so a run
+    parses each distinct version string once however many projects and lookups share it.
+    '''
+    try:
+        return Version(text)
+    except WrongAssumptionError:
+        return None
+
+class Specifier:
+    '''
+    One PEP 440 version clause, like '>=1.4', '~=2.2', '==1.19.*' or '!=1.3.0'
+    '''
+    __slots__ = ('text','operator','version','wildcard')
+    
+    def __init__(self,text):
+        match = SPECIFIER_PATTERN.match(text)
+        if not match:
+            raise WrongAssumptionError('Specifier',f"'{text}' is not a version specifier")
+        self.text = text.strip()
+        self.operator, version = match.groups()
+        self.wildcard = self.operator in ('==','!=') and version.endswith('.*')
+        if self.operator == '===':
+            self.version = version
+            return
+        self.version = parse_version(version[:-2] if self.wildcard else version)
+        if self.version is None or (self.operator == '~=' and len(self.version.release) < 2):
+            raise WrongAssumptionError('Specifier',f"'{text}' is not a version specifier")
+    
+    @property
+    def prerelease(self):
+        '''True if the clause names a pre-release, which lets pre-releases match it'''
+        return self.operator in ('==','>=','<=','~=') and self.version.is_prerelease
+    
+    def matches_prefix(self,version,prefix):
+        if version.epoch != self.version.epoch:
+            return False
+        release = version.release + (0,) * max(0,len(prefix) - len(version.release))
+        return release[:len(prefix)] == prefix
+    
+    def contains(self,version):
+        '''
+        returns True if version (a Version) satisfies the clause
+        '''
+        operator, spec = self.operator, self.version
+        if operator == '===':
+            return version.text.strip().lower() == spec.lower()
+        if operator in ('==','!='):
+            if self.wildcard:
+                matched = self.matches_prefix(version,spec.release)
+            elif spec.local:
+                matched = version.key == spec.key
+            else:
+                matched = version.public == spec.public
+            return matched if operator == '==' else not matched
+        if operator == '~=':
+            return version.public >= spec.public and self.matches_prefix(version,spec.release[:-1])
+        if operator == '<=':
+            return version.public <= spec.public
+        if operator == '>=':
+            return version.public >= spec.public
+        if operator == '<':
+            # <1.0 doesn't let in 1.0's own pre-releases (unless it names one itself)
+            return version.public < spec.public and not (version.is_prerelease and not spec.is_prerelease and version.base == spec.base)
+        # >1.0 doesn't let in 1.0's own post-releases or local versions
+        return version.public > spec.public and not (version.is_postrelease and not spec.is_postrelease and version.base == spec.base)
+    
+    def __str__(self):
+        return self.text
+
+class SpecifierSet:
+    '''
+    The version clauses of a requirement, like '>=1.0,!=1.3.*,<2'; a version has to satisfy
+    all of them. An empty set allows any version. Use parse_specifiers, which memoizes them.
+    '''
+    __slots__ = ('text','specifiers')
+    
+    def __init__(self,text=''):
+        self.text = text.strip()
+        self.specifiers = tuple(Specifier(part) for part in text.split(',') if part.strip())
+    
+    @property
+    def pinned(self):
+        '''the version as written if a clause is an exact pin ('==1.2.3'), else None'''
+        for specifier in self.specifiers:
+            if specifier.operator in ('==','===') and not specifier.wildcard:
+                return str(specifier.version)
+        return None
+    
+    def contains(self,version,prereleases=None):
+        '''
+        returns True if version (a string or Version) satisfies every clause. Pre-releases 
+        only match if prereleases is True, or by default if one of the clauses names one.
+        '''
+        if not isinstance(version,Version):
+            version = parse_version(version)
+            if version is None:
+                return False
+        if prereleases is None:
+            prereleases = any(specifier.prerelease for specifier in self.specifiers)
+        if version.is_prerelease and not prereleases:
+            return False
+        return all(specifier.contains(version) for specifier in self.specifiers)
+    
+    def best(self,versions):
+        '''
+        returns the newest of versions (strings) the set allows, as written, or None. Like pip,
+        pre-releases are only picked when nothing else is allowed, unless a clause names one.
+        Versions that don't parse are skipped.
+        '''
+        parsed = [version for version in map(parse_version,versions) if version is not None]
+        allowed = [version for version in parsed if self.contains(version)]
+        if len(allowed) == 0:
+            allowed = [version for version in parsed if self.contains(version,True)]
+        if len(allowed) == 0:
+            return None
+        return max(allowed).text
+    
+    def __bool__(self):
+        return len(self.specifiers) > 0
+    
+    def __str__(self):
+        return self.text
+    
+    def __repr__(self):
+        return f"SpecifierSet('{self.text}')"
+
+@functools.lru_cache(maxsize=4096)
+def parse_specifiers(text):
+    '''
+    returns the SpecifierSet for text, or None if it isn't valid. Memoized like parse_version.
+    '''
+    try:
+        return SpecifierSet(text)
+    except WrongAssumptionError:
+        return None
+
+def latest_version(versions):
+    '''
+    returns the newest version, preferring final releases over pre-releases the way pypi 
+    reports a project's latest version; None if versions is empty
+    '''
+    return parse_specifiers('').best(versions)
+
+# -----------------------------------------------------------
+# INSTRUMENTATION -------------------------------------------
+# -----------------------------------------------------------
+
+STAT_COUNTERS = ['files','bytes','requests','cache_hits','cache_misses']
+
+class Stats:
+    '''
+    Collects per-phase numbers for --stats: wall time, files and bytes read, network
+    requests, cache hits and misses (index lookups and incremental file results), and the peak
+    resident memory of thaw and its worker processes at the end of the phase. The peak only ever
+    grows, so a phase that raises it is the one that used the memory. Collection only happens
+    inside collect_stats.
+    '''
+    def __init__(self):
+        self.phases = {}
+        self.stack = []
+        self.lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def phase(self,name):
+        phase = self.phases.setdefault(name,dict({'seconds':0.0,'peak_memory':0},**{counter: 0 for counter in STAT_COUNTERS}))
+        self.stack.append(phase)
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase['seconds'] += time.perf_counter() - start
+            phase['peak_memory'] = max(phase['peak_memory'],peak_memory())
+            self.stack.pop()
+    
+    def count(self,counter,n=1):
+        with self.lock:
+            if self.stack:
+                self.stack[-1][counter] += n
+    
+    def totals(self):
+        totals = {'seconds':0.0,'peak_memory':0}
+        for counter in STAT_COUNTERS:
+            totals[counter] = 0
+        for phase in self.phases.values():
+            for key, value in phase.items():
+                totals[key] = max(totals[key],value) if key == 'peak_memory' else totals[key] + value
+        return totals
+    
+    def table(self):
+        '''
+        returns the stats as a plain text table, one row per phase plus a total row
+        '''
+        header = f"{'phase':<12} | {'seconds':>9} | {'files':>7} | {'bytes':>12} | {'requests':>8} | {'cache hits':>10} | {'cache misses':>12} | {'peak rss':>11}\n"
+        rows = [header]
+        for name, phase in list(self.phases.items()) + [('total',self.totals())]:
+            rows.append(f"{name:<12} | {phase['seconds']:>9.3f} | {phase['files']:>7} | {phase['bytes']:>12} | {phase['requests']:>8} | {phase['cache_hits']:>10} | {phase['cache_misses']:>12} | {format_bytes(phase['peak_memory']):>11}\n")
+        return ''.join(rows)
+
+def peak_memory():
+    '''
+    returns the peak resident memory in bytes of this process or its largest worker process,
+    or 0 where the resource module isn't available
+    '''
+    if resource is None:
+        return 0
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == 'darwin' else peak * 1024 # kilobytes everywhere but macOS
+
+def format_bytes(size):
+    for unit in ['B','KB','MB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+@contextlib.contextmanager
+def collect_stats(stats):
+    '''
+    makes stats (a Stats) collect numbers for everything thaw does inside the with block
+    '''
+    global _stats
+    previous = _stats
+    _stats = stats
+    try:
+        yield stats
+    finally:
+        _stats = previous
+
+def stats_phase(name):
+    if _stats is None:
+        return contextlib.nullcontext()
+    return _stats.phase(name)
+
+def count_stat(counter,n=1):
+    if _stats is not None:
+        _stats.count(counter,n)
+
 # -----------------------------------------------------------
 # PYPI / LOCAL SEARCH ---------------------------------------
 # -----------------------------------------------------------
 
-def get_library_source(library,project_dir):
+def library_is_local(library,project_dir,local_modules=None):
+    '''
+    returns True if library is a module or package inside project_dir.
+    local_modules is the 'modules' set from index_project; the project is indexed if it isn't given
+    '''
+    if local_modules is None:
+        local_modules = index_project(project_dir)['modules']
+    return library in local_modules
+
+def get_library_source(library,project_dir,index_url=PYPI_URL,cache=None,local_modules=None):
     '''
     Takes in library name string and project directory location
     Outputs "pypi", "local", or "other" depending on whether the library 
     is a dependency found on pypi, a local dependency within the project, 
-    or something else/not found in the project
-    '''
-    local = False
-    for root, dirs, files in os.walk(project_dir):
-        for file in files:
-            if file == f"{library}.py":
-                local = True
-    if local:
+    or something else/not found in the project ("unknown" if the index can't be reached)
+    '''
+    if library_is_local(library,project_dir,local_modules):
         return "local"
     else:
-        url = f"https://pypi.org/project/{library}/"
-        try:
-            result = request.urlopen(url)
-            return "pypi"
-        except:
-            return "other"
+        return fetch_library_metadata(library,index_url,cache)['source']
+
+# -----------------------------------------------------------
+
+def fetch_url(url,timeout=None):
+    '''
+    GETs url and returns (status, body bytes). Connections are kept alive and reused
+    per thread and per host, so repeated lookups don't pay for a new TLS handshake each time.
+    Asks for a gzipped response (the body returned is decompressed). Follows redirects. Raises on connection errors, or if the index doesn't answer within
+    timeout seconds (no limit if None).
+    '''
+    for redirect in range(MAX_REDIRECTS + 1):
+        parts = parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        for attempt in range(2):
+            connection = get_connection(parts.scheme,parts.netloc,timeout)
+            count_stat('requests')
+            try:
+                connection.request('GET',path,headers={'Accept-Encoding':'gzip'})
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError):
+                # server closed an idle keep-alive connection; reconnect once
+                close_connection(parts.scheme,parts.netloc)
+                if attempt == 1:
+                    raise
+            except Exception:
+                # e.g. a timeout part way through a response; the connection can't be reused
+                close_connection(parts.scheme,parts.netloc)
+                raise
+        if response.will_close:
+            close_connection(parts.scheme,parts.netloc)
+        if (response.getheader('Content-Encoding') or '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            url = parse.urljoin(url,response.getheader('Location'))
+        else:
+            return response.status, body
+    raise WrongAssumptionError('fetch_url',f"too many redirects for {url}")
+
+def thread_connections():
+    if not hasattr(_thread_connections,'connections'):
+        _thread_connections.connections = {}
+    return _thread_connections.connections
+
+def get_connection(scheme,netloc,timeout=None):
+    connections = thread_connections()
+    if (scheme, netloc) not in connections:
+        if scheme == 'https':
+            connections[(scheme, netloc)] = http.client.HTTPSConnection(netloc,timeout=timeout)
+        elif scheme == 'http':
+            connections[(scheme, netloc)] = http.client.HTTPConnection(netloc,timeout=timeout)
+        else:
+            raise WrongAssumptionError('get_connection',f"unsupported url scheme '{scheme}'")
+    connection = connections[(scheme, netloc)]
+    connection.timeout = timeout
+    if connection.sock:
+        connection.sock.settimeout(timeout)
+    return connection
+
+def close_connection(scheme,netloc):
+    connections = thread_connections()
+    connection = connections.pop((scheme, netloc),None)
+    if connection:
+        connection.close()
+
+class PicklableLock:
+    '''
+    For classes that guard their state with self.lock: a lock can't be pickled, so it's 
+    left out, and each process that unpickles the object (see batch_scan) gets a fresh one
+    '''
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+class NetworkPolicy(PicklableLock):
+    '''
+    How hard to try the package index before giving up, so a slow or dead index can't stall
+    a run. Shared by every lookup of a run (and the threads making them).
+    
+    timeout   => seconds to wait on any one request (None for no limit)
+    deadline  => seconds all the lookups since start() may take together (None for no limit)
+    retries   => times a request is retried after a connection error, timeout or 429/5xx
+                 answer, waiting a random 0 to backoff * 2**attempt seconds before each retry
+    failure_threshold, cooldown => circuit breaker: after failure_threshold failed requests 
+                 in a row, no requests are made for cooldown seconds (then one is let through 
+                 to see if the index is back)
+    '''
+    def __init__(self,timeout=REQUEST_TIMEOUT,deadline=LOOKUP_DEADLINE,retries=LOOKUP_RETRIES,backoff=RETRY_BACKOFF,failure_threshold=BREAKER_THRESHOLD,cooldown=BREAKER_COOLDOWN):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+        self.skipped = 0
+        self.start()
+    
+    def start(self):
+        '''
+        starts the clock on the total deadline
+        '''
+        self.started = time.monotonic()
+    
+    def remaining(self):
+        if self.deadline is None:
+            return float('inf')
+        return self.deadline - (time.monotonic() - self.started)
+    
+    @property
+    def tripped(self):
+        with self.lock:
+            return self.opened is not None and time.monotonic() - self.opened < self.cooldown
+    
+    def allows(self):
+        '''
+        returns False if the breaker is open or the deadline has passed
+        '''
+        return not self.tripped and self.remaining() > 0
+    
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+    
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+    
+    def request_timeout(self):
+        '''
+        seconds the next request may take: the timeout, cut short by the deadline (None if neither is set)
+        '''
+        timeout = self.remaining()
+        if self.timeout is not None:
+            timeout = min(self.timeout,timeout)
+        return None if timeout == float('inf') else timeout
+    
+    def fetch(self,url):
+        '''
+        fetch_url under this policy: returns (status, body bytes), or raises 
+        IndexUnavailableError if the index couldn't be reached in time
+        '''
+        problem = 'circuit breaker is open'
+        for attempt in range(self.retries + 1):
+            if not self.allows():
+                break
+            try:
+                status, body = fetch_url(url,self.request_timeout())
+            except (OSError, http.client.HTTPException, WrongAssumptionError) as e:
+                problem = str(e) or type(e).__name__
+            else:
+                if status not in RETRY_STATUSES:
+                    self.succeeded()
+                    return status, body
+                problem = f"status {status}"
+            self.failed()
+            if attempt < self.retries:
+                delay = random.uniform(0,self.backoff * 2 ** attempt)
+                if delay >= self.remaining():
+                    break
+                time.sleep(delay)
+        with self.lock:
+            self.skipped += 1
+        raise IndexUnavailableError('NetworkPolicy.fetch',f"gave up on {url}: {problem}")
 
 # -----------------------------------------------------------
 
 def hacky_parse_for_library_title(html_string):
+    '''
+    pulls "<name> <version>" out of a pypi.org project page - no longer used for lookups,
+    which go through the JSON API (see fetch_library_metadata)
+    '''
     classname_start = html_string.find("package-header__name")
     
     inner_start = html_string[classname_start:].find(">")
@@ -148,26 +807,340 @@ def hacky_parse_for_library_title(html_string):
 
 # -----------------------------------------------------------
 
-def get_latest_version(library_name):
+def default_cache_dir():
     '''
-    Takes in library name as string, looks it up on pypi, and returns 
-    current version number as string
+    returns the per-user cache directory thaw stores its files in ($THAW_CACHE_DIR if set)
+    '''
+    if os.environ.get('THAW_CACHE_DIR'):
+        return os.environ['THAW_CACHE_DIR']
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif platform.system() == 'Darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base,'thaw')
+
+class MetadataCache(PicklableLock):
+    '''
+    On-disk cache of index lookups, kept as one JSON file keyed by index url and package name.
+    Entries older than ttl seconds count as misses (unless offline), and only the max_entries 
+    most recently used entries are kept when the cache is saved.
+    
+    refresh => ignore cached entries and look everything up again
+    offline => never touch the network; use cached entries no matter how old
+    '''
+    def __init__(self,path=None,ttl=CACHE_TTL,max_entries=CACHE_MAX_ENTRIES,refresh=False,offline=False):
+        self.path = path or os.path.join(default_cache_dir(),'metadata.json')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def key(self,index_url,library):
+        return f"{index_url.rstrip('/')} {library.lower()}"
+    
+    def get(self,index_url,library):
+        '''
+        returns cached metadata for library, or None on a miss
+        '''
+        if self.refresh:
+            return None
+        with self.lock:
+            entry = self.entries.get(self.key(index_url,library))
+            if entry is None:
+                return None
+            now = time.time()
+            if not self.offline and now - entry['fetched'] > self.ttl:
+                return None
+            # recorded for eviction, but a hit alone doesn't make save() rewrite the file
+            entry['used'] = now
+            return entry['metadata']
+    
+    def set(self,index_url,library,metadata):
+        now = time.time()
+        with self.lock:
+            self.entries[self.key(index_url,library)] = {'metadata':metadata,'fetched':now,'used':now}
+            self.changed = True
+    
+    def save(self):
+        '''
+        writes the cache back to disk if entries were added, dropping the least recently used
+        entries past max_entries; a run answered entirely from the cache writes nothing
+        '''
+        with self.lock:
+            if not self.changed:
+                return
+            if len(self.entries) > self.max_entries:
+                newest = sorted(self.entries.items(),key=lambda item: item[1]['used'],reverse=True)
+                self.entries = dict(newest[:self.max_entries])
+            os.makedirs(os.path.dirname(self.path) or '.',exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',suffix='.tmp')
+            with os.fdopen(fd,'w') as f:
+                json.dump(self.entries,f)
+            os.replace(temp_path,self.path)
+            self.changed = False
+
+# -----------------------------------------------------------
+
+def fetch_library_metadata(library,index_url=PYPI_URL,cache=None,policy=None,with_versions=False):
+    '''
+    Looks library up on the index once and returns {'source':'pypi'|'other'|'unknown', 
+    'version':latest version or None}, plus 'versions' (every release the index lists) if
+    with_versions; 'unknown' means the index couldn't be reached under policy (a 
+    NetworkPolicy), and isn't cached. index_url can be (see index_kind):
+        a JSON API index like pypi.org  => <index_url>/pypi/<library>/json
+        a PEP 503 simple index URL      => <index_url>/<library>/ (e.g. a devpi mirror)
+        a local directory or file:// URL => a simple-index directory or wheelhouse, read 
+                                            once into memory (see LocalIndex)
+    For remote indexes, checks cache (a MetadataCache) first if given, and stores fresh 
+    answers in it.
     '''
-    url = f"https://pypi.org/project/{library_name}/"
+    kind = index_kind(index_url)
+    if kind == 'local':
+        return metadata_fields(local_index(index_path(index_url)).metadata(library),with_versions)
+    if cache:
+        metadata = cache.get(index_url,library)
+        # entries cached before release lists were kept don't have them
+        if metadata is not None and (cache.offline or not with_versions or metadata['source'] != 'pypi' or 'versions' in metadata):
+            count_stat('cache_hits')
+            return metadata_fields(metadata,with_versions)
+        count_stat('cache_misses')
+        if cache.offline:
+            return {'source':'other','version':None}
+    policy = policy or NetworkPolicy()
     try:
-        result = request.urlopen(url)
-        binary_data = result.read()
-        data = binary_data.decode('utf-8')
-        fulltitle = hacky_parse_for_library_title(data)
-        try: 
-            name, version = fulltitle.split(' ')
-            return version
-        except:
-            raise WrongAssumptionError('get_latest_version',f"unable to split name and version properly. Full text is: \n{fulltext}")
+        if kind == 'simple':
+            metadata = fetch_simple_metadata(library,index_url,policy)
+        else:
+            metadata = fetch_json_metadata(library,index_url,policy,with_versions)
+    except IndexUnavailableError:
+        return {'source':'unknown','version':None}
+    except Exception:
+        return {'source':'other','version':None}
+    if metadata is None:
+        return {'source':'other','version':None}
+    if cache:
+        cache.set(index_url,library,metadata)
+    return metadata_fields(metadata,with_versions)
+
+def metadata_fields(metadata,with_versions):
+    if with_versions or 'versions' not in metadata:
+        return metadata
+    return {'source':metadata['source'],'version':metadata['version']}
+
+def fetch_json_metadata(library,index_url,policy,with_versions=False):
+    '''
+    returns metadata from the JSON API, or None if the index gave an unexpected answer.
+    The release list is only built if with_versions.
+    '''
+    status, body = policy.fetch(f"{index_url}/pypi/{parse.quote(library)}/json")
+    if status == 200:
+        try:
+            data = json.loads(body)
+            version = data['info']['version']
+        except (ValueError, KeyError, TypeError):
+            return {'source':'pypi','version':None}
+        if not with_versions:
+            return {'source':'pypi','version':version or None}
+        # releases whose files were all yanked can't be installed by a version range
+        releases = data.get('releases') or {}
+        versions = sorted(release for release, files in releases.items() if not (files and all(file.get('yanked') for file in files)))
+        return {'source':'pypi','version':version or None,'versions':versions}
+    elif status == 404:
+        return {'source':'other','version':None}
+    return None
+
+def fetch_simple_metadata(library,index_url,policy):
+    '''
+    returns metadata from a PEP 503 simple index project page, or None if the index gave
+    an unexpected answer
+    '''
+    status, body = policy.fetch(f"{index_url.rstrip('/')}/{normalize_name(library)}/")
+    if status == 200:
+        versions = set()
+        for filename in simple_page_files(body.decode('utf-8','replace')):
+            parsed = parse_distribution_filename(filename)
+            if parsed:
+                versions.add(parsed[1])
+        return versions_metadata(versions)
+    elif status == 404:
+        return {'source':'other','version':None}
+    return None
+
+# -----------------------------------------------------------
+
+DISTRIBUTION_EXTENSIONS = ['.whl','.tar.gz','.tar.bz2','.tar.xz','.tgz','.zip','.egg']
+SIMPLE_LINK = re.compile(r'<a\s[^>]*>',re.IGNORECASE)
+HREF = re.compile(r'href\s*=\s*["\']([^"\']+)["\']',re.IGNORECASE)
+
+def index_kind(index_url):
+    '''
+    returns 'local' for a directory path or file:// URL, 'simple' for a URL whose last path
+    segment is simple (or devpi's +simple), and 'json' for anything else
+    '''
+    if index_url.startswith('file://') or not re.match(r'^[A-Za-z][A-Za-z0-9+.-]+://',index_url):
+        return 'local'
+    if parse.urlsplit(index_url).path.rstrip('/').rsplit('/',1)[-1] in ('simple','+simple'):
+        return 'simple'
+    return 'json'
+
+def index_path(index_url):
+    if index_url.startswith('file://'):
+        return parse.unquote(parse.urlsplit(index_url).path)
+    return os.path.expanduser(index_url)
+
+def normalize_name(name):
+    '''
+    PEP 503 normalized project name: lowercase, with runs of -, _ and . turned into -
+    '''
+    return re.sub(r'[-_.]+','-',name).lower()
+
+def parse_distribution_filename(filename):
+    '''
+    returns (normalized name, version) for a wheel, sdist or egg filename, or None
+    ex: 'Django-3.1.2-py3-none-any.whl' => ('django', '3.1.2')
+    '''
+    for extension in DISTRIBUTION_EXTENSIONS:
+        if filename.lower().endswith(extension):
+            stem = filename[:-len(extension)]
+            break
+    else:
+        return None
+    if extension in ('.whl','.egg'):
+        parts = stem.split('-')
+        if len(parts) < 2:
             return None
-    except:
-        raise WrongAssumptionError('get_latest_version',f"unable to connect to {url}")
+        name, version = parts[0], parts[1]
+    else:
+        if '-' not in stem:
+            return None
+        name, version = stem.rsplit('-',1)
+    if parse_version(version) is None:
         return None
+    return normalize_name(name), version
+
+def simple_page_files(html):
+    '''
+    yields the filenames linked from a PEP 503 simple index page, skipping yanked files
+    '''
+    for link in SIMPLE_LINK.findall(html):
+        href = HREF.search(link)
+        if href and 'data-yanked' not in link.lower():
+            yield parse.unquote(href.group(1).split('#')[0].rstrip('/').rsplit('/',1)[-1])
+
+def versions_metadata(versions):
+    if len(versions) == 0:
+        return {'source':'other','version':None}
+    return {'source':'pypi','version':latest_version(versions),'versions':sorted(versions)}
+
+class LocalIndex:
+    '''
+    In-memory name => versions index of a local package directory, built with one pass over 
+    it. The directory can be a wheelhouse (distribution files side by side, like pip 
+    download or pip wheel leave), or a PEP 503 simple index laid out on disk (a folder per
+    project holding its files, or an index.html linking them).
+    '''
+    def __init__(self,path):
+        self.path = path
+        self.versions = {}
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.is_dir():
+                self.add_project_directory(entry)
+            else:
+                self.add_file(entry.name)
+    
+    def add_file(self,filename,project=None):
+        parsed = parse_distribution_filename(filename)
+        if parsed:
+            self.versions.setdefault(project or parsed[0],set()).add(parsed[1])
+    
+    def add_project_directory(self,entry):
+        project = normalize_name(entry.name)
+        for file in os.scandir(entry.path):
+            if file.name == 'index.html':
+                with open(file.path,encoding='utf-8',errors='replace') as f:
+                    for filename in simple_page_files(f.read()):
+                        self.add_file(filename,project)
+            elif file.is_file():
+                self.add_file(file.name,project)
+    
+    def metadata(self,library):
+        return versions_metadata(self.versions.get(normalize_name(library),()))
+
+_local_indexes = {}
+_local_indexes_lock = threading.Lock()
+
+def local_index(path):
+    '''
+    returns the LocalIndex of path, building it only once per run (or again if files were
+    added to or removed from the directory itself since; project folders aren't re-checked)
+    '''
+    try:
+        signature = os.stat(path).st_mtime_ns
+    except OSError:
+        signature = None
+    key = os.path.abspath(path)
+    with _local_indexes_lock:
+        if key not in _local_indexes or _local_indexes[key][0] != signature:
+            _local_indexes[key] = (signature, LocalIndex(path))
+        return _local_indexes[key][1]
+
+# -----------------------------------------------------------
+
+def get_latest_version(library_name,index_url=PYPI_URL,cache=None):
+    '''
+    Takes in library name as string, looks it up on pypi, and returns 
+    current version number as string
+    '''
+    metadata = fetch_library_metadata(library_name,index_url,cache)
+    if metadata['source'] != 'pypi':
+        raise WrongAssumptionError('get_latest_version',f"unable to find {library_name} on {index_url}")
+    elif metadata['version'] is None:
+        raise WrongAssumptionError('get_latest_version',f"no version listed for {library_name} on {index_url}")
+    return metadata['version']
+
+# -----------------------------------------------------------
+
+def resolve_libraries(libraries,project_dir,index_url=PYPI_URL,workers=LOOKUP_WORKERS,cache=None,local_modules=None,policy=None,with_versions=False):
+    '''
+    Looks up every library once (duplicates are dropped), running up to `workers` index lookups
+    at a time over keep-alive connections. The lookups share policy (a NetworkPolicy, whose
+    deadline starts now), so once the index stops answering the rest come back "unknown" 
+    right away.
+    outputs: dict of {library : {'source':"pypi"|"local"|"other"|"unknown", 'version':latest version or None}}
+             (with 'versions' too if with_versions, see fetch_library_metadata)
+    '''
+    if local_modules is None:
+        local_modules = index_project(project_dir)['modules']
+    resolved = {}
+    remote = []
+    for library in libraries:
+        if library in resolved or library in remote:
+            continue
+        if library_is_local(library,project_dir,local_modules):
+            resolved[library] = {'source':'local','version':None}
+        else:
+            remote.append(library)
+    if len(remote) > 0:
+        policy = policy or NetworkPolicy()
+        policy.start()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(remote)))) as executor:
+            for library, metadata in zip(remote, executor.map(fetch_library_metadata,remote,[index_url] * len(remote),[cache] * len(remote),[policy] * len(remote),[with_versions] * len(remote))):
+                resolved[library] = metadata
+    return resolved
 
 # -----------------------------------------------------------
 # PROJECT SEARCH --------------------------------------------
@@ -211,133 +1184,1314 @@ def get_libraries_and_versions_from_requirements(filepath):
                 libraries += [{'library':library,'version':version}]
     return libraries
 
-def check_file_for_library(filepath,library):
+@contextlib.contextmanager
+def open_source(filepath):
     '''
-    inputs: str:filepath, str:library name
-    outputs: list containing line #s (not counting 'import x') that the library is explicity in
+    yields the raw contents of filepath as a bytes-like buffer: small files are read in 
+    one call, files of MMAP_THRESHOLD bytes or more are memory-mapped so that rejecting 
+    them (see libraries_in_source) never copies them into memory
     '''
-    with open(filepath) as f:
-        i = 0
-        imported = False
-        words_to_check = [library]
-        affected_lines = []
-        affected_lines_text = []
-        for line in f:
-            line_text = str(line)
-            i += 1
-            if 'import' in line_text and library in line_text:
-                imported = True
-                if '#' in line_text:
-                    line_text = line_text.split('#')[0]
-                if 'as' in line_text:
-                    words_to_check = [line_text.split(' as ')[1].strip()]
-                elif 'from' in line_text:
-                    modules = line_text.split('import')[1].strip()
-                    if ',' in modules:
-                        for mod in modules.split(','):
-                            words_to_check.append(mod.strip())
-                    else:
-                        words_to_check.append(modules)
-            elif imported:
-                for keyword in words_to_check:
-                    if '#' in line_text:
-                        if keyword in line_text.split('#')[0] and i not in affected_lines:
-                            affected_lines.append(i)
-                            affected_lines_text.append(line_text)
-                            words_to_check += check_line_for_new_variable(keyword,line_text)
-                    elif keyword in line_text and i not in affected_lines:
-                        affected_lines.append(i)
-                        affected_lines_text.append(line_text)
-                        words_to_check += check_line_for_new_variable(keyword,line_text)
-    
-    return {'linenums': affected_lines, 'linetext': affected_lines_text}
+    with open(filepath,'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            yield f.read()
+        else:
+            with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as data:
+                yield data
 
-# -----------------------------------------------------------
+def read_file_bytes(filepath):
+    with open(filepath,'rb') as f:
+        return f.read()
 
-def search_directory_for_library(directory,library):
-    affected_files = []
+def source_encoding(data):
+    '''
+    returns the encoding python would use for source bytes (BOM or coding declaration, 
+    otherwise utf-8); falls back to utf-8 if the declaration is invalid
+    '''
+    lines = iter(data[:1024].splitlines(keepends=True)[:2])
     try:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.py'):
-                    filepath = root + '/' + file
-                    affected = check_file_for_library(filepath,library)
-                    affected_lines = affected['linenums']
-                    affected_lines_text = affected['linetext']
-                    if len(affected_lines) > 0:
-                        affected_files.append({'file':filepath,'lines':affected_lines,'linestext':affected_lines_text})
-    except:
-        raise WrongAssumptionError('search_directory_for_library',f"directory input '{directory}' is not valid directory path or is '{type(directory)}' type instead of str, bytes, or os.path object")
-    return affected_files
-
-# -----------------------------------------------------------
+        encoding, first_lines = tokenize.detect_encoding(lambda: next(lines,b''))
+    except SyntaxError:
+        return 'utf-8'
+    return encoding
 
-def check_file_for_imports(file):
-    libraries = []
-    with open(file) as f:
-        for line in f:
-            line_text = str(line)
-            if 'import' in line_text:                   # this captures 'import x', 'import x as y', 'from x import a,b,c'
-                libraries.append(line_text.split(' ')[1].strip())           # future: need to check for unusual import statements?
-    return libraries
-
-def search_directory_for_imports(dir_path):
-    libraries = []
-    for root, dirs, files in os.walk(dir_path):
-        for file in files:
-            if file.endswith('.py'):
-                filepath = root + '/' + file
-                try:
-                    libraries += check_file_for_imports(filepath)
-                except:
-                    raise WrongAssumptionError('search_directory_for_imports',f"{filepath} not found in {os.listdir(dir_path)}")
-    return libraries   
+def encode_name(name,encoding):
+    '''
+    encodes a library or variable name to match it against source bytes in encoding
+    (without the BOM that the utf-8-sig codec would put in front of it)
+    '''
+    if encoding == 'utf-8-sig':
+        encoding = 'utf-8'
+    return name.encode(encoding,'replace')
 
-# -----------------------------------------------------------
-# REPORT BUILDING -------------------------------------------
-# -----------------------------------------------------------
+def decode_line(line,encoding):
+    '''
+    decodes one line of source bytes the way text mode would read it: bytes that can't be
+    decoded are replaced rather than raising, and line endings become '\\n'
+    '''
+    text = line.decode(encoding,'replace')
+    if encoding == 'utf-8-sig':
+        text = text.lstrip('\ufeff')
+    if text.endswith('\r\n'):
+        text = text[:-2] + '\n'
+    elif text.endswith('\r'):
+        text = text[:-1] + '\n'
+    return text
 
-def write_report_segment(directory,affected_by_outdated_library_dict,verbose):
-    cutoff = len(directory) + 1
-    report_segment = ""
-    for affected in affected_by_outdated_library_dict:
-        report_segment += f"\n\t{affected['file'][cutoff:]}"
-        if verbose:
-            for i in range(0,len(affected['lines'])):
-                report_segment += f"\n\t\t{affected['lines'][i]:<10} | {affected['linestext'][i]}"
-        else:
-            report_segment += f"\n\t\t{affected['lines']}"
-    return report_segment
+@functools.lru_cache(maxsize=64)
+def library_names_pattern(libraries):
+    return re.compile(b'|'.join(re.escape(library.encode('utf-8')) for library in sorted(libraries,key=len,reverse=True)))
 
-# -----------------------------------------------------------
+def libraries_in_source(data,libraries):
+    '''
+    returns the libraries whose names appear anywhere in data (a file's raw bytes).
+    A file that never mentions a library can't import or use it, so the line-by-line
+    analysis can skip it; one regex search over the whole buffer rejects most files.
+    '''
+    libraries = [library for library in libraries if library]
+    if len(libraries) == 0 or not library_names_pattern(tuple(libraries)).search(data):
+        return []
+    return [library for library in libraries if data.find(library.encode('utf-8')) != -1]
 
-def write_report_segments_for_scales(scales_dict,affected_by_outdated_libraries,directory,verbose):
-    report_segments = ''
-    if len(scales_dict) > 0:
-        for lib in scales_dict['libraries']:
-            report_segments += f"\n[ ]{lib}"
-            report_segments += write_report_segment(directory,affected_by_outdated_libraries[lib],verbose)
+def check_file_for_libraries(filepath,libraries,with_text=True,data=None):
+    '''
+    inputs: str:filepath, list:library names, (optional) bool:record line text, bytes:file contents if already read
+    outputs: dict of {library : {'linenums':[...], 'linetext':[...]}} for every library, reading the file only once
+             (just {'linenums':[...]} when with_text is False)
+    
+    Matching runs on the raw bytes; only the lines that end up in the report are decoded.
+    '''
+    results = {}
+    for library in libraries:
+        results[library] = empty_file_result(with_text)
+    if data is None:
+        with open_source(filepath) as source:
+            present = libraries_in_source(source,libraries)
+            if len(present) == 0:
+                return results
+            data = bytes(source)
     else:
-        report_segments += "\nNone"
-        
-    return report_segments
+        present = libraries_in_source(data,libraries)
+        if len(present) == 0:
+            return results
+    encoding = source_encoding(data)
+    tracked = {}
+    for library in present:
+        name = encode_name(library,encoding)
+        tracked[library] = {'name':name,'imported':False,'matcher':KeywordMatcher([name]),'linenums':[],'linetext':[] if with_text else None}
+    i = 0
+    for line in data.splitlines(keepends=True):
+        i += 1
+        for state in tracked.values():
+            check_line_for_library(state,line,i,encoding)
+    
+    for library, state in tracked.items():
+        results[library]['linenums'] = state['linenums']
+        if with_text:
+            results[library]['linetext'] = state['linetext']
+    return results
 
+def empty_file_result(with_text=True):
+    if with_text:
+        return {'linenums': [], 'linetext': []}
+    return {'linenums': []}
+
+def check_line_for_library(state,line,i,encoding):
+    '''
+    updates the running per-file state for one library with line number i (raw bytes):
+    records imports/aliases, affected lines (and their text, unless state['linetext'] is 
+    None), and new variables made with the library
+    '''
+    if b'import' in line and state['name'] in line:
+        state['imported'] = True
+        if b'#' in line:
+            line = line.split(b'#')[0]
+        if b' as ' in line:
+            state['matcher'] = KeywordMatcher([line.split(b' as ')[1].strip()])
+        elif b'from' in line:
+            modules = line.split(b'import')[1].strip()
+            for mod in modules.split(b','):
+                state['matcher'].add(mod.strip())
+    elif state['imported']:
+        keyword = state['matcher'].search(line.split(b'#')[0])
+        if keyword:
+            line_text = decode_line(line,encoding)
+            state['linenums'].append(i)
+            if state['linetext'] is not None:
+                state['linetext'].append(line_text)
+            for variable in check_line_for_new_variable(decode_line(keyword,encoding),line_text):
+                state['matcher'].add(encode_name(variable,encoding))
+
+def check_file_for_library(filepath,library):
+    '''
+    inputs: str:filepath, str:library name
+    outputs: list containing line #s (not counting 'import x') that the library is explicity in
+    '''
+    return check_file_for_libraries(filepath,[library])[library]
 
-# -----------------------------------------------------------
-# MAIN ------------------------------------------------------
 # -----------------------------------------------------------
 
-def main():
+def glob_to_regex(pattern):
+    '''
+    translates a .gitignore-style glob to a regex: * and ? don't cross '/', ** does
+    '''
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/',i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**',i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']',i + 1)
+            characters = pattern[i + 1:end].replace('\\','\\\\')
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            regex += '[' + characters + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
 
-    parser = argparse.ArgumentParser(description="Identify outdated libraries in your project dependencies and where they're used.")
-    parser.add_argument('directory',action="store",help="Top level of project directory on which to run report.")
-    parser.add_argument('-o','--out',action="store",help="Write thaw report file to specified file path; thaw will write timestamped .txt report file.")
-    parser.add_argument('-v','--verbose',action="store_true",help="Include content of lines affected by out-of-date libraries (only line numbers will be written otherwise).")
-    parser.add_argument('-l','--library',action="store",nargs='*',help="Search for instances of specified libraries instead of all outdated libraries.")
-    parser.add_argument('-i','--imports',action="store_true",help="Check import statements in files instead of requirements.txt.")
-    args = parser.parse_args()
+class IgnoreRules:
+    '''
+    The files and directories a project walk skips, from .gitignore files (the project's own
+    and any nested ones, plus .git/info/exclude) and extra exclude globs, which work like
+    lines of a .gitignore at the top of the project. Supports the usual .gitignore syntax:
+    # comments, ! negation, trailing / for directories only, leading or inner / to anchor a
+    pattern to its .gitignore's directory, and **. The last matching rule wins.
+    '''
+    def __init__(self,directory,exclude=(),gitignore=True):
+        self.gitignore = gitignore
+        self.rules = []
+        if gitignore:
+            self.add_file(os.path.join(directory,'.git','info','exclude'),'')
+        self.add_patterns(exclude,'')
+    
+    def add_file(self,path,base):
+        try:
+            with open(path,encoding='utf-8',errors='replace') as f:
+                self.add_patterns(f.read().splitlines(),base)
+        except OSError:
+            pass
+    
+    def add_patterns(self,patterns,base):
+        for pattern in patterns:
+            pattern = pattern.rstrip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            elif pattern.startswith('\\'):
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            if pattern:
+                self.rules.append((base,glob_to_regex(pattern.lstrip('/')),negate,dir_only,anchored))
+    
+    def ignored(self,relpath,is_dir):
+        '''
+        returns True if relpath ('/'-separated, relative to the project) should be skipped
+        '''
+        ignored = False
+        name = relpath.rsplit('/',1)[-1]
+        for base, regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not relpath.startswith(base + '/'):
+                    continue
+                path = relpath[len(base) + 1:]
+            else:
+                path = relpath
+            if regex.match(path if anchored else name):
+                ignored = not negate
+        return ignored
+
+def walk_project(directory,exclude=(),gitignore=True):
+    '''
+    walks directory like os.walk (same order, doesn't follow directory symlinks) and yields
+    (root, [os.DirEntry for each file in root]), without going into directories that don't
+    hold project code: PRUNED_DIRECTORIES (.git, virtualenvs, .tox, node_modules, build, 
+    site-packages, ...), any other virtualenv (a directory with a pyvenv.cfg), and anything 
+    ignored by .gitignore or the exclude globs. Entries come from os.scandir, so file types
+    (and stat info, once asked for) don't cost extra system calls.
+    '''
+    ignore = IgnoreRules(directory,exclude,gitignore)
+    pending = [(directory,'')]
+    while pending:
+        root, relative_root = pending.pop()
+        try:
+            with os.scandir(root) as listing:
+                entries = list(listing)
+        except OSError:
+            continue
+        if relative_root and any(entry.name == 'pyvenv.cfg' for entry in entries):
+            continue
+        if gitignore and any(entry.name == '.gitignore' for entry in entries):
+            ignore.add_file(os.path.join(root,'.gitignore'),relative_root)
+        files = []
+        subdirectories = []
+        for entry in entries:
+            relpath = relative_root + '/' + entry.name if relative_root else entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if entry.name in PRUNED_DIRECTORIES or entry.is_symlink() or ignore.ignored(relpath,True):
+                    continue
+                subdirectories.append((entry.path,relpath))
+            elif not ignore.ignored(relpath,False):
+                files.append(entry)
+        yield root, files
+        pending.extend(reversed(subdirectories))
+
+class Manifest:
+    '''
+    The project's python files, listed once per run (or loaded from an earlier run) and
+    passed to every stage, so nothing else needs to walk the tree.
+    
+    entries     => {'path','module'} for every .py file, in os.walk order; module is its
+                   dotted name from the top of the project (e.g. 'pkg.sub.mod'). Sizes and
+                   mtimes aren't kept: an edit doesn't change any directory's mtime, so they
+                   would go stale while the manifest stays current - stages that need them
+                   stat the file themselves.
+    files       => the entries' paths
+    modules     => top-level names importable from the project: the modules (x.py) and 
+                   packages (directories with python files below them, with or without an
+                   __init__.py) at the top of the project, or at the top of src/ for a src
+                   layout. Names deeper down (like app/requests.py) aren't importable on 
+                   their own, so they don't hide the library of the same name.
+    directories => {directory : mtime (ns)} for every directory walked, plus the .gitignore
+                   files read; a directory's mtime changes whenever a file in it is added, 
+                   removed or renamed, so a saved manifest is still right if none of these
+                   changed (see is_current)
+    '''
+    def __init__(self,directory,exclude=(),entries=None,directories=None):
+        self.directory = directory
+        self.exclude = list(exclude)
+        self.entries = entries or []
+        self.directories = directories or {}
+        self.files = [entry['path'] for entry in self.entries]
+        self.modules = set()
+        for entry in self.entries:
+            parts = entry['module'].split('.')
+            if parts[0] == 'src' and len(parts) > 1:
+                self.modules.add('src' if parts[1] == '__init__' else parts[1])
+            else:
+                self.modules.add(parts[0])
+        self.modules.discard('__init__')
+    
+    @classmethod
+    def build(cls,directory,exclude=()):
+        '''
+        walks directory once with walk_project and returns its Manifest
+        '''
+        entries = []
+        directories = {}
+        for root, files in walk_project(directory,exclude):
+            try:
+                directories[root] = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+            relative_root = os.path.relpath(root,directory)
+            package = '' if relative_root == os.curdir else '.'.join(relative_root.split(os.sep)) + '.'
+            for entry in files:
+                if entry.name.endswith('.py'):
+                    if entry.is_file():
+                        entries.append({'path':root + '/' + entry.name,'module':package + entry.name[:-3]})
+                elif entry.name == '.gitignore':
+                    directories[entry.path] = entry.stat().st_mtime_ns
+        return cls(directory,exclude,entries,directories)
+    
+    def is_current(self):
+        '''
+        returns True if no directory (or .gitignore) in the manifest changed since it was built
+        '''
+        for path, mtime in self.directories.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+    
+    def save(self,path):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump({'format':MANIFEST_FORMAT,'directory':self.directory,'exclude':self.exclude,'entries':self.entries,'directories':self.directories},f)
+        os.replace(temp_path,path)
+    
+    @classmethod
+    def load(cls,path,directory,exclude=()):
+        '''
+        returns the Manifest saved at path if it's for the same directory and exclude globs 
+        and still current, otherwise None
+        '''
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data['format'] != MANIFEST_FORMAT or data['directory'] != directory or data['exclude'] != list(exclude):
+                return None
+            manifest = cls(directory,exclude,data['entries'],data['directories'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if not manifest.is_current():
+            return None
+        return manifest
+
+def manifest_path(directory,exclude=()):
+    project_key = hashlib.sha1(f"{os.path.abspath(directory)} {' '.join(exclude)}".encode('utf-8')).hexdigest()
+    return os.path.join(default_cache_dir(),'manifests',f"{project_key}.json")
+
+def load_manifest(directory,exclude=(),path=None):
+    '''
+    returns the Manifest saved at path (see manifest_path) if it's still current, otherwise
+    walks directory and saves the new Manifest there. Without a path it always walks.
+    '''
+    if path:
+        manifest = Manifest.load(path,directory,exclude)
+        if manifest:
+            return manifest
+    manifest = Manifest.build(directory,exclude)
+    if path:
+        manifest.save(path)
+    return manifest
+
+def index_project(directory,exclude=()):
+    '''
+    walks directory once and returns {'files':[...], 'modules':set()} (see Manifest)
+    '''
+    manifest = Manifest.build(directory,exclude)
+    return {'files':manifest.files,'modules':manifest.modules}
+
+def list_python_files(directory):
+    '''
+    returns list of filepaths for every .py file in directory, in os.walk order
+    '''
+    return index_project(directory)['files']
+
+class WorkerPool:
+    '''
+    A pool of up to `jobs` processes for map_files that is only started the first time it's
+    needed and then reused by every later call until close(), so a caller scanning over and
+    over (a Scanner, --watch) doesn't start new processes each time
+    '''
+    def __init__(self,jobs):
+        self.jobs = jobs
+        self.executor = None
+    
+    def map(self,function,*iterables,chunksize=1):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        return self.executor.map(function,*iterables,chunksize=chunksize)
+    
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+def map_files(function,filepaths,jobs,*args,pool=None):
+    '''
+    returns [function(filepath,*args) for filepath in filepaths], sharding the files across
+    a pool of up to `jobs` processes (pool, a WorkerPool, if given; a new one otherwise).
+    Results are always in the same order as filepaths, so output is identical to a serial 
+    run. Small projects (fewer than MIN_FILES_PER_JOB files per worker) are run serially 
+    since starting processes would cost more than it saves.
+    '''
+    if _stats is not None:
+        count_stat('files',len(filepaths))
+        count_stat('bytes',sum(os.path.getsize(filepath) for filepath in filepaths))
+    workers = min(jobs or 1, len(filepaths) // MIN_FILES_PER_JOB)
+    if workers <= 1:
+        return [function(filepath,*args) for filepath in filepaths]
+    chunksize = max(1, len(filepaths) // (workers * 4))
+    iterables = [[arg] * len(filepaths) for arg in args]
+    if pool is not None:
+        return list(pool.map(function,filepaths,*iterables,chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function,filepaths,*iterables,chunksize=chunksize))
+
+# -----------------------------------------------------------
+
+def file_digest(filepath):
+    digest = hashlib.sha1()
+    with open(filepath,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FileResultCache:
+    '''
+    Per-project cache of scan results for --incremental runs, kept as one JSON file in the
+    user cache directory. Each .py file's entry is fingerprinted by mtime, size and content
+    hash and holds its imports (from check_file_for_imports) and its hits for every library
+    it has been scanned for (from check_file_for_libraries). A file whose fingerprint changed
+    starts over with an empty entry, so only changed files are read again.
+    
+    With persist=False the cache is only kept in memory (e.g. between --watch scans).
+    '''
+    def __init__(self,project_dir,path=None,engine='line',persist=True):
+        project_key = hashlib.sha1(f"{os.path.abspath(project_dir)} {engine}".encode('utf-8')).hexdigest()
+        self.path = path or os.path.join(default_cache_dir(),'files',f"{project_key}.json")
+        self.persist = persist
+        self.entries = {}
+        self.seen = set()
+        self.changed = False
+        if not persist:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('format') == FILE_CACHE_FORMAT:
+                self.entries = data['files']
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+    
+    def entry(self,filepath):
+        '''
+        returns the cached entry for filepath, or a fresh empty one if the file has changed:
+        {'mtime','size','hash', 'imports':list or None, 'scanned':[libraries], 'hits':{library : {'linenums'}}}
+        '''
+        key = os.path.abspath(filepath)
+        self.seen.add(key)
+        stat = os.stat(filepath)
+        entry = self.entries.get(key)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            count_stat('cache_hits')
+            return entry
+        digest = file_digest(filepath)
+        if entry and entry['hash'] == digest:
+            count_stat('cache_hits')
+            entry['mtime'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+        else:
+            count_stat('cache_misses')
+            entry = {'mtime':stat.st_mtime_ns,'size':stat.st_size,'hash':digest,'imports':None,'scanned':[],'hits':{}}
+            self.entries[key] = entry
+        self.changed = True
+        return entry
+    
+    def store_libraries(self,entry,affected):
+        for library, result in affected.items():
+            if library not in entry['scanned']:
+                entry['scanned'].append(library)
+            if len(result['linenums']) > 0:
+                entry['hits'][library] = result
+        self.changed = True
+    
+    def store_imports(self,entry,imports):
+        entry['imports'] = imports
+        self.changed = True
+    
+    def save(self):
+        '''
+        writes the cache back to disk, dropping files that weren't seen since the last save
+        '''
+        for key in list(self.entries):
+            if self.seen and key not in self.seen:
+                del self.entries[key]
+                self.changed = True
+        self.seen = set()
+        if not self.changed or not self.persist:
+            return
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump({'format':FILE_CACHE_FORMAT,'files':self.entries},f)
+        os.replace(temp_path,self.path)
+        self.changed = False
+
+# -----------------------------------------------------------
+
+def read_source_lines(filepath,linenums):
+    '''
+    returns the decoded text of the given (1-based) line numbers of filepath, exactly as
+    check_file_for_libraries would have recorded it. Lines that are gone by now (the file
+    was deleted, or cut short since the scan) come back as ''
+    '''
+    try:
+        with open_source(filepath) as source:
+            data = bytes(source)
+    except OSError:
+        return ['' for i in linenums]
+    count_stat('files')
+    count_stat('bytes',len(data))
+    encoding = source_encoding(data)
+    lines = data.splitlines(keepends=True)
+    return [decode_line(lines[i - 1],encoding) if i <= len(lines) else '' for i in linenums]
+
+class FileHits:
+    '''
+    Compact record of where one library is used in one file: the (interned) file path and
+    the line numbers as an array of unsigned ints. The text of those lines isn't kept; it's
+    read back from the file when the report asks for it, so verbose reports don't hold a 
+    copy of every affected line for every library.
+    
+    For compatibility it can also be read like the old {'file','lines','linestext'} dict.
+    '''
+    __slots__ = ('file','lines')
+    
+    def __init__(self,file,lines):
+        self.file = sys.intern(file)
+        self.lines = array('I',lines)
+    
+    @property
+    def linestext(self):
+        return read_source_lines(self.file,self.lines)
+    
+    def __getitem__(self,key):
+        if key == 'file':
+            return self.file
+        if key == 'lines':
+            return self.lines.tolist()
+        if key == 'linestext':
+            return self.linestext
+        raise KeyError(key)
+    
+    def __eq__(self,other):
+        if isinstance(other,FileHits):
+            return self.file == other.file and self.lines == other.lines
+        if isinstance(other,dict):
+            return {'file':self.file,'lines':self['lines'],'linestext':self.linestext} == other
+        return NotImplemented
+    
+    def __repr__(self):
+        return f"FileHits({self.file!r}, {self.lines.tolist()!r})"
+
+def search_directory_for_libraries(directory,libraries,jobs=1,filepaths=None,file_cache=None,engine='line',pool=None):
+    '''
+    walks directory once (unless filepaths from index_project are given) and checks each 
+    .py file once for all libraries with the given engine ('line' or 'ast'), spread across
+    `jobs` processes (of pool, a WorkerPool, if given). With a FileResultCache, only files that changed (or weren't scanned 
+    for these libraries yet) are read.
+    outputs: dict of {library : [FileHits, ...]}
+    '''
+    affected_files = {}
+    for library in libraries:
+        affected_files[library] = []
+    if len(affected_files) == 0:
+        return affected_files
+    try:
+        if filepaths is None:
+            filepaths = list_python_files(directory)
+        if file_cache:
+            entries = [file_cache.entry(filepath) for filepath in filepaths]
+            pending = [filepath for filepath, entry in zip(filepaths, entries) if not set(affected_files).issubset(entry['scanned'])]
+        else:
+            entries = [None] * len(filepaths)
+            pending = filepaths
+        scanned = dict(zip(pending, map_files(ENGINES[engine]['libraries'],pending,jobs,list(affected_files),False,pool=pool)))
+        for filepath, entry in zip(filepaths, entries):
+            if filepath in scanned:
+                affected = scanned[filepath]
+                if file_cache:
+                    file_cache.store_libraries(entry,affected)
+            else:
+                affected = {library: entry['hits'][library] for library in affected_files if library in entry['hits']}
+            for library, result in affected.items():
+                if len(result['linenums']) > 0:
+                    affected_files[library].append(FileHits(filepath,result['linenums']))
+    except:
+        raise WrongAssumptionError('search_directory_for_libraries',f"directory input '{directory}' is not valid directory path or is '{type(directory)}' type instead of str, bytes, or os.path object")
+    return affected_files
+
+def search_directory_for_library(directory,library):
+    return search_directory_for_libraries(directory,[library])[library]
+
+# -----------------------------------------------------------
+
+def check_file_for_imports(file):
+    libraries = []
+    with open_source(file) as data:
+        if data.find(b'import') == -1:
+            return libraries
+        data = bytes(data)
+    encoding = source_encoding(data)
+    for line in data.splitlines(keepends=True):
+        if b'import' in line:                       # this captures 'import x', 'import x as y', 'from x import a,b,c'
+            libraries.append(decode_line(line.split(b' ')[1],encoding).strip())           # future: need to check for unusual import statements?
+    return libraries
+
+def search_directory_for_imports(dir_path,jobs=1,filepaths=None,file_cache=None,engine='line',pool=None):
+    libraries = []
+    if filepaths is None:
+        filepaths = list_python_files(dir_path)
+    try:
+        if file_cache:
+            entries = [file_cache.entry(filepath) for filepath in filepaths]
+            pending = [filepath for filepath, entry in zip(filepaths, entries) if entry['imports'] is None]
+        else:
+            entries = [None] * len(filepaths)
+            pending = filepaths
+        scanned = dict(zip(pending, map_files(ENGINES[engine]['imports'],pending,jobs,pool=pool)))
+        for filepath, entry in zip(filepaths, entries):
+            if filepath in scanned:
+                if file_cache:
+                    file_cache.store_imports(entry,scanned[filepath])
+                libraries += scanned[filepath]
+            else:
+                libraries += entry['imports']
+    except:
+        raise WrongAssumptionError('search_directory_for_imports',f"unable to read python files in {dir_path}")
+    return libraries   
+
+# -----------------------------------------------------------
+# DEPENDENCY SOURCES ----------------------------------------
+# -----------------------------------------------------------
+
+DEPENDENCY_FILES = ['requirements*.txt','requirements/*.txt','pyproject.toml','setup.cfg','Pipfile.lock','poetry.lock']
+REQUIREMENT_PATTERN = re.compile(r'^\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*(?:\[[^\]]*\])?\s*(?:@\s*(\S+)|\(?([^;()@]*?)\)?)\s*$')
+URL_REQUIREMENT = re.compile(r'^(?:[a-z]+\+)?[a-z]+://|^file:|^\.{0,2}/|\.(?:whl|zip|tar\.gz|tgz|tar\.bz2)$',re.IGNORECASE)
+EGG_FRAGMENT = re.compile(r'[#&]egg=([A-Za-z0-9][A-Za-z0-9._-]*)')
+REQUIREMENT_OPTION = re.compile(r'^(-r|--requirement|-c|--constraint|-e|--editable)(?:\s*=\s*|\s+)(.+)$')
+MARKER_TOKEN = re.compile(r'''\s*("[^"]*"|'[^']*'|===|==|!=|~=|<=|>=|<|>|\(|\)|not\s+in\b|[A-Za-z_][A-Za-z0-9_.]*)''')
+
+@functools.lru_cache(maxsize=4096)
+def parse_requirement(text):
+    '''
+    returns (library name, SpecifierSet, url or None, environment marker or None) for a 
+    PEP 508 requirement like 'pandas[excel]>=1.0,<1.2; python_version >= "3.6"', a
+    'name @ url' requirement, or a pip URL/path with #egg=name. None if text isn't one.
+    Memoized, since projects in a batch share most of their lines.
+    '''
+    text, _, marker = text.partition(';')
+    text = text.strip()
+    marker = marker.strip() or None
+    match = REQUIREMENT_PATTERN.match(text)
+    if match and match.group(2):
+        return match.group(1), parse_specifiers(''), match.group(2), marker
+    if URL_REQUIREMENT.search(text):
+        egg = EGG_FRAGMENT.search(text)
+        if egg:
+            return egg.group(1), parse_specifiers(''), text, marker
+        parsed = parse_distribution_filename(text.rsplit('/',1)[-1])
+        if parsed:
+            return parsed[0], parse_specifiers(''), text, marker
+        return None
+    if not match:
+        return None
+    specifier = parse_specifiers(match.group(3))
+    if specifier is None:
+        return None
+    return match.group(1), specifier, None, marker
+
+@functools.lru_cache(maxsize=None)
+def marker_environment():
+    '''
+    the PEP 508 environment markers are evaluated against: this interpreter, with no extras
+    '''
+    implementation = sys.implementation.version
+    return {
+        'python_version': '%d.%d' % sys.version_info[:2],
+        'python_full_version': platform.python_version(),
+        'os_name': os.name,
+        'sys_platform': sys.platform,
+        'platform_system': platform.system(),
+        'platform_machine': platform.machine(),
+        'platform_release': platform.release(),
+        'platform_version': platform.version(),
+        'platform_python_implementation': platform.python_implementation(),
+        'implementation_name': sys.implementation.name,
+        'implementation_version': f"{implementation.major}.{implementation.minor}.{implementation.micro}",
+        'extra': '',
+    }
+
+def compare_marker_values(left,operator,right):
+    if operator == 'in':
+        return left in right
+    if operator == 'not in':
+        return left not in right
+    version = parse_version(left)
+    specifier = parse_specifiers(operator + right) if version and operator != '===' else None
+    if specifier is not None:
+        return specifier.contains(version,True)
+    if operator in ('==','==='):
+        return left == right
+    if operator == '!=':
+        return left != right
+    return {'<':left < right,'<=':left <= right,'>':left > right,'>=':left >= right}.get(operator,False)
+
+@functools.lru_cache(maxsize=1024)
+def marker_applies(marker):
+    '''
+    returns True if the PEP 508 environment marker (like 'python_version < "3.8" and 
+    sys_platform == "win32"') holds here. Markers that don't parse count as holding, so
+    a dependency is never dropped by mistake.
+    '''
+    if not marker:
+        return True
+    tokens = []
+    position = 0
+    while position < len(marker.rstrip()):
+        match = MARKER_TOKEN.match(marker,position)
+        if not match:
+            return True
+        tokens.append(match.group(1))
+        position = match.end()
+    environment = marker_environment()
+    
+    def value(token):
+        if token[0] in '"\'':
+            return token[1:-1]
+        if token not in environment:
+            raise WrongAssumptionError('marker_applies',f"unknown marker variable '{token}'")
+        return environment[token]
+    
+    def expression(i):
+        result, i = conjunction(i)
+        while i < len(tokens) and tokens[i] == 'or':
+            right, i = conjunction(i + 1)
+            result = result or right
+        return result, i
+    
+    def conjunction(i):
+        result, i = comparison(i)
+        while i < len(tokens) and tokens[i] == 'and':
+            right, i = comparison(i + 1)
+            result = result and right
+        return result, i
+    
+    def comparison(i):
+        if tokens[i] == '(':
+            result, i = expression(i + 1)
+            if tokens[i] != ')':
+                raise WrongAssumptionError('marker_applies',"unbalanced parentheses")
+            return result, i + 1
+        operator = re.sub(r'\s+',' ',tokens[i + 1])
+        return compare_marker_values(value(tokens[i]),operator,value(tokens[i + 2])), i + 3
+    
+    try:
+        result, i = expression(0)
+    except (WrongAssumptionError, IndexError):
+        return True
+    return result if i == len(tokens) else True
+
+def poetry_constraint(constraint):
+    '''
+    returns poetry's version constraint syntax as PEP 440 specifiers:
+    ^1.2.3 => >=1.2.3,<2.0.0   ~1.2.3 => >=1.2.3,<1.3.0   1.2.3 => ==1.2.3   * => (anything)
+    Alternatives (||) can't be written as one specifier set, so they allow anything.
+    '''
+    constraint = constraint.strip()
+    if constraint in ('','*') or '||' in constraint:
+        return ''
+    clauses = []
+    for operator, version in re.findall(r'(\^|~=|~|===|==|!=|<=|>=|<|>|=)?\s*([0-9][^\s,]*)',constraint):
+        parsed = parse_version(version.rstrip('.*'))
+        if parsed is None:
+            continue
+        release = list(parsed.release)
+        if operator == '^':
+            bump = next((i for i, part in enumerate(release) if part != 0),len(release) - 1)
+            upper = release[:bump] + [release[bump] + 1]
+            clauses.append(f">={version},<{'.'.join(map(str,upper))}")
+        elif operator == '~':
+            upper = [release[0] + 1] if len(release) == 1 else [release[0], release[1] + 1]
+            clauses.append(f">={version},<{'.'.join(map(str,upper))}")
+        elif operator in ('','='):
+            clauses.append(f"=={version}")
+        else:
+            clauses.append(f"{operator}{version}")
+    return ','.join(clauses)
+
+def requirement_entry(text):
+    '''
+    returns the ('require', (name, specifier text, url)) entry for a requirement string, or
+    None if it isn't one or its environment marker rules it out
+    '''
+    requirement = parse_requirement(text)
+    if requirement is None or not marker_applies(requirement[3]):
+        return None
+    return ('require', (requirement[0], requirement[1].text, requirement[2]))
+
+def parse_requirements_text(lines,directory):
+    '''
+    parses pip requirements file lines into entries (see parse_dependency_file); -r and -c
+    paths are relative to directory. Other pip options and inline --hash options are skipped.
+    '''
+    entries = []
+    logical = ''
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.endswith('\\'):
+            logical += line[:-1] + ' '
+            continue
+        line = (logical + line).strip()
+        logical = ''
+        # a # only starts a comment at the start of a line or after whitespace (not in URLs)
+        line = re.split(r'(?:^|\s)#',line,1)[0].strip()
+        if len(line) == 0:
+            continue
+        option = REQUIREMENT_OPTION.match(line)
+        if option:
+            flag, value = option.group(1), option.group(2).strip()
+            if flag in ('-r','--requirement'):
+                entries.append(('include', os.path.join(directory,value)))
+            elif flag in ('-c','--constraint'):
+                entries.append(('constrain', os.path.join(directory,value)))
+            else:
+                line = value
+        if line.startswith('-'):
+            continue
+        entry = requirement_entry(re.split(r'\s+(?=--?[A-Za-z])',line,1)[0])
+        if entry:
+            entries.append(entry)
+    return entries
+
+def parse_pyproject(data):
+    '''
+    entries for the PEP 621 [project] dependencies and optional dependencies, and poetry's
+    dependency tables (the python version itself is skipped)
+    '''
+    entries = []
+    project = data.get('project') or {}
+    requirements = list(project.get('dependencies') or [])
+    for group in (project.get('optional-dependencies') or {}).values():
+        requirements += group
+    for text in requirements:
+        entry = requirement_entry(text)
+        if entry:
+            entries.append(entry)
+    poetry = (data.get('tool') or {}).get('poetry') or {}
+    tables = [poetry.get('dependencies') or {}, poetry.get('dev-dependencies') or {}]
+    tables += [group.get('dependencies') or {} for group in (poetry.get('group') or {}).values()]
+    for table in tables:
+        for name, value in table.items():
+            if name.lower() == 'python':
+                continue
+            url = None
+            if isinstance(value,dict):
+                if not marker_applies(value.get('markers')):
+                    continue
+                url = value.get('git') or value.get('url') or value.get('path')
+                value = value.get('version','')
+            specifier = poetry_constraint(value) if isinstance(value,str) else ''
+            entries.append(('require', (name, specifier if parse_specifiers(specifier) else '', url)))
+    return entries
+
+def parse_setup_cfg(text,directory):
+    '''
+    entries for setup.cfg's [options] install_requires and [options.extras_require]
+    '''
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string(text)
+    values = []
+    if config.has_option('options','install_requires'):
+        values.append(config.get('options','install_requires'))
+    if config.has_section('options.extras_require'):
+        values += [value for _, value in config.items('options.extras_require')]
+    entries = []
+    for value in values:
+        value = value.strip()
+        if value.startswith('file:'):
+            for filename in value[len('file:'):].split(','):
+                entries.append(('include', os.path.join(directory,filename.strip())))
+        else:
+            entries += parse_requirements_text(value.splitlines(),directory)
+    return entries
+
+def parse_pipfile_lock(data):
+    '''
+    entries for the packages pinned in Pipfile.lock's default and develop sections
+    '''
+    entries = []
+    for section in ('default','develop'):
+        for name, info in (data.get(section) or {}).items():
+            if not marker_applies(info.get('markers')):
+                continue
+            url = info.get('git') or info.get('file') or info.get('path')
+            specifier = info.get('version','') if not url else ''
+            entries.append(('require', (name, specifier if parse_specifiers(specifier) else '', url)))
+    return entries
+
+def parse_poetry_lock(data):
+    '''
+    entries for the packages pinned in poetry.lock
+    '''
+    entries = []
+    for package in data.get('package') or []:
+        if not marker_applies(package.get('markers') if isinstance(package.get('markers'),str) else None):
+            continue
+        source = package.get('source') or {}
+        url = source.get('url') if source.get('type') in ('git','url','directory','file') else None
+        specifier = f"=={package['version']}" if package.get('version') and not url else ''
+        entries.append(('require', (package['name'], specifier if parse_specifiers(specifier) else '', url)))
+    return entries
+
+@functools.lru_cache(maxsize=256)
+def parse_dependency_file(path,signature):
+    '''
+    parses one dependency file into a tuple of entries:
+        ('require', (name, specifier text, url or None)) => a dependency
+        ('include', path)                                => -r: read another file too
+        ('constrain', path)                              => -c: another file limits versions
+    Memoized on the file's (mtime, size) signature, so a file shared by several projects or
+    included from several files is only parsed once, and again only once it changes.
+    Files that can't be read or parsed have no entries.
+    '''
+    name = os.path.basename(path)
+    directory = os.path.dirname(path)
+    try:
+        if name in ('pyproject.toml','poetry.lock'):
+            if tomllib is None:
+                return ()
+            with open(path,'rb') as f:
+                data = tomllib.load(f)
+            return tuple(parse_pyproject(data) if name == 'pyproject.toml' else parse_poetry_lock(data))
+        with open(path,encoding='utf-8',errors='replace') as f:
+            if name == 'Pipfile.lock':
+                return tuple(parse_pipfile_lock(json.load(f)))
+            if name == 'setup.cfg':
+                return tuple(parse_setup_cfg(f.read(),directory))
+            return tuple(parse_requirements_text(f,directory))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, configparser.Error):
+        return ()
+
+def read_dependency_file(path):
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ()
+    return parse_dependency_file(path,(stat.st_mtime_ns,stat.st_size))
+
+def find_dependency_files(directory):
+    '''
+    returns the project's dependency files (see DEPENDENCY_FILES), in that order and sorted
+    by name within each pattern; empty if it has none
+    '''
+    files = []
+    for pattern in DEPENDENCY_FILES:
+        folder, _, name = pattern.rpartition('/')
+        try:
+            items = sorted(os.listdir(os.path.join(directory,folder)))
+        except OSError:
+            continue
+        for item in items:
+            path = os.path.join(directory,folder,item)
+            if fnmatch.fnmatch(item,name) and os.path.isfile(path):
+                files.append(path)
+    return files
+
+def is_dependency_file(filepath):
+    '''
+    returns True if filepath could declare dependencies (for --watch)
+    '''
+    name = os.path.basename(filepath)
+    return (name in ('pyproject.toml','setup.cfg','Pipfile.lock','poetry.lock') 
+            or fnmatch.fnmatch(name,'*requirements*.txt') or fnmatch.fnmatch(name,'*constraints*.txt')
+            or (name.endswith('.txt') and os.path.basename(os.path.dirname(filepath)) == 'requirements'))
+
+def collect_dependencies(filepaths):
+    '''
+    Reads filepaths and the files they include, each once, and merges what they declare.
+    outputs: list of dicts {library, specifier : SpecifierSet, url : str or None, files : [paths]}
+             with one dict per library (names compared PEP 503 normalized), in the order
+             they were first declared. A library's version clauses from every file that
+             declares it (and from -c constraints files) are combined.
+    '''
+    dependencies = {}
+    constraints = {}
+    visited = set()
+    
+    def visit(path,constraint):
+        key = (os.path.abspath(path),constraint)
+        if key in visited:
+            return
+        visited.add(key)
+        for kind, value in read_dependency_file(path):
+            if kind == 'include':
+                visit(value,constraint)
+            elif kind == 'constrain':
+                visit(value,True)
+            elif constraint:
+                constraints.setdefault(normalize_name(value[0]),[]).append(value[1])
+            else:
+                name, specifier, url = value
+                dependency = dependencies.setdefault(normalize_name(name),{'library':name,'specifiers':[],'url':None,'files':[]})
+                if specifier and specifier not in dependency['specifiers']:
+                    dependency['specifiers'].append(specifier)
+                dependency['url'] = dependency['url'] or url
+                if key[0] not in dependency['files']:
+                    dependency['files'].append(key[0])
+    
+    for path in filepaths:
+        visit(path,False)
+    results = []
+    for normalized, dependency in dependencies.items():
+        specifiers = dependency['specifiers'] + [specifier for specifier in constraints.get(normalized,[]) if specifier and specifier not in dependency['specifiers']]
+        specifier = parse_specifiers(','.join(specifiers)) or parse_specifiers('')
+        results.append({'library':dependency['library'],'specifier':specifier,'url':dependency['url'],'files':dependency['files']})
+    return results
+
+def get_requirements(filepath):
+    '''
+    inputs: str:filepath for requirements.txt
+    outputs: list of dicts {library : str:library_name, specifier : SpecifierSet of its version clauses}
+    Files it includes with -r or -c are read too; URL requirements and options are skipped.
+    '''
+    return [{'library':dependency['library'],'specifier':dependency['specifier']} for dependency in collect_dependencies([filepath]) if not dependency['url']]
+
+def pinned_version(specifier,versions=None):
+    '''
+    returns the version a requirement installs: the version as written for an exact pin
+    (==1.2.3), else the newest of versions (the index's releases) specifier allows. 
+    None for an unpinned requirement, or if the releases aren't known.
+    '''
+    if specifier.pinned:
+        return specifier.pinned
+    if specifier and versions:
+        return specifier.best(versions)
+    return None
+
+# -----------------------------------------------------------
+# AST ENGINE ------------------------------------------------
+# -----------------------------------------------------------
+
+def dotted_name(node):
+    '''
+    returns 'a.b.c' for a Name/Attribute chain like a.b.c, None for anything else
+    '''
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return '.'.join(reversed(parts))
+    return None
+
+class UsageVisitor(ast.NodeVisitor):
+    '''
+    Walks a module in source order and records which lines use each library. Imports,
+    aliases and from-imports bind names to libraries, and an assignment whose value uses
+    a library binds its targets too (rebinding a name to something else unbinds it).
+    Branches of an if, try or match are each followed from the bindings before it, and a
+    name stays bound afterwards to whatever any branch bound it to, so a fallback like
+    `except ImportError: np = None` doesn't hide the uses of np. Names are tracked per
+    module, not per function scope.
+    '''
+    def __init__(self,libraries):
+        self.libraries = set(libraries)
+        self.bound = {}
+        self.linenums = {library: set() for library in libraries}
+        self.using = []
+    
+    def bind(self,name,libraries):
+        if libraries:
+            self.bound[name] = set(libraries)
+        else:
+            self.bound.pop(name,None)
+    
+    def record(self,node):
+        libraries = self.bound.get(dotted_name(node) or '',())
+        for library in libraries:
+            self.linenums[library].add(node.lineno)
+        if self.using:
+            self.using[-1].update(libraries)
+    
+    def visit_and_collect(self,node):
+        '''
+        visits node and returns the set of libraries used anywhere inside it
+        '''
+        self.using.append(set())
+        self.visit(node)
+        used = self.using.pop()
+        if self.using:
+            self.using[-1].update(used)
+        return used
+    
+    def bind_targets(self,target,libraries):
+        if isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self.bind_targets(element,libraries)
+        elif isinstance(target, ast.Starred):
+            self.bind_targets(target.value,libraries)
+        elif dotted_name(target):
+            self.bind(dotted_name(target),libraries)
+    
+    def visit_branches(self,branches):
+        '''
+        visits each branch (a list of statements) from the bindings before them all, then
+        keeps every binding any of the branches made
+        '''
+        before = self.bound
+        merged = {}
+        for branch in branches:
+            self.bound = dict(before)
+            for child in branch:
+                self.visit(child)
+            for name, libraries in self.bound.items():
+                merged[name] = merged.get(name,set()) | libraries
+        self.bound = merged
+    
+    def visit_If(self,node):
+        self.visit(node.test)
+        self.visit_branches([node.body,node.orelse])
+    
+    def visit_Try(self,node):
+        for handler in node.handlers:
+            if handler.type:
+                self.visit(handler.type)
+        self.visit_branches([node.body + node.orelse] + [handler.body for handler in node.handlers])
+        for child in node.finalbody:
+            self.visit(child)
+    
+    visit_TryStar = visit_Try
     
-    scales = {
+    def visit_Match(self,node):
+        self.visit(node.subject)
+        for case in node.cases:
+            self.visit(case.pattern)
+            if case.guard:
+                self.visit(case.guard)
+        self.visit_branches([[]] + [case.body for case in node.cases])
+    
+    def visit_Import(self,node):
+        for alias in node.names:
+            library = alias.name.split('.')[0]
+            if library in self.libraries:
+                self.bind(alias.asname or library,[library])
+    
+    def visit_ImportFrom(self,node):
+        if node.level or not node.module:
+            return
+        library = node.module.split('.')[0]
+        if library in self.libraries:
+            for alias in node.names:
+                if alias.name != '*':
+                    self.bind(alias.asname or alias.name,[library])
+    
+    def visit_Name(self,node):
+        # assigning to a name only rebinds it (see visit_Assign), it doesn't use the library
+        if not isinstance(node.ctx, ast.Store):
+            self.record(node)
+    
+    def visit_Attribute(self,node):
+        if not isinstance(node.ctx, ast.Store):
+            self.record(node)
+        self.generic_visit(node)
+    
+    def visit_Assign(self,node):
+        used = self.visit_and_collect(node.value)
+        for target in node.targets:
+            self.visit(target)
+            self.bind_targets(target,used)
+    
+    def visit_AnnAssign(self,node):
+        self.visit(node.annotation)
+        if node.value:
+            used = self.visit_and_collect(node.value)
+            self.visit(node.target)
+            self.bind_targets(node.target,used)
+    
+    def visit_AugAssign(self,node):
+        used = self.visit_and_collect(node.value)
+        self.visit(node.target)
+        self.record(node.target)
+        if used:
+            self.bind_targets(node.target,used | self.bound.get(dotted_name(node.target) or '',set()))
+    
+    def visit_NamedExpr(self,node):
+        self.bind_targets(node.target,self.visit_and_collect(node.value))
+    
+    def visit_For(self,node):
+        self.bind_targets(node.target,self.visit_and_collect(node.iter))
+        for child in node.body + node.orelse:
+            self.visit(child)
+    
+    visit_AsyncFor = visit_For
+    
+    def visit_withitem(self,node):
+        used = self.visit_and_collect(node.context_expr)
+        if node.optional_vars:
+            self.bind_targets(node.optional_vars,used)
+
+def parse_file(filepath,data=None):
+    '''
+    returns (ast tree, list of source lines), or (None, None) if the file isn't valid python
+    '''
+    if data is None:
+        data = read_file_bytes(filepath)
+    try:
+        tree = ast.parse(data,filepath)
+    except (SyntaxError, ValueError):
+        return None, None
+    encoding = source_encoding(data)
+    return tree, [decode_line(line,encoding) for line in data.splitlines(keepends=True)]
+
+def check_file_for_libraries_ast(filepath,libraries,with_text=True):
+    '''
+    AST engine version of check_file_for_libraries: same inputs and outputs, but imports,
+    aliases and variables are resolved from the parsed module instead of line substrings.
+    Files that don't mention any of the libraries aren't parsed at all, and files that 
+    don't parse fall back to the line engine.
+    '''
+    results = {}
+    for library in libraries:
+        results[library] = empty_file_result(with_text)
+    with open_source(filepath) as source:
+        present = libraries_in_source(source,libraries)
+        if len(present) == 0:
+            return results
+        data = bytes(source)
+    tree, lines = parse_file(filepath,data)
+    if tree is None:
+        return check_file_for_libraries(filepath,libraries,with_text,data)
+    visitor = UsageVisitor(present)
+    visitor.visit(tree)
+    for library in present:
+        linenums = sorted(visitor.linenums[library])
+        results[library]['linenums'] = linenums
+        if with_text:
+            results[library]['linetext'] = [lines[i - 1] for i in linenums]
+    return results
+
+def check_file_for_imports_ast(file):
+    '''
+    AST engine version of check_file_for_imports: returns the top level name of every 
+    absolute import in the file, in source order
+    '''
+    with open_source(file) as data:
+        if data.find(b'import') == -1:
+            return []
+        data = bytes(data)
+    tree, lines = parse_file(file,data)
+    if tree is None:
+        return check_file_for_imports(file)
+    libraries = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            libraries += [(node.lineno, alias.name.split('.')[0]) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            libraries.append((node.lineno, node.module.split('.')[0]))
+    return [library for lineno, library in sorted(libraries,key=lambda item: item[0])]
+
+ENGINES = {
+    'line': {'libraries': check_file_for_libraries, 'imports': check_file_for_imports},
+    'ast': {'libraries': check_file_for_libraries_ast, 'imports': check_file_for_imports_ast},
+}
+
+# -----------------------------------------------------------
+# SCANNING --------------------------------------------------
+# -----------------------------------------------------------
+
+def empty_scales():
+    return {
         "major": {
             "count":0,
             "libraries":[],
@@ -351,159 +2505,766 @@ def main():
             "libraries":[],
         }
     }
+
+class Scan:
+    '''
+    Result of one Scanner.scan. 
+    
+    mode      => 'requirements', 'imports' or 'library'
+    directory => the directory that was scanned
+    libraries => one record per library, in report order: 
+                 {'library', 'affected':[FileHits, ...]}
+                 plus 'source' ('pypi','local','other' or 'unknown') in requirements and imports mode,
+                 and 'current_version', 'latest_version', 'scale' in requirements mode
+    scales    => {'major'|'minor'|'micro' : {'count','libraries'}} in requirements mode, else None
+    message   => why nothing was scanned (e.g. no requirements file), else None
+    '''
+    def __init__(self,mode,directory,libraries=None,scales=None,message=None):
+        self.mode = mode
+        self.directory = directory
+        self.libraries = libraries or []
+        self.scales = scales
+        self.message = message
     
-    report_summary = ""
-    report_body = ""
+    def __repr__(self):
+        return f"Scan(mode={self.mode!r}, directory={self.directory!r}, libraries={len(self.libraries)})"
     
-    if args.library and args.imports:
-        print("--library and --imports flags cannot be used in the same report. Instead, please run thaw with one flag and then rerun with the other.")
-    elif args.imports:
-        libraries = search_directory_for_imports(args.directory)
-        affected_by_libraries = {}
+    def library(self,name):
+        '''
+        returns the record for library name, or None if it isn't in the scan
+        '''
+        for record in self.libraries:
+            if record['library'] == name:
+                return record
+        return None
+    
+    @property
+    def outdated(self):
+        '''
+        records of libraries with a newer version available (requirements mode)
+        '''
+        return [record for record in self.libraries if record.get('scale')]
+    
+    def write(self,writer,report_format='text',verbose=False):
+        '''
+        writes the scan to a ReportWriter in report_format ('text', 'json' or 'jsonl')
+        '''
+        REPORT_FORMATS[report_format](writer,self,verbose)
+    
+    def changed_since(self,previous):
+        '''
+        returns a Scan of only the libraries whose records differ from those in previous
+        (new libraries included), with scales counted over just those libraries
+        '''
+        before = {record['library']: record for record in previous.libraries}
+        records = [record for record in self.libraries if before.get(record['library']) != record]
+        scales = None
+        if self.scales is not None:
+            scales = empty_scales()
+            for record in records:
+                if record['scale']:
+                    scales[record['scale']]['count'] += 1
+                    scales[record['scale']]['libraries'].append(record['library'])
+        return Scan(self.mode,self.directory,records,scales,self.message)
+
+class Scanner:
+    '''
+    Runs scans and keeps their state between calls, so a long-running caller pays for
+    index lookups and (with incremental) unchanged files only once: the MetadataCache and 
+    each project's FileResultCache are loaded on first use and reused by every later scan,
+    as is the pool of worker processes (see WorkerPool) once a project needs one. close()
+    stops the workers; a Scanner can also be used as a context manager.
+    
+    index_url, jobs, engine, incremental => as the matching command line flags
+    cache                                => MetadataCache to use (one in the user cache
+                                            directory by default)
+    keep_results                         => without incremental, still keep each file's
+                                            results in memory between scans (for --watch)
+    exclude                              => globs of files and directories to skip, as --exclude
+    policy                               => NetworkPolicy for index lookups (the defaults if
+                                            not given)
+    '''
+    def __init__(self,index_url=PYPI_URL,jobs=None,engine='line',incremental=False,cache=None,keep_results=False,exclude=(),policy=None):
+        if engine not in ENGINES:
+            raise WrongAssumptionError('Scanner',f"engine '{engine}' is not one of {sorted(ENGINES)}")
+        self.index_url = index_url
+        self.jobs = jobs or os.cpu_count()
+        self.engine = engine
+        self.incremental = incremental
+        self.keep_results = keep_results
+        self.exclude = list(exclude)
+        self.cache = cache or MetadataCache()
+        self.policy = policy or NetworkPolicy()
+        self.file_caches = {}
+        self.manifests = {}
+        self.pool = WorkerPool(self.jobs)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc_info):
+        self.close()
+    
+    def close(self):
+        '''
+        stops the worker processes, if any were started; a later scan starts them again
+        '''
+        self.pool.close()
+    
+    def file_cache(self,directory):
+        if not (self.incremental or self.keep_results):
+            return None
+        key = os.path.abspath(directory)
+        if key not in self.file_caches:
+            self.file_caches[key] = FileResultCache(directory,engine=self.engine,persist=self.incremental)
+        return self.file_caches[key]
+    
+    def manifest(self,directory):
+        '''
+        returns the Manifest of directory, reusing the one from the last scan (or with 
+        incremental, the last run) if the project's directories haven't changed since
+        '''
+        key = os.path.abspath(directory)
+        manifest = self.manifests.get(key)
+        if manifest is None or not manifest.is_current():
+            manifest = load_manifest(directory,self.exclude,manifest_path(directory,self.exclude) if self.incremental else None)
+            self.manifests[key] = manifest
+        return manifest
+    
+    def save(self):
+        '''
+        writes the metadata cache and any file caches back to disk
+        '''
+        self.cache.save()
+        for file_cache in self.file_caches.values():
+            file_cache.save()
+    
+    def scan(self,directory,mode=None,libraries=None):
+        '''
+        scans directory and returns a Scan; caches are saved afterwards.
+        mode      => 'requirements' (outdated libraries from the dependency files, see 
+                     find_dependency_files), 'imports' 
+                     (every imported library) or 'library' (the given libraries). Defaults to
+                     'library' when libraries are given, 'requirements' otherwise.
+        '''
+        if mode is None:
+            mode = 'library' if libraries else 'requirements'
+        if mode not in ['requirements','imports','library']:
+            raise WrongAssumptionError('Scanner.scan',f"mode '{mode}' is not one of 'requirements', 'imports' or 'library'")
+        with stats_phase('walk'):
+            manifest = self.manifest(directory)
+        file_cache = self.file_cache(directory)
+        if mode == 'imports':
+            result = self.scan_imports(directory,manifest,file_cache)
+        elif mode == 'library':
+            result = self.scan_libraries(directory,manifest,file_cache,libraries or [])
+        else:
+            result = self.scan_requirements(directory,manifest,file_cache)
+        with stats_phase('save'):
+            self.save()
+        return result
+    
+    def scan_imports(self,directory,manifest,file_cache):
+        with stats_phase('imports'):
+            libraries = search_directory_for_imports(directory,self.jobs,manifest.files,file_cache,self.engine,self.pool)
         libraries.sort()
+        with stats_phase('lookups'):
+            resolved = resolve_libraries(libraries,directory,self.index_url,cache=self.cache,local_modules=manifest.modules,policy=self.policy)
+        with stats_phase('scan'):
+            affected_by_libraries = search_directory_for_libraries(directory,libraries,self.jobs,manifest.files,file_cache,self.engine,self.pool)
+        records = []
         for lib in libraries:
-            affected_by_libraries[lib] = search_directory_for_library(args.directory,lib)
-            source = get_library_source(lib,args.directory)
-            symbol = {'pypi':'*','local':'+','other':' '}
-            report_summary += f"\t{symbol[source]}{lib:<40} | {len(affected_by_libraries[lib])} files affected\n"
-            report_body += f"\n{lib}"
-            report_body += write_report_segment(args.directory,affected_by_libraries[lib],args.verbose)
-    elif args.library:
-        affected_by_libraries = {}
-        report_summary += '\n'
-        for lib in args.library:
-            affected_by_libraries[lib] = search_directory_for_library(args.directory,lib)
-            report_summary += f"\t{lib:<40} | {len(affected_by_libraries[lib])} files affected\n"
-            report_body += f"\n{lib}"
-            report_body += write_report_segment(args.directory,affected_by_libraries[lib],args.verbose)
+            records.append({'library':lib,'source':resolved[lib]['source'],'affected':affected_by_libraries[lib]})
+        return Scan('imports',directory,records)
+    
+    def scan_libraries(self,directory,manifest,file_cache,libraries):
+        with stats_phase('scan'):
+            affected_by_libraries = search_directory_for_libraries(directory,libraries,self.jobs,manifest.files,file_cache,self.engine,self.pool)
+        records = []
+        for lib in libraries:
+            records.append({'library':lib,'affected':affected_by_libraries[lib]})
+        return Scan('library',directory,records)
+    
+    def scan_requirements(self,directory,manifest,file_cache):
+        dependency_files = find_dependency_files(directory)
+        if len(dependency_files) == 0:
+            return Scan('requirements',directory,message="No requirements file found - please double check that you are entering the top level of your project, or try using the --imports flag if your project has no requirements file.")
+        
+        scales = empty_scales()
+        libraries = collect_dependencies(dependency_files)
+        with stats_phase('lookups'):
+            resolved = resolve_libraries([item['library'] for item in libraries if not item['url']],directory,self.index_url,cache=self.cache,local_modules=manifest.modules,policy=self.policy,with_versions=True)
+        records = []
+        for item in libraries:
+            library = item['library']
+            # libraries installed from a VCS or URL aren't looked up on the index
+            metadata = resolved.get(library) or {'source':'other','version':None}
+            current_version = pinned_version(item['specifier'],metadata.get('versions'))
+            if metadata['source'] == 'pypi' and current_version:
+                latest_version = metadata['version']
+            else:
+                latest_version = None
+               
+            scale = None
+            if latest_version:
+                scale = version_update_scale(current_version,latest_version)
+                if scale:
+                    scales[scale]["count"] += 1
+                    scales[scale]["libraries"].append(library)
+            records.append({'library':library,'source':metadata['source'],'current_version':current_version,'latest_version':latest_version,'scale':scale,'affected':[]})
+        
+        outdated_libraries = [record['library'] for record in records if record['scale']]
+        with stats_phase('scan'):
+            affected_by_outdated_libraries = search_directory_for_libraries(directory,outdated_libraries,self.jobs,manifest.files,file_cache,self.engine,self.pool)
+        for record in records:
+            if record['scale']:
+                record['affected'] = affected_by_outdated_libraries[record['library']]
+        return Scan('requirements',directory,records,scales)
+
+_default_scanner = None
+
+def scan(directory,mode=None,libraries=None):
+    '''
+    scans directory with a module-wide Scanner (created on first use, so its caches are
+    shared by every call) and returns a Scan; see Scanner.scan for mode and libraries
+    '''
+    global _default_scanner
+    if _default_scanner is None:
+        _default_scanner = Scanner()
+    return _default_scanner.scan(directory,mode,libraries)
+
+# -----------------------------------------------------------
+
+class ProjectWatcher:
+    '''
+    Polls directory for changes to .py and dependency files by comparing each file's
+    mtime and size against the previous poll. Needs nothing beyond the standard library, 
+    and a poll only stats files, so it stays fast on large projects.
+    '''
+    def __init__(self,directory,exclude=()):
+        self.directory = directory
+        self.exclude = exclude
+        self.snapshot = self.take_snapshot()
+    
+    def take_snapshot(self):
+        '''
+        returns {filepath : (mtime in ns, size)} for every watched file
+        '''
+        snapshot = {}
+        for root, files in walk_project(self.directory,self.exclude):
+            for entry in files:
+                if entry.name.endswith('.py') or is_dependency_file(root + '/' + entry.name):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[root + '/' + entry.name] = (stat.st_mtime_ns,stat.st_size)
+        return snapshot
+    
+    def poll(self):
+        '''
+        returns sorted list of files added, changed or removed since the last poll
+        '''
+        snapshot = self.take_snapshot()
+        changed = [filepath for filepath in set(snapshot) | set(self.snapshot) if snapshot.get(filepath) != self.snapshot.get(filepath)]
+        self.snapshot = snapshot
+        return sorted(changed)
+
+def watch_directory(scanner,previous,writer,report_format='text',verbose=False,interval=WATCH_INTERVAL,polls=None):
+    '''
+    watches previous.directory and, whenever watched files change, scans it again with 
+    scanner (which reanalyzes only changed files when it keeps results) and writes the
+    report sections of libraries whose results changed. Runs until interrupted, or for 
+    `polls` polls.
+    '''
+    watcher = ProjectWatcher(previous.directory,scanner.exclude)
+    libraries = None
+    if previous.mode == 'library':
+        libraries = [record['library'] for record in previous.libraries]
+    n = 0
+    while polls is None or n < polls:
+        n += 1
+        time.sleep(interval)
+        changed = watcher.poll()
+        if len(changed) == 0:
+            continue
+        current = scanner.scan(previous.directory,previous.mode,libraries)
+        update = current.changed_since(previous)
+        if report_format == 'text':
+            writer.write(f"\n\nTHAW UPDATE {dt.now().strftime('%m/%d/%y %H:%M:%S')} - {len(changed)} files changed\n")
+            if update.message:
+                writer.write(update.message)
+            elif len(update.libraries) == 0:
+                writer.write("No changes to the report")
+        elif update.message:
+            write_message(writer,update.message,report_format)
+        if len(update.libraries) > 0:
+            update.write(writer,report_format,verbose)
+        writer.flush()
+        previous = current
+
+# -----------------------------------------------------------
+# REPORT BUILDING -------------------------------------------
+# -----------------------------------------------------------
+
+class ReportWriter:
+    '''
+    Streams the report to stdout and, if out is given, to a timestamped report file in
+    that directory as each piece is produced, rather than building the whole report in
+    memory first. The file is written through a large buffer. With echo=False the report
+    only goes to the file.
+    
+    Text reports are written in two parts: the summary, then (after end_summary) the body.
+    json/jsonl reports are written as-is, with no header or spacing added.
+    '''
+    def __init__(self,out=None,stdout=None,report_format='text',echo=True):
+        self.stdout = (stdout or sys.stdout) if echo else None
+        self.report_format = report_format
+        self.log = None
+        self.path = None
+        if out:
+            now = dt.now()
+            extension = {'text':'txt'}.get(report_format,report_format)
+            report_title = f"thaw_report_{now.strftime('%m%d%y_%H%M%S')}.{extension}"
+            self.path = os.path.join(out,report_title)
+            self.log = open(self.path,'w',buffering=REPORT_BUFFER_SIZE)
+            if report_format == 'text':
+                self.log.write(f"THAW REPORT RUN {now.strftime('%m/%d/%y %H:%M:%S')}")
+                self.log.write('\n')
+    
+    def write(self,text):
+        if self.stdout:
+            self.stdout.write(text)
+        if self.log:
+            self.log.write(text)
+    
+    def end_summary(self):
+        if self.report_format == 'text':
+            if self.stdout:
+                self.stdout.write('\n\n\n')
+            if self.log:
+                self.log.write('\n')
+    
+    def flush(self):
+        if self.stdout:
+            self.stdout.flush()
+        if self.log:
+            self.log.flush()
+    
+    def close(self):
+        if self.stdout:
+            if self.report_format == 'text':
+                self.stdout.write('\n\n\n')
+            self.stdout.flush()
+        if self.log:
+            self.log.close()
+
+# -----------------------------------------------------------
+
+def iter_report_segment(directory,affected_by_outdated_library_dict,verbose):
+    '''
+    yields the report lines for one library's affected files one at a time
+    '''
+    cutoff = len(directory) + 1
+    for affected in affected_by_outdated_library_dict:
+        yield f"\n\t{affected['file'][cutoff:]}"
+        if verbose:
+            lines = affected['lines']
+            linestext = affected['linestext']
+            for i in range(0,len(lines)):
+                yield f"\n\t\t{lines[i]:<10} | {linestext[i]}"
+        else:
+            yield f"\n\t\t{affected['lines']}"
+
+def write_report_segment(directory,affected_by_outdated_library_dict,verbose):
+    return ''.join(iter_report_segment(directory,affected_by_outdated_library_dict,verbose))
+
+def stream_report_segment(writer,directory,affected_by_outdated_library_dict,verbose):
+    for piece in iter_report_segment(directory,affected_by_outdated_library_dict,verbose):
+        writer.write(piece)
+
+# -----------------------------------------------------------
+
+def iter_report_segments_for_scales(scales_dict,affected_by_outdated_libraries,directory,verbose):
+    if len(scales_dict['libraries']) > 0:
+        for lib in scales_dict['libraries']:
+            yield f"\n[ ]{lib}"
+            yield from iter_report_segment(directory,affected_by_outdated_libraries[lib],verbose)
+    else:
+        yield "\nNone"
+
+def write_report_segments_for_scales(scales_dict,affected_by_outdated_libraries,directory,verbose):
+    return ''.join(iter_report_segments_for_scales(scales_dict,affected_by_outdated_libraries,directory,verbose))
+
+
+# -----------------------------------------------------------
+
+def write_text_report(writer,scan,verbose):
+    '''
+    writes scan in thaw's plain text layout
+    '''
+    directory = scan.directory
+    if scan.mode == 'imports':
+        symbol = {'pypi':'*','local':'+','other':' ','unknown':'?'}
+        for record in scan.libraries:
+            writer.write(f"\t{symbol[record['source']]}{record['library']:<40} | {len(record['affected'])} files affected\n")
+        writer.end_summary()
+        for record in scan.libraries:
+            writer.write(f"\n{record['library']}")
+            stream_report_segment(writer,directory,record['affected'],verbose)
+    elif scan.mode == 'library':
+        writer.write('\n')
+        for record in scan.libraries:
+            writer.write(f"\t{record['library']:<40} | {len(record['affected'])} files affected\n")
+        writer.end_summary()
+        for record in scan.libraries:
+            writer.write(f"\n{record['library']}")
+            stream_report_segment(writer,directory,record['affected'],verbose)
     else:
-        requirements_file = None
-        for item in os.listdir(args.directory):
-            if fnmatch.fnmatch(item,'requirements*.txt'):
-                requirements_file = os.path.join(args.directory,item)
+        scales = scan.scales
+        affected_by_outdated_libraries = {}
+        for record in scan.libraries:
+            if record['scale']:
+                version_change = record['current_version'] + ' >> ' + record['latest_version']
+                writer.write(f"\t*{record['library']:<40} | {version_change:<20} | {len(record['affected'])} files affected\n")
+                affected_by_outdated_libraries[record['library']] = record['affected']
+            elif record['latest_version']:
+                writer.write(f"\t{record['library']:<41} | {record['current_version']}, no update needed\n")
+            elif record['source'] == 'unknown':
+                writer.write(f"\t?{record['library']:<40} | unknown (index unreachable)\n")
+        writer.end_summary()
         
-        if requirements_file:
-            libraries = get_libraries_and_versions_from_requirements(requirements_file)
-            affected_by_outdated_libraries = {}            
-            for item in libraries:
-                library = item['library']
-                current_version = item['version']
-                source = get_library_source(library,args.directory)
-                if source == 'pypi' and current_version:
-                    latest_version = get_latest_version(library)
-                else:
-                    latest_version = None
-                   
-                if latest_version:
-                    scale = version_update_scale(current_version,latest_version)
-                    if scale:
-                        scales[scale]["count"] += 1
-                        scales[scale]["libraries"].append(library)
-                        affected_by_outdated_libraries[library] = search_directory_for_library(args.directory,library)
-                        version_change = current_version + ' >> ' + latest_version
-                        report_summary += f"\t*{library:<40} | {version_change:<20} | {len(affected_by_outdated_libraries[library])} files affected\n"
-                    else:
-                        report_summary += f"\t{library:<41} | {current_version}, no update needed\n"
-            major = scales['major']['count']
-            minor = scales['minor']['count']
-            micro = scales['micro']['count']
-            report_body += f"{major + minor + micro} total updates: "
-            report_body += f"{major} MAJOR updates, "
-            report_body += f"{minor} MINOR updates, "
-            report_body += f"{micro} MICRO updates\n"
-            
-            report_body += '\nMajor updates:'
-            if len(scales['major']['libraries']) > 0:
-                for lib in scales['major']['libraries']:
-                    report_body += f"\n[ ]{lib}"
-                    report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose)
+        major = scales['major']['count']
+        minor = scales['minor']['count']
+        micro = scales['micro']['count']
+        writer.write(f"{major + minor + micro} total updates: ")
+        writer.write(f"{major} MAJOR updates, ")
+        writer.write(f"{minor} MINOR updates, ")
+        writer.write(f"{micro} MICRO updates\n")
+        
+        writer.write('\nMajor updates:')
+        for piece in iter_report_segments_for_scales(scales['major'],affected_by_outdated_libraries,directory,verbose):
+            writer.write(piece)
+        writer.write('\n\nMinor updates:')
+        for piece in iter_report_segments_for_scales(scales['minor'],affected_by_outdated_libraries,directory,verbose):
+            writer.write(piece)
+        writer.write('\n\nMicro updates:')
+        for piece in iter_report_segments_for_scales(scales['micro'],affected_by_outdated_libraries,directory,verbose):
+            writer.write(piece)
+
+def library_record_fields(record):
+    '''
+    the fields of a report library record that go into json/jsonl output, minus affected files
+    '''
+    fields = {'library': record['library']}
+    for key in ['source','current_version','latest_version','scale']:
+        if key in record:
+            fields[key] = record[key]
+    fields['files_affected'] = len(record['affected'])
+    return fields
+
+def file_record_fields(directory,affected,verbose):
+    fields = {'file': affected['file'][len(directory) + 1:], 'lines': list(affected['lines'])}
+    if verbose:
+        fields['linestext'] = list(affected['linestext'])
+    return fields
+
+def write_json_report(writer,scan,verbose):
+    '''
+    writes scan as one json document; line text is only included with verbose
+    '''
+    directory = scan.directory
+    document = {'mode': scan.mode, 'libraries': []}
+    for record in scan.libraries:
+        fields = library_record_fields(record)
+        fields['files'] = [file_record_fields(directory,affected,verbose) for affected in record['affected']]
+        document['libraries'].append(fields)
+    if scan.scales:
+        document['scales'] = scan.scales
+    for chunk in json.JSONEncoder(indent=2).iterencode(document):
+        writer.write(chunk)
+    writer.write('\n')
+
+def write_jsonl_report(writer,scan,verbose):
+    '''
+    writes scan as json lines: a "library" record for each library followed by a "file" 
+    record for each file it affects, then a closing "summary" record with the scale buckets
+    (requirements mode only). Each line can be processed on its own.
+    '''
+    directory = scan.directory
+    for record in scan.libraries:
+        writer.write(json.dumps(dict({'type':'library'},**library_record_fields(record))) + '\n')
+        for affected in record['affected']:
+            writer.write(json.dumps(dict({'type':'file','library':record['library']},**file_record_fields(directory,affected,verbose))) + '\n')
+    if scan.scales:
+        writer.write(json.dumps({'type':'summary','scales':scan.scales}) + '\n')
+
+def write_message(writer,message,report_format='text'):
+    '''
+    writes a message in place of a report (e.g. no requirements file was found): printed as
+    is for text, otherwise as a json document or jsonl record with a "message" field, so the
+    output stays parseable
+    '''
+    if report_format == 'json':
+        writer.write(json.dumps({'message':message},indent=2) + '\n')
+    elif report_format == 'jsonl':
+        writer.write(json.dumps({'type':'message','message':message}) + '\n')
+    else:
+        print(message)
+        writer.end_summary()
+
+REPORT_FORMATS = {
+    'text': write_text_report,
+    'json': write_json_report,
+    'jsonl': write_jsonl_report,
+}
+
+
+# -----------------------------------------------------------
+# MAIN ------------------------------------------------------
+# -----------------------------------------------------------
+
+def fill_default_args(parser,args):
+    '''
+    sets any flag missing from args (e.g. a Namespace built by hand) to the parser's default
+    '''
+    for action in parser._actions:
+        if action.dest != 'help' and not hasattr(args,action.dest):
+            setattr(args,action.dest,action.default)
+    return args
+
+
+def add_scan_arguments(parser):
+    '''
+    adds the flags thaw and thaw-batch share: how versions are looked up and how files are scanned
+    '''
+    parser.add_argument('--index-url',action="store",default=PYPI_URL,help=f"Base URL of the package index to look up latest versions on (defaults to {PYPI_URL}). Also takes a simple index URL, or a local wheelhouse or simple-index directory.")
+    parser.add_argument('--refresh',action="store_true",help="Ignore cached package versions and look every library up again.")
+    parser.add_argument('--offline',action="store_true",help="Don't contact the package index; only use cached package versions.")
+    parser.add_argument('--cache-ttl',action="store",type=int,default=CACHE_TTL,help=f"Seconds that cached package versions stay fresh (defaults to {CACHE_TTL}).")
+    parser.add_argument('--timeout',action="store",type=float,default=REQUEST_TIMEOUT,help=f"Seconds to wait on any one request to the package index (defaults to {REQUEST_TIMEOUT}).")
+    parser.add_argument('--deadline',action="store",type=float,default=LOOKUP_DEADLINE,help=f"Seconds all version lookups may take together; libraries not looked up by then are reported as unknown (defaults to {LOOKUP_DEADLINE}).")
+    parser.add_argument('--retries',action="store",type=int,default=LOOKUP_RETRIES,help=f"Times to retry a request that failed or timed out (defaults to {LOOKUP_RETRIES}). After {BREAKER_THRESHOLD} failures in a row the index is left alone and the remaining libraries are reported as unknown.")
+    parser.add_argument('--incremental',action="store_true",help="Reuse results from the last run for files that haven't changed since.")
+    parser.add_argument('--engine',action="store",choices=sorted(ENGINES),default='line',help="How files are analyzed: 'line' matches library names line by line, 'ast' parses each file and resolves imports and variables exactly (defaults to line).")
+    parser.add_argument('-e','--exclude',action="store",nargs='*',default=[],metavar='GLOB',help="Skip files and directories matching these globs (.gitignore syntax, relative to each project). Version control, virtualenv, build and cache directories and anything in .gitignore are always skipped.")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Identify outdated libraries in your project dependencies and where they're used.")
+    parser.add_argument('directory',action="store",help="Top level of project directory on which to run report.")
+    parser.add_argument('-o','--out',action="store",help="Write thaw report file to specified file path; thaw will write timestamped .txt report file.")
+    parser.add_argument('-v','--verbose',action="store_true",help="Include content of lines affected by out-of-date libraries (only line numbers will be written otherwise).")
+    parser.add_argument('-l','--library',action="store",nargs='*',help="Search for instances of specified libraries instead of all outdated libraries.")
+    parser.add_argument('-i','--imports',action="store_true",help="Check import statements in files instead of requirements.txt.")
+    parser.add_argument('-j','--jobs',action="store",type=int,default=os.cpu_count(),help="Number of processes to scan files with (defaults to the number of CPUs).")
+    add_scan_arguments(parser)
+    parser.add_argument('-w','--watch',action="store_true",help="Keep running and report again whenever .py or requirements files in the project change, rescanning only the files that changed.")
+    parser.add_argument('--stats',action="store_true",help="Print time, files and bytes read, network requests, cache hits/misses and peak resident memory for each phase of the run to stderr.")
+    parser.add_argument('--profile',action="store",metavar="PATH",help="Write cProfile data for the scan to PATH (view it with pstats or snakeviz; use --jobs 1 to include file scanning).")
+    parser.add_argument('-f','--format',action="store",choices=sorted(REPORT_FORMATS),default='text',help="Report format: the plain text report (default), one json document, or json lines with one record per library and per affected file.")
+    args = fill_default_args(parser,parser.parse_args())
+    
+    writer = ReportWriter(args.out,report_format=args.format)
+    if args.library and args.imports:
+        write_message(writer,"--library and --imports flags cannot be used in the same report. Instead, please run thaw with one flag and then rerun with the other.",args.format)
+        writer.close()
+        return
+    
+    stats = Stats() if args.stats else None
+    profiler = cProfile.Profile() if args.profile else None
+    with contextlib.ExitStack() as instrumentation:
+        if stats:
+            instrumentation.enter_context(collect_stats(stats))
+        with stats_phase('load'):
+            cache = MetadataCache(ttl=args.cache_ttl,refresh=args.refresh,offline=args.offline)
+        policy = NetworkPolicy(args.timeout,args.deadline,args.retries)
+        scanner = instrumentation.enter_context(Scanner(args.index_url,args.jobs,args.engine,args.incremental,cache,keep_results=args.watch,exclude=args.exclude,policy=policy))
+        if profiler:
+            profiler.enable()
+        if args.imports:
+            result = scanner.scan(args.directory,'imports')
+        elif args.library:
+            result = scanner.scan(args.directory,'library',args.library)
+        else:
+            result = scanner.scan(args.directory,'requirements')
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if policy.skipped:
+            sys.stderr.write(f"thaw: couldn't reach {args.index_url}; {policy.skipped} libraries are reported as unknown\n")
+        
+        with stats_phase('report'):
+            if result.message:
+                write_message(writer,result.message,args.format)
             else:
-                report_body += "\nNone"
-            
-            report_body += '\n\nMinor updates:'
-            if len(scales['minor']['libraries']) > 0:
-                for lib in scales['minor']['libraries']:
-                    report_body += f"\n[ ]{lib}"
-                    report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose)            
-            else: 
-                report_body += "\nNone"
-            report_body += '\n\nMicro updates:'
-            if len(scales['micro']['libraries']) > 0:
-                for lib in scales['micro']['libraries']:
-                    report_body += f"\n[ ]{lib}"
-                    report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose) 
+                result.write(writer,args.format,args.verbose)
+        if args.watch:
+            writer.flush()
+            try:
+                watch_directory(scanner,result,writer,args.format,args.verbose)
+            except KeyboardInterrupt:
+                pass
+        writer.close()
+    if stats:
+        sys.stderr.write(stats.table())
+
+    
+# -----------------------------------------------------------
+# BATCH -----------------------------------------------------
+# -----------------------------------------------------------
+
+def read_projects_file(path):
+    '''
+    returns the project directories listed in path, one per line (blank lines and # comments
+    are skipped); relative paths are relative to the file's directory
+    '''
+    directories = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                directories.append(os.path.join(os.path.dirname(os.path.abspath(path)),os.path.expanduser(line)))
+    return directories
+
+def project_names(directories):
+    '''
+    returns a short unique name for each project directory (its folder name, numbered if taken)
+    '''
+    names = []
+    for directory in directories:
+        name = os.path.basename(os.path.abspath(directory)) or 'project'
+        candidate = name
+        n = 1
+        while candidate in names:
+            n += 1
+            candidate = f"{name}-{n}"
+        names.append(candidate)
+    return names
+
+def batch_scan(directories,cache=None,index_url=PYPI_URL,jobs=1,engine='line',incremental=False,exclude=(),workers=None,policy=None):
+    '''
+    Checks the requirements of several projects, sharing work between them: the union of
+    all their requirements (less each project's own modules) is looked up on the index once
+    (so a library used by every project costs one request), then the projects are scanned
+    in a pool of up to `workers` processes, each given a copy of the filled cache.
+    outputs: list of Scans, in the same order as directories
+    '''
+    cache = cache or MetadataCache()
+    policy = policy or NetworkPolicy()
+    union = {}
+    for directory in directories:
+        local_modules = index_project(directory,exclude)['modules']
+        for item in collect_dependencies(find_dependency_files(directory)):
+            if not item['url'] and item['library'] not in local_modules:
+                union.setdefault(normalize_name(item['library']),item['library'])
+    resolve_libraries(list(union.values()),None,index_url,cache=cache,local_modules=set(),policy=policy,with_versions=True)
+    # the lookups above were fresh, so the project scans can use them even with refresh
+    cache.refresh = False
+    cache.save()
+    
+    workers = min(workers or os.cpu_count() or 1,len(directories))
+    if workers <= 1:
+        with Scanner(index_url,jobs,engine,incremental,cache,exclude=exclude,policy=policy) as scanner:
+            return [scanner.scan(directory,'requirements') for directory in directories]
+    with ProcessPoolExecutor(max_workers=workers,initializer=start_batch_worker,initargs=(index_url,jobs,engine,incremental,cache,exclude,policy)) as executor:
+        return list(executor.map(scan_batch_project,directories))
+
+_batch_scanner = None
+
+def start_batch_worker(index_url,jobs,engine,incremental,cache,exclude,policy):
+    global _batch_scanner
+    _batch_scanner = Scanner(index_url,jobs,engine,incremental,cache,exclude=exclude,policy=policy)
+
+def scan_batch_project(directory):
+    # each project is scanned once, so its file workers aren't kept around for the next one
+    try:
+        return _batch_scanner.scan(directory,'requirements')
+    finally:
+        _batch_scanner.close()
+
+def batch_summary(names,scans,report_paths):
+    '''
+    returns the cross-project summary: which libraries are outdated in which projects
+    {'projects':[{'project','directory','report','message','libraries','outdated'}, ...],
+     'libraries':[{'library','latest_version','projects':[{'project','current_version','scale','files_affected'}, ...]}, ...]}
+    libraries are ordered by how many projects they're outdated in, most first
+    '''
+    projects = []
+    outdated = {}
+    for name, scan, report_path in zip(names,scans,report_paths):
+        projects.append({'project':name,'directory':scan.directory,'report':report_path,'message':scan.message,'libraries':len(scan.libraries),'outdated':len(scan.outdated)})
+        for record in scan.outdated:
+            library = outdated.setdefault(record['library'].lower(),{'library':record['library'],'latest_version':record['latest_version'],'projects':[]})
+            library['projects'].append({'project':name,'current_version':record['current_version'],'scale':record['scale'],'files_affected':len(record['affected'])})
+    libraries = sorted(outdated.values(),key=lambda library: (-len(library['projects']),library['library'].lower()))
+    return {'projects':projects,'libraries':libraries}
+
+def write_batch_summary(writer,summary,report_format='text'):
+    if report_format == 'json':
+        for chunk in json.JSONEncoder(indent=2).iterencode(summary):
+            writer.write(chunk)
+        writer.write('\n')
+    elif report_format == 'jsonl':
+        for project in summary['projects']:
+            writer.write(json.dumps(dict({'type':'project'},**project)) + '\n')
+        for library in summary['libraries']:
+            for project in library['projects']:
+                writer.write(json.dumps(dict({'type':'outdated','library':library['library'],'latest_version':library['latest_version']},**project)) + '\n')
+    else:
+        writer.write(f"{len(summary['projects'])} projects, {len(summary['libraries'])} outdated libraries\n")
+        for library in summary['libraries']:
+            writer.write(f"\t*{library['library']:<40} | {'latest ' + library['latest_version']:<20} | outdated in {len(library['projects'])} projects\n")
+            for project in library['projects']:
+                version_change = f"{project['current_version']} ({project['scale']})"
+                writer.write(f"\t\t{project['project']:<32} | {version_change:<20} | {project['files_affected']} files affected\n")
+        writer.end_summary()
+        writer.write('Projects:')
+        for project in summary['projects']:
+            if project['message']:
+                writer.write(f"\n\t{project['project']:<40} | {project['message'].split(' - ')[0]}")
             else:
-                report_body += "\nNone"
-            
-            # with open(os.path.join(args.directory,"requirements.txt")) as requirements:
-            #     affected_by_outdated_libraries = {}
- 
-            #     for line in requirements:
-            #         if "==" in line:
-            #             library, current_version = line.strip().split("==")
-            #             if '[' in library:
-            #                 library = library.split('[')[0]
-            #             latest_version = get_latest_version(library)
-            #             if latest_version:
-            #                 scale = version_update_scale(current_version,latest_version)
-            #                 if scale:
-            #                     scales[scale]["count"] += 1
-            #                     scales[scale]["libraries"].append(library)
-            #                     affected_by_outdated_libraries[library] = search_directory_for_library(args.directory,library)
-            #                     version_change = current_version + ' >> ' + latest_version
-            #                     report_summary += f"\t*{library:<40} | {version_change:<20} | {len(affected_by_outdated_libraries[library])} files affected\n"
-            #                 else:
-            #                     report_summary += f"\t{library:<41} | {current_version}, no update needed\n"
-            #         else:
-            #             report_summary += f'\t{line.strip():<41} | no version requirement\n'
-
-            #     major = scales['major']['count']
-            #     minor = scales['minor']['count']
-            #     micro = scales['micro']['count']
-            #     report_body += f"{major + minor + micro} total updates: "
-            #     report_body += f"{major} MAJOR updates, "
-            #     report_body += f"{minor} MINOR updates, "
-            #     report_body += f"{micro} MICRO updates\n"
-                
-            #     report_body += '\nMajor updates:'
-            #     if len(scales['major']['libraries']) > 0:
-            #         for lib in scales['major']['libraries']:
-            #             report_body += f"\n[ ]{lib}"
-            #             report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose)
-            #     else:
-            #         report_body += "\nNone"
-                
-            #     report_body += '\n\nMinor updates:'
-            #     if len(scales['minor']['libraries']) > 0:
-            #         for lib in scales['minor']['libraries']:
-            #             report_body += f"\n[ ]{lib}"
-            #             report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose)            
-            #     else: 
-            #         report_body += "\nNone"
-            #     report_body += '\n\nMicro updates:'
-            #     if len(scales['micro']['libraries']) > 0:
-            #         for lib in scales['micro']['libraries']:
-            #             report_body += f"\n[ ]{lib}"
-            #             report_body += write_report_segment(args.directory,affected_by_outdated_libraries[lib],args.verbose) 
-            
-        else:
-            print("No requirements file found - please double check that you are entering the top level of your project, or try using the --imports flag if your project has no requirements file.")
-    
-    if args.out:
-        now = dt.now()
-        report_title = f"thaw_report_{now.strftime('%m%d%y_%H%M%S')}.txt"
-        report_filename = os.path.join(args.out,report_title)
-        with open(report_filename,'w') as log:
-            log.write(f"THAW REPORT RUN {now.strftime('%m/%d/%y %H:%M:%S')}")
-            log.write('\n')
-            log.write(report_summary)
-            log.write('\n')
-            log.write(report_body)
-    print(report_summary)
-    print('\n')
-    print(report_body)
-    print('\n')
+                writer.write(f"\n\t{project['project']:<40} | {project['outdated']} of {project['libraries']} libraries outdated | {project['report']}")
 
+def batch_main():
+    parser = argparse.ArgumentParser(description="Run thaw over several projects at once, with one report per project and a combined summary.")
+    parser.add_argument('projects',action="store",nargs='*',help="Top level directories of the projects to report on.")
+    parser.add_argument('-p','--projects-file',action="store",help="File listing project directories, one per line.")
+    parser.add_argument('-o','--out',action="store",default='.',help="Directory to write reports to: each project's report goes in a folder named after it, and the summary at the top (defaults to the current directory).")
+    parser.add_argument('-v','--verbose',action="store_true",help="Include content of affected lines in the project reports.")
+    parser.add_argument('-j','--jobs',action="store",type=int,default=1,help="Number of processes to scan each project's files with (defaults to 1).")
+    parser.add_argument('--workers',action="store",type=int,help="Number of processes to scan projects in, one project each at a time (defaults to the number of CPUs).")
+    add_scan_arguments(parser)
+    parser.add_argument('-f','--format',action="store",choices=sorted(REPORT_FORMATS),default='text',help="Format of the project reports and the summary.")
+    args = fill_default_args(parser,parser.parse_args())
+    
+    directories = list(args.projects)
+    if args.projects_file:
+        directories += read_projects_file(args.projects_file)
+    if len(directories) == 0:
+        parser.error("no projects given - list project directories or use --projects-file")
     
+    cache = MetadataCache(ttl=args.cache_ttl,refresh=args.refresh,offline=args.offline)
+    policy = NetworkPolicy(args.timeout,args.deadline,args.retries)
+    scans = batch_scan(directories,cache,args.index_url,args.jobs,args.engine,args.incremental,args.exclude,args.workers,policy)
+    names = project_names(directories)
+    report_paths = []
+    for name, result in zip(names,scans):
+        if result.message:
+            report_paths.append(None)
+            continue
+        project_out = os.path.join(args.out,name)
+        os.makedirs(project_out,exist_ok=True)
+        writer = ReportWriter(project_out,report_format=args.format,echo=False)
+        result.write(writer,args.format,args.verbose)
+        writer.close()
+        report_paths.append(writer.path)
+    
+    writer = ReportWriter(args.out,report_format=args.format)
+    write_batch_summary(writer,batch_summary(names,scans,report_paths),args.format)
+    writer.close()
+
+
 if __name__ == "__main__":
     main()